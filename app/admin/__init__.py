@@ -1,6 +1,11 @@
+from pathlib import Path
+
 from sqladmin import Admin
 
+from app.admin.documents import DocumentsAdmin
+from app.admin.export import ExportAdmin
 from app.admin.notes import NoteAdmin, ItemNoteAdmin
+from app.admin.reports import ReportsAdmin
 from app.core.auth_admin import AdminAuth
 from app.core.config import settings
 
@@ -14,7 +19,11 @@ def init_admin(app, engine) -> None:
 		engine,
 		base_url="/admin",
 		title="Painel Administrativo",
-		authentication_backend=authentication_backend
+		authentication_backend=authentication_backend,
+		templates_dir=str(Path(__file__).parent / "templates"),
 	)
 	admin.add_view(NoteAdmin)
 	admin.add_view(ItemNoteAdmin)
+	admin.add_view(ReportsAdmin)
+	admin.add_view(ExportAdmin)
+	admin.add_view(DocumentsAdmin)
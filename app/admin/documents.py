@@ -0,0 +1,38 @@
+from fastapi import Request
+from sqladmin import BaseView, expose
+from starlette.responses import FileResponse, RedirectResponse, Response
+
+from app.db.session import AsyncSessionLocal
+from app.db.storage import document_storage
+from app.models import Note
+
+
+class DocumentsAdmin(BaseView):
+	"""Download do PDF original de uma nota; não aparece no menu, é acessado pelo detalhe da nota."""
+
+	name = "Documentos"
+
+	def is_visible(self, request: Request) -> bool:
+		return False
+
+	@expose("/documents/{note_id}", methods=["GET"])
+	async def download(self, request: Request) -> Response:
+		try:
+			note_id = int(request.path_params["note_id"])
+		except ValueError:
+			return Response("Nota inválida", status_code=400)
+
+		async with AsyncSessionLocal() as db:
+			note = await db.get(Note, note_id)
+		if note is None or not note.storage_key:
+			return Response("PDF original não armazenado para esta nota", status_code=404)
+
+		filename = f"nota_{note.note_number or note.id}.pdf"
+		url = await document_storage.presigned_url(note.storage_key, filename)
+		if url:
+			return RedirectResponse(url, status_code=307)
+
+		path = document_storage.local_path(note.storage_key)
+		if path is None or not path.exists():
+			return Response("Arquivo não encontrado no storage", status_code=404)
+		return FileResponse(path, media_type="application/pdf", filename=filename, content_disposition_type="inline")
@@ -0,0 +1,57 @@
+from datetime import date
+
+from fastapi import Request
+from pydantic import ValidationError
+from sqladmin import BaseView, expose
+from starlette.responses import Response, StreamingResponse
+
+from app.services.export_service import (
+	EXPORT_FORMATS,
+	ExportFilters,
+	ExportFormatUnavailableError,
+	available_formats,
+	export_content_type,
+	export_filename,
+	stream_export,
+)
+
+
+class ExportAdmin(BaseView):
+	name = "Exportar Notas"
+	icon = "fa fa-file-export"
+	category = "Financeiro"
+	category_icon = "fa fa-dollar-sign"
+
+	@expose("/export", methods=["GET"])
+	async def export_page(self, request: Request) -> Response:
+		"""
+		Formulário de filtros; com `format` na query, devolve o arquivo.
+		CSV sai em streaming; XLSX e Parquet são gravados por inteiro num arquivo
+		temporário antes do primeiro byte ser enviado.
+		"""
+		params = request.query_params
+		export_format = params.get("format")
+		if not export_format:
+			return await self.templates.TemplateResponse(
+				request,
+				"export.html",
+				context={"formats": list(EXPORT_FORMATS), "available": available_formats(), "today": date.today()},
+			)
+
+		try:
+			filters = ExportFilters(**{key: params.get(key) or None for key in ExportFilters.model_fields})
+		except ValidationError as e:
+			return Response(f"Filtros inválidos: {e}", status_code=400)
+
+		try:
+			body = stream_export(export_format, filters)
+		except ExportFormatUnavailableError as e:
+			return Response(str(e), status_code=501)
+		except ValueError as e:
+			return Response(str(e), status_code=400)
+
+		return StreamingResponse(
+			body,
+			media_type=export_content_type(export_format),
+			headers={"Content-Disposition": f'attachment; filename="{export_filename(export_format, filters)}"'},
+		)
@@ -1,9 +1,24 @@
-from sqladmin import ModelView
+from typing import Iterable, Set
 
+from fastapi import Request
+from markupsafe import Markup
+
+from app.admin.pagination import KeysetModelView
+from app.db.session import AsyncSessionLocal
 from app.models import Note, ItemNote
+from app.services.access_key import known_access_keys
+from app.services.reports_service import ReportBucket, bucket_of, buckets_of_notes, refresh_buckets
+
+
+async def _refresh_reports(buckets: Set[ReportBucket] = frozenset(), note_ids: Iterable[int] = ()) -> None:
+	"""Recalcula os buckets de relatório afetados por uma edição/exclusão no painel."""
+	async with AsyncSessionLocal() as db:
+		buckets = set(buckets) | await buckets_of_notes(db, note_ids)
+		await refresh_buckets(db, buckets)
+		await db.commit()
 
 
-class NoteAdmin(ModelView, model=Note):
+class NoteAdmin(KeysetModelView, model=Note):
 	name = "Notas Fiscais"
 	name_plural = "Notas Fiscais"
 	icon = "fa fa-file-invoice-dollar"
@@ -14,9 +29,12 @@ class NoteAdmin(ModelView, model=Note):
 	can_edit = True
 	can_delete = True
 	can_view_details = True
+	# O export padrão do sqladmin carrega tudo em memória; use "Exportar Notas".
+	can_export = False
 
 	page_size = 50
 	page_size_options = [25, 50, 100, 200]
+	keyset_columns = [Note.date_of_issue, Note.id]
 
 	column_list = [
 		Note.id,
@@ -38,9 +56,20 @@ class NoteAdmin(ModelView, model=Note):
 		Note.issuer_city,
 		Note.issuer_state,
 		Note.total_value,
+		Note.extractor_stage,
+		Note.source_size,
+		Note.payload_size,
+		Note.preprocess_ms,
+		Note.storage_key,
 		Note.items,
 	]
 
+	column_formatters_detail = {
+		# Relativo a /admin/note/details/<id>: o download passa pelo DocumentsAdmin.
+		Note.storage_key: lambda m, a: Markup(f'<a href="../../documents/{m.id}" target="_blank">Baixar PDF</a>')
+		if m.storage_key else "—",
+	}
+
 	column_labels = {
 		Note.id: "ID",
 		Note.note_type: "Tipo da Nota",
@@ -58,6 +87,11 @@ class NoteAdmin(ModelView, model=Note):
 		Note.total_value: "Valor Total",
 		Note.pdf_url: "URL do PDF",
 		Note.pdf_file: "Arquivo PDF",
+		Note.storage_key: "PDF Original",
+		Note.extractor_stage: "Estágio de Extração",
+		Note.source_size: "Bytes Recebidos",
+		Note.payload_size: "Bytes Enviados ao Extrator",
+		Note.preprocess_ms: "Pré-processamento (ms)",
 		Note.created_at: "Criado em",
 		Note.items: "Itens da Nota",
 	}
@@ -65,8 +99,27 @@ class NoteAdmin(ModelView, model=Note):
 	column_searchable_list = [Note.note_number, Note.provider]
 	column_filterable_list = [Note.note_type, Note.date_of_issue]
 
+	async def on_model_change(self, data: dict, model: Note, is_created: bool, request: Request) -> None:
+		# `model` ainda tem os valores antigos: guarda o bucket de onde a nota pode sair e a chave anterior.
+		request.state.report_buckets = {bucket_of(model.issuer_cnpj, model.date_of_issue)}
+		request.state.access_key = model.access_key
+
+	async def after_model_change(self, data: dict, model: Note, is_created: bool, request: Request) -> None:
+		old_access_key = getattr(request.state, "access_key", None)
+		await known_access_keys.replace(old_access_key, model.access_key, model.id)
+		buckets = getattr(request.state, "report_buckets", set())
+		await _refresh_reports(buckets | {bucket_of(model.issuer_cnpj, model.date_of_issue)})
 
-class ItemNoteAdmin(ModelView, model=ItemNote):
+	async def on_model_delete(self, model: Note, request: Request) -> None:
+		request.state.report_buckets = {bucket_of(model.issuer_cnpj, model.date_of_issue)}
+
+	async def after_model_delete(self, model: Note, request: Request) -> None:
+		if model.access_key:
+			await known_access_keys.remove(model.access_key)
+		await _refresh_reports(request.state.report_buckets)
+
+
+class ItemNoteAdmin(KeysetModelView, model=ItemNote):
 	name = "Itens da Nota"
 	name_plural = "Itens das Notas"
 	icon = "fa fa-boxes"
@@ -77,9 +130,12 @@ class ItemNoteAdmin(ModelView, model=ItemNote):
 	can_edit = True
 	can_delete = True
 	can_view_details = True
+	# O export padrão do sqladmin carrega tudo em memória; use "Exportar Notas".
+	can_export = False
 
 	page_size = 50
 	page_size_options = [25, 50, 100, 200]
+	keyset_columns = [ItemNote.id]
 
 	column_list = [
 		ItemNote.id,
@@ -113,3 +169,12 @@ class ItemNoteAdmin(ModelView, model=ItemNote):
 
 	column_searchable_list = [ItemNote.product_name, ItemNote.product_code]
 	column_filterable_list = [ItemNote.note_id, ItemNote.ncm, ItemNote.cfop]
+
+	async def on_model_change(self, data: dict, model: ItemNote, is_created: bool, request: Request) -> None:
+		request.state.report_note_ids = {model.note_id}
+
+	async def after_model_change(self, data: dict, model: ItemNote, is_created: bool, request: Request) -> None:
+		await _refresh_reports(note_ids=getattr(request.state, "report_note_ids", set()) | {model.note_id})
+
+	async def after_model_delete(self, model: ItemNote, request: Request) -> None:
+		await _refresh_reports(note_ids={model.note_id})
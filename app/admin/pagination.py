@@ -0,0 +1,135 @@
+"""
+Paginação por keyset e contagem estimada para as listagens do sqladmin.
+
+O `ModelView.list` padrão faz `count(*)` sobre a consulta inteira e pagina com
+OFFSET, o que degrada linearmente com o tamanho das tabelas. Aqui:
+
+- Na ordenação padrão da view (`keyset_columns`, decrescente), a página N é lida
+  com `WHERE (colunas) < cursor LIMIT page_size`, usando o último registro da
+  página anterior como cursor. Os cursores ficam num cache em memória por
+  consulta (filtros/busca/tamanho de página); saltos para páginas sem cursor
+  conhecido partem do cursor mais próximo e pulam só as páginas intermediárias.
+- Sem busca nem filtros, o total vem de `pg_class.reltuples` (estimativa mantida
+  pelo autovacuum/ANALYZE). Com busca ou filtros, a contagem é limitada a
+  `count_limit` linhas.
+
+Quando o usuário escolhe uma ordenação (`sortBy`), a listagem volta ao OFFSET padrão.
+"""
+from typing import Any, List, Optional, Tuple
+
+from cachetools import TTLCache
+from sqlalchemy import ClauseElement, Select, String, func, or_, select, text, tuple_
+from sqladmin import ModelView
+from sqladmin.pagination import Pagination
+from sqlalchemy.orm import selectinload
+from starlette.requests import Request
+
+Cursor = Tuple[Any, ...]
+
+
+class KeysetModelView(ModelView):
+	# Colunas da ordenação padrão, da mais significativa para o desempate (sempre a PK por último).
+	keyset_columns: List[Any] = []
+	count_limit: int = 10_000
+	cursor_cache_size: int = 2048
+	cursor_cache_ttl: int = 10 * 60
+	cursor_lookback: int = 100
+
+	def __init__(self) -> None:
+		super().__init__()
+		self._cursors: TTLCache = TTLCache(maxsize=self.cursor_cache_size, ttl=self.cursor_cache_ttl)
+
+	async def list(self, request: Request) -> Pagination:
+		if not self.keyset_columns or request.query_params.get("sortBy"):
+			return await super().list(request)
+
+		page = self.validate_page_number(request.query_params.get("page"), 1)
+		page_size = self.validate_page_number(request.query_params.get("pageSize"), 0)
+		page_size = min(page_size or self.page_size, max(self.page_size_options))
+		search = request.query_params.get("search", None)
+
+		stmt = await self._apply_filters(self.list_query(request), request)
+		if search:
+			stmt = self.search_query(stmt=stmt, term=search)
+		filtered = bool(search) or stmt.whereclause is not None
+		count = await self._estimated_count(stmt, filtered)
+
+		query_key = self._query_key(request, page_size)
+		start_page, cursor = self._nearest_cursor(query_key, page)
+
+		stmt = stmt.order_by(*(column.desc() for column in self.keyset_columns))
+		if cursor is not None:
+			stmt = stmt.where(tuple_(*self.keyset_columns) < tuple_(*cursor))
+		stmt = stmt.offset((page - start_page) * page_size).limit(page_size)
+		for relation in self._list_relations:
+			stmt = stmt.options(selectinload(relation))
+
+		rows = await self._run_query(stmt)
+		if rows:
+			self._cursors[(query_key, page)] = self._cursor_of(rows[-1])
+			# Com estimativa baixa, garante que o sqladmin ainda ofereça a página seguinte.
+			count = max(count, (page - 1) * page_size + len(rows) + (page_size if len(rows) == page_size else 0))
+
+		return Pagination(rows=rows, page=page, page_size=page_size, count=count)
+
+	def search_query(self, stmt: Select, term: str) -> Select:
+		# Sem o CAST do sqladmin, para que o ILIKE use os índices de trigramas das colunas texto.
+		expressions = []
+		for field in self._search_fields:
+			column = getattr(self.model, field)
+			if not isinstance(column.type, String):
+				column = column.cast(String)
+			expressions.append(column.ilike(f"%{term}%"))
+		return stmt.filter(or_(*expressions))
+
+	async def _apply_filters(self, stmt: Select, request: Request) -> Select:
+		for column_filter in self.get_filters():
+			value = request.query_params.get(column_filter.parameter_name)
+			if not value:
+				continue
+			if getattr(column_filter, "has_operator", False):
+				operation = request.query_params.get(f"{column_filter.parameter_name}_op")
+				if operation:
+					stmt = await column_filter.get_filtered_query(stmt, operation, value, self.model)
+			else:
+				stmt = await column_filter.get_filtered_query(stmt, value, self.model)
+		return stmt
+
+	async def _estimated_count(self, stmt: Select, filtered: bool) -> int:
+		if not filtered:
+			estimate = await self._run_scalar(
+				text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)")
+				.bindparams(table=self.model.__tablename__)
+			)
+			# reltuples é -1 (ou 0) até o primeiro ANALYZE; nesse caso conta de verdade (tabela pequena).
+			if estimate is not None and estimate > 0:
+				return estimate
+
+		limited = stmt.with_only_columns(*self.pk_columns).order_by(None).limit(self.count_limit).subquery()
+		return await self._run_scalar(select(func.count()).select_from(limited)) or 0
+
+	async def _run_scalar(self, stmt: ClauseElement) -> Optional[Any]:
+		rows = await self._run_query(stmt)
+		return rows[0] if rows else None
+
+	def _keyset_names(self) -> List[str]:
+		return [column.key for column in self.keyset_columns]
+
+	def _cursor_of(self, row: Any) -> Cursor:
+		return tuple(getattr(row, name) for name in self._keyset_names())
+
+	@staticmethod
+	def _query_key(request: Request, page_size: int) -> Tuple:
+		params = tuple(sorted((k, v) for k, v in request.query_params.multi_items() if k not in ("page", "pageSize")))
+		return params, page_size
+
+	def _nearest_cursor(self, query_key: Tuple, page: int) -> Tuple[int, Optional[Cursor]]:
+		"""
+		Retorna (página inicial, cursor) a partir do cursor conhecido mais próximo antes
+		de `page`, procurando no máximo `cursor_lookback` páginas para trás.
+		"""
+		for previous in range(page - 1, max(0, page - 1 - self.cursor_lookback), -1):
+			cursor = self._cursors.get((query_key, previous))
+			if cursor is not None:
+				return previous + 1, cursor
+		return 1, None
@@ -0,0 +1,39 @@
+from datetime import date
+
+from fastapi import Request
+from sqladmin import BaseView, expose
+
+from app.db.session import AsyncSessionLocal
+from app.services import reports_service
+
+
+class ReportsAdmin(BaseView):
+	name = "Relatórios"
+	icon = "fa fa-chart-line"
+	category = "Financeiro"
+	category_icon = "fa fa-dollar-sign"
+
+	@expose("/reports", methods=["GET"])
+	async def dashboard(self, request: Request):
+		"""Painel com os totais pré-agregados dos últimos 12 meses (ou do período filtrado)."""
+		today = date.today()
+		default_from = date(today.year - 1, today.month, 1)
+		params = request.query_params
+		try:
+			month_from = date.fromisoformat(params["month_from"]) if params.get("month_from") else default_from
+			month_to = date.fromisoformat(params["month_to"]) if params.get("month_to") else today
+		except ValueError:
+			month_from, month_to = default_from, today
+		issuer_cnpj = params.get("issuer_cnpj") or None
+
+		async with AsyncSessionLocal() as db:
+			context = {
+				"month_from": month_from,
+				"month_to": month_to,
+				"issuer_cnpj": issuer_cnpj or "",
+				"monthly": await reports_service.monthly_totals(db, month_from, month_to, issuer_cnpj),
+				"issuers": await reports_service.issuer_totals(db, month_from, month_to, issuer_cnpj, limit=10),
+				"ncms": await reports_service.item_totals(db, "ncm", month_from, month_to, issuer_cnpj, limit=10),
+				"cfops": await reports_service.item_totals(db, "cfop", month_from, month_to, issuer_cnpj, limit=10),
+			}
+		return await self.templates.TemplateResponse(request, "reports.html", context=context)
@@ -0,0 +1,80 @@
+import asyncio
+import secrets
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import List
+
+from fastapi import File, Header, HTTPException, UploadFile, status
+from fastapi.routing import APIRouter
+
+from app.core.config import settings
+from app.services.ingest_service import (
+	BatchProgress,
+	UnsafeArchiveError,
+	check_archives,
+	enqueue_batch,
+	load_progress,
+)
+
+router = APIRouter()
+
+
+def _save_upload(upload: UploadFile, target: Path) -> None:
+	with target.open("wb") as out:
+		shutil.copyfileobj(upload.file, out, length=1024 * 1024)
+
+
+def _check_api_key(api_key: str | None) -> None:
+	# Sem chave configurada a API fica fechada: ingestão em lote não pode ficar aberta por omissão.
+	if not settings.ingest_api_key:
+		raise HTTPException(
+			status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+			detail="Ingestão em lote desabilitada: configure INGEST_API_KEY",
+		)
+	if not api_key or not secrets.compare_digest(api_key, settings.ingest_api_key):
+		raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="API key inválida")
+
+
+@router.post("/batch", status_code=status.HTTP_202_ACCEPTED)
+async def create_batch(
+		files: List[UploadFile] = File(...),
+		x_api_key: str | None = Header(default=None),
+):
+	"""
+	Recebe PDFs, XMLs ou arquivos .zip para ingestão em lote (backfill).
+	Os .zip são validados (número de arquivos, tamanho descompactado e taxa de
+	compressão) antes de qualquer extração. Cada documento é gravado no storage e
+	enfileirado para os workers; o progresso é consultado em
+	`GET /ingest/batch/{batch_id}`.
+	"""
+	_check_api_key(x_api_key)
+
+	workdir = Path(tempfile.mkdtemp(prefix="nf_ingest_"))
+	try:
+		for index, upload in enumerate(files):
+			target = workdir / f"{index:06d}_{Path(upload.filename or 'documento').name}"
+			await asyncio.to_thread(_save_upload, upload, target)
+
+		try:
+			await asyncio.to_thread(check_archives, workdir)
+		except UnsafeArchiveError as e:
+			raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+		except zipfile.BadZipFile as e:
+			raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Arquivo .zip inválido: {e}")
+
+		progress = await enqueue_batch(workdir, BatchProgress())
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+	return {"batch_id": progress.batch_id, "discovered": progress.discovered}
+
+
+@router.get("/batch/{batch_id}", response_model=BatchProgress)
+async def get_batch(batch_id: str, x_api_key: str | None = Header(default=None)):
+	_check_api_key(x_api_key)
+
+	progress = await load_progress(batch_id)
+	if progress is None:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lote não encontrado")
+	return progress
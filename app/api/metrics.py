@@ -0,0 +1,11 @@
+from fastapi import Response
+from fastapi.routing import APIRouter
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+	"""Métricas no formato de exposição do Prometheus."""
+	return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,62 @@
+import secrets
+from datetime import date
+from typing import Literal, Optional
+
+from fastapi import Depends, Header, HTTPException, Query, status
+from fastapi.routing import APIRouter
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import get_db_session
+from app.services import reports_service
+
+router = APIRouter()
+
+
+def _check_api_key(x_api_key: str | None = Header(default=None)) -> None:
+	# Sem chave configurada a API fica fechada; o painel continua em Financeiro → Relatórios.
+	if not settings.reports_api_key:
+		raise HTTPException(
+			status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+			detail="API de relatórios desabilitada: configure REPORTS_API_KEY",
+		)
+	if not x_api_key or not secrets.compare_digest(x_api_key, settings.reports_api_key):
+		raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="API key inválida")
+
+
+@router.get("/monthly", dependencies=[Depends(_check_api_key)])
+async def monthly(
+		month_from: Optional[date] = None,
+		month_to: Optional[date] = None,
+		issuer_cnpj: Optional[str] = None,
+		db: AsyncSession = Depends(get_db_session),
+):
+	"""Quantidade de notas, valor total, ICMS e IPI por mês de emissão."""
+	return await reports_service.monthly_totals(db, month_from, month_to, issuer_cnpj)
+
+
+@router.get("/issuers", dependencies=[Depends(_check_api_key)])
+async def issuers(
+		month_from: Optional[date] = None,
+		month_to: Optional[date] = None,
+		issuer_cnpj: Optional[str] = None,
+		limit: int = Query(default=100, ge=1, le=1000),
+		db: AsyncSession = Depends(get_db_session),
+):
+	"""Totais por CNPJ emitente no período."""
+	return await reports_service.issuer_totals(db, month_from, month_to, issuer_cnpj, limit)
+
+
+@router.get("/items", dependencies=[Depends(_check_api_key)])
+async def items(
+		group_by: Literal["ncm", "cfop"] = "ncm",
+		month_from: Optional[date] = None,
+		month_to: Optional[date] = None,
+		issuer_cnpj: Optional[str] = None,
+		ncm: Optional[str] = None,
+		cfop: Optional[str] = None,
+		limit: int = Query(default=100, ge=1, le=1000),
+		db: AsyncSession = Depends(get_db_session),
+):
+	"""Itens, quantidade, valor bruto, desconto, ICMS e IPI agrupados por NCM ou CFOP."""
+	return await reports_service.item_totals(db, group_by, month_from, month_to, issuer_cnpj, ncm, cfop, limit)
@@ -1,30 +1,111 @@
+import math
 from datetime import datetime, timezone, timedelta
 
-from fastapi import Request, BackgroundTasks
-from fastapi.params import Depends
+import orjson
+from fastapi import Request
+from fastapi.responses import ORJSONResponse
 from fastapi.routing import APIRouter
+from starlette.background import BackgroundTask
 from loguru import logger
-from sqlalchemy.ext.asyncio import AsyncSession
-
-from app.db.session import get_db_session
-from app.services.evolution.evolution_integration import evolution_client
-from app.services.notes_service import process_pdf_b64
+from opentelemetry import trace
+from opentelemetry.trace import SpanKind
+
+from app.core.config import settings
+from app.core.metrics import RATE_LIMIT_DEFERRED, WEBHOOK_DURATION, WEBHOOKS_IGNORED, WEBHOOKS_RECEIVED, observe
+from app.core.tracing import extract_context, inject_context, tracer
+from app.schemas.jobs import DocumentJob
+from app.services.evolution.evolution_integration import evolution_clients
+from app.services.nfe_xml import is_xml_document
+from app.services.queue.broker import queue_for
+from app.services.queue.outbox import reply_outbox
+from app.services.rate_limit import deferral_delay, sender_rate_limiter
 
 router = APIRouter()
 
+# Substrings que um evento relevante obrigatoriamente contém. Checadas nos bytes
+# crus, antes do parse: presença, status, grupos e mensagens de texto são
+# descartados sem decodificar o JSON.
+_UPSERT_MARKER = b"messages.upsert"
+_DOCUMENT_MARKER = b"documentMessage"
+_IMAGE_MARKER = b"imageMessage"
+
+# Fotos de cupom NFC-e; viram PDF no pré-processamento do worker.
+_IMAGE_MIMETYPES = {"image/jpeg", "image/png", "image/webp"}
+
+
+def _reply(content: dict, status_code: int = 200, background: BackgroundTask | None = None) -> ORJSONResponse:
+	# Devolver a Response pronta evita o jsonable_encoder do FastAPI no caminho quente.
+	return ORJSONResponse(content, status_code=status_code, background=background)
+
+
+def _ignored(
+		reason: str,
+		message: str,
+		status_code: int = 200,
+		background: BackgroundTask | None = None,
+) -> ORJSONResponse:
+	WEBHOOKS_IGNORED.labels(reason=reason).inc()
+	trace.get_current_span().set_attribute("nfbot.ignored_reason", reason)
+	return _reply({"message": message}, status_code, background)
+
+
+async def _notice(instance: str, phone_number: str, kind: str, text: str) -> BackgroundTask | None:
+	"""Aviso ao remetente pelo outbox, limitado a um por tipo dentro do cooldown."""
+	if await sender_rate_limiter.should_notify(phone_number, kind):
+		return BackgroundTask(reply_outbox.add, instance, phone_number, "notice", text)
+	return None
+
+
+async def _read_body(request: Request, limit: int) -> bytes | None:
+	"""Lê o corpo até `limit` bytes; `None` se passar disso (sem bufferizar o excedente)."""
+	content_length = request.headers.get("content-length")
+	if content_length and content_length.isdigit() and int(content_length) > limit:
+		return None
+	body = bytearray()
+	async for chunk in request.stream():
+		body += chunk
+		if len(body) > limit:
+			return None
+	return bytes(body)
 
-@router.post("/webhook")
+
+@router.post("/webhook", response_class=ORJSONResponse)
 async def evolution_webhook(
 		request: Request,
-		background_tasks: BackgroundTasks,
-		db: AsyncSession = Depends(get_db_session)
 ):
 	"""Endpoint to receive webhook events from Evolution API."""
-	raw = await request.json()
-	logger.info(f"📥 Webhook bruto recebido: {raw}")
-
-	if raw.get("event") != "messages.upsert":
-		return {"message": "ignored"}
+	WEBHOOKS_RECEIVED.inc()
+	with observe(WEBHOOK_DURATION):
+		with tracer.start_as_current_span(
+				"POST /evolution/webhook",
+				context=extract_context(dict(request.headers)),
+				kind=SpanKind.SERVER,
+		):
+			return await _handle_webhook(request)
+
+
+async def _handle_webhook(request: Request) -> ORJSONResponse:
+	body = await _read_body(request, settings.webhook_max_body_bytes)
+	if body is None:
+		return _ignored("too_large", "payload too large", status_code=413)
+
+	if _UPSERT_MARKER not in body:
+		return _ignored("other_event", "ignored")
+	if _DOCUMENT_MARKER not in body and _IMAGE_MARKER not in body:
+		return _ignored("not_document", "ignored: not document")
+
+	try:
+		raw = orjson.loads(body)
+	except orjson.JSONDecodeError:
+		return _ignored("invalid_json", "invalid json", status_code=400)
+
+	if not isinstance(raw, dict) or raw.get("event") != "messages.upsert":
+		return _ignored("other_event", "ignored")
+
+	# A Evolution informa no payload a instância (número) que recebeu o evento.
+	instance = raw.get("instance") or evolution_clients.default_instance
+	if instance not in evolution_clients:
+		return _ignored("unknown_instance", "unknown instance")
 
 	data = raw.get("data") or {}
 	key = data.get("key") or {}
@@ -32,52 +113,96 @@ async def evolution_webhook(
 
 	remote_jid = key.get("remoteJid")
 	if not remote_jid:
-		return {"message": "missing remoteJid"}
+		return _ignored("missing_remote_jid", "missing remoteJid")
 
 	phone_number = remote_jid.split("@", 1)[0]
 
-	document = message.get("documentMessage")
+	document = message.get("documentMessage") or message.get("imageMessage")
 	if not document:
-		return {"message": "ignored: not document"}
+		return _ignored("not_document", "ignored: not document")
 
-	msg_ts = data.messageTimestamp
-	msg_time = datetime.fromtimestamp(int(msg_ts), tz=timezone.utc)
+	try:
+		msg_time = datetime.fromtimestamp(int(data.get("messageTimestamp")), tz=timezone.utc)
+	except (TypeError, ValueError, OverflowError, OSError):
+		# Sem horário não dá para separar mensagem nova de reenvio do histórico.
+		return _ignored("invalid_timestamp", "missing or invalid messageTimestamp")
 	now = datetime.now(timezone.utc)
 	if now - msg_time > timedelta(minutes=2):
-		return {"message": "Mensagem muito antiga ignorada"}
+		return _ignored("old_message", "Mensagem muito antiga ignorada")
 
 	mimetype = document.get("mimetype")
-	file_name = document.get("fileName") or document.get("title") or ""
-
-	if mimetype != "application/pdf" or not file_name.lower().endswith(".pdf"):
-		background_tasks.add_task(
-			evolution_client.send_text_message,
-			phone_number,
-			"Só aceito arquivos PDF de nota fiscal para registro. Envie um PDF válido.",
+	file_name = document.get("fileName") or document.get("title") or document.get("caption") or ""
+
+	if "documentMessage" not in message and mimetype in _IMAGE_MIMETYPES:
+		document_type = "image"
+		file_name = file_name or "foto da nota"
+	elif is_xml_document(mimetype, file_name):
+		document_type = "xml"
+	elif mimetype == "application/pdf" and file_name.lower().endswith(".pdf"):
+		document_type = "pdf"
+	else:
+		return _ignored(
+			"invalid_mimetype",
+			"invalid mimetype",
+			background=await _notice(
+				instance,
+				phone_number,
+				"invalid_document",
+				"Só aceito arquivos PDF ou XML de nota fiscal, ou foto do cupom, para registro. Envie um arquivo válido.",
+			),
 		)
-		return {"message": "invalid mimetype"}
 
 	url = document.get("url")
 	if not url:
-		return {"message": "missing document url"}
-
-	title = document.get("title") or file_name
-	message_id = key.get("id")
-
-	async def process():
-		try:
-			pdf_b64 = await evolution_client.get_base64_from_media_message(message_id)
-			await process_pdf_b64(pdf_b64, db, pdf_url=url)
-			await evolution_client.send_text_message(
-				phone_number,
-				f"Nota fiscal '{title}' processada com sucesso e registrada no sistema.",
+		return _ignored("missing_url", "missing document url")
+
+	job = DocumentJob(
+		message_id=key.get("id"),
+		phone_number=phone_number,
+		title=document.get("title") or file_name,
+		pdf_url=url,
+		media_url=message.get("mediaUrl"),
+		document_type=document_type,
+		instance=instance,
+		trace_context=inject_context(),
+	)
+	trace.get_current_span().set_attributes({
+		"nfbot.job_id": job.id,
+		"nfbot.document_type": document_type,
+		"nfbot.instance": instance,
+	})
+	queue = queue_for(instance)
+
+	decision = await sender_rate_limiter.hit(phone_number, job.message_id, instance)
+	if not decision.allowed:
+		minutes = max(1, math.ceil(decision.retry_after_seconds / 60))
+		if decision.scope == "sender":
+			# 200 e não 429: a Evolution reenviaria o evento.
+			return _ignored(
+				"rate_limited",
+				"rate limited",
+				background=await _notice(
+					instance,
+					phone_number,
+					"rate_limited",
+					f"Você atingiu o limite de notas enviadas por enquanto. Tente novamente em cerca de {minutes} min.",
+				),
 			)
-		except Exception as e:
-			logger.exception(f"Erro ao processar nota fiscal: {e}")
-			await evolution_client.send_text_message(
+		# Cota da instância ou global esgotada: o documento não é descartado, só processado mais tarde.
+		delay = deferral_delay(decision, await queue.delayed_count())
+		minutes = max(1, math.ceil(delay / 60))
+		await queue.enqueue_delayed(job.model_copy(update={"quota_pending": True}), delay)
+		RATE_LIMIT_DEFERRED.inc()
+		return _reply(
+			{"message": "deferred", "job_id": job.id},
+			background=await _notice(
+				instance,
 				phone_number,
-				"Tive um erro ao processar sua nota fiscal. Tente novamente em alguns minutos.",
-			)
+				"deferred",
+				f"Recebi sua nota! Estamos com muitos envios agora e ela será processada em cerca de {minutes} min.",
+			),
+		)
 
-	background_tasks.add_task(process)
-	return {"message": "PDF received, processing started"}
+	await queue.enqueue(job)
+	logger.bind(event="webhook_enqueued").info(f"📥 {document_type.upper()} {job.message_id} enfileirado (job {job.id})")
+	return _reply({"message": f"{document_type.upper()} received, processing started", "job_id": job.id})
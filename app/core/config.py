@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Literal
 from urllib.parse import urlsplit, urlunsplit
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -9,15 +10,147 @@ class Settings(BaseSettings):
 	api_v1_str: str = "/api/v1"
 
 	database_connection_uri: str
+	db_pool_size: int = 10
+	db_max_overflow: int = 20
+	db_pool_timeout_seconds: float = 30.0
+	db_pool_recycle_seconds: int = 1800
+	db_pool_pre_ping: bool = True
+	# 0 desliga o cache de prepared statements (necessário atrás de PgBouncer em modo transaction).
+	db_statement_cache_size: int = 500
+	items_copy_threshold: int = 500
 
 	cache_redis_uri: str
 
+	queue_stream_name: str = "nf_bot_zap:jobs"
+	queue_group_name: str = "nf_bot_zap_workers"
+	queue_dead_letter_stream: str = "nf_bot_zap:jobs:dead"
+	queue_delayed_key: str = "nf_bot_zap:jobs:delayed"
+	# Stream da ingestão em lote, consumido com `ingest_concurrency` consumidores por worker.
+	queue_batch_stream_name: str = "nf_bot_zap:jobs:batch"
+	queue_worker_concurrency: int = 4
+	# Instâncias da Evolution atendidas pelo worker (vazio: todas); ver `python -m app.worker --instances`.
+	worker_instances: list[str] = []
+	queue_visibility_timeout_seconds: int = 300
+	queue_max_attempts: int = 5
+	queue_retry_base_seconds: float = 5.0
+	queue_retry_max_seconds: float = 300.0
+	worker_metrics_port: int = 9100
+
+	log_level: str = "INFO"
+	log_json: bool = True
+	log_file: str | None = "logs/app_{time}.log"
+	log_max_message_chars: int = 2000
+	log_sample_per_second: int = 20
+
+	otel_enabled: bool = False
+	otel_exporter_otlp_endpoint: str = "http://localhost:4318/v1/traces"
+	otel_sample_ratio: float = 0.1
+
 	evolution_api_url: str
 	authentication_api_key: str
 	evolution_instance_name: str
+	# Instâncias extras servidas pelo mesmo deploy: nome -> apikey da instância
+	# (vazio usa AUTHENTICATION_API_KEY). Ex.: EVOLUTION_INSTANCES='{"loja2": ""}'
+	evolution_instances: dict[str, str] = {}
+	evolution_webhook_url: str | None = None
+	evolution_webhook_events: list[str] = ["MESSAGES_UPSERT"]
+	webhook_max_body_bytes: int = 1024 * 1024
+	evolution_max_connections: int = 50
+	evolution_max_keepalive_connections: int = 20
+	evolution_keepalive_expiry_seconds: float = 30.0
+	evolution_http2: bool = False
+	evolution_connect_timeout_seconds: float = 5.0
+	evolution_send_timeout_seconds: float = 15.0
+	evolution_media_timeout_seconds: float = 60.0
+	evolution_max_attempts: int = 3
+	# "delay" do sendText (ms de "digitando..." antes do envio); o ritmo entre mensagens fica com o outbox.
+	evolution_send_delay_ms: int = 0
+	evolution_circuit_failure_threshold: int = 5
+	evolution_circuit_reset_seconds: float = 30.0
+
+	media_max_bytes: int = 25 * 1024 * 1024
+	media_spool_max_memory_bytes: int = 2 * 1024 * 1024
+	media_chunk_size: int = 64 * 1024
 
 	google_api_key: str
 
+	local_parser_min_confidence: float = 0.9
+
+	# Quota do projeto no Gemini, compartilhada por todos os workers (buckets no Redis).
+	llm_requests_per_minute: int = 60
+	llm_tokens_per_minute: int = 1_000_000
+	llm_bucket_prefix: str = "nf_bot_zap:llm:bucket:"
+	llm_estimated_tokens_per_request: int = 6000
+	llm_initial_concurrency: int = 4
+	llm_max_concurrency: int = 16
+	llm_max_attempts: int = 5
+	llm_retry_max_wait_seconds: float = 60.0
+	# PDFs a partir de `llm_chunk_min_pages` páginas são extraídos em faixas de `llm_chunk_pages`.
+	llm_chunk_min_pages: int = 4
+	llm_chunk_pages: int = 3
+	llm_chunk_concurrency: int = 4
+	# Pedidos de continuação quando a resposta do modelo vem cortada no meio dos itens.
+	llm_max_continuations: int = 2
+
+	# Páginas só de imagem e fotos são reduzidas antes de irem ao modelo.
+	preprocess_enabled: bool = True
+	preprocess_target_dpi: int = 150
+	preprocess_grayscale: bool = True
+	preprocess_jpeg_quality: int = 70
+	preprocess_image_max_px: int = 2000
+
+	ingest_concurrency: int = 4
+	# Sem chave configurada a API de ingestão responde 503.
+	ingest_api_key: str | None = None
+	# Limites verificados no índice do .zip antes de extrair qualquer membro.
+	ingest_zip_max_members: int = 10_000
+	ingest_zip_max_uncompressed_bytes: int = 2 * 1024 * 1024 * 1024
+	ingest_zip_max_ratio: int = 100
+	ingest_progress_ttl_seconds: int = 7 * 24 * 60 * 60
+
+	reports_api_key: str | None = None
+
+	rate_limit_enabled: bool = True
+	rate_limit_window_seconds: int = 60 * 60
+	# Documentos por remetente na janela, por tier; `default` vale para quem não tem tier.
+	rate_limit_tiers: dict[str, int] = {"default": 20, "trusted": 200, "blocked": 0}
+	rate_limit_global_limit: int = 2000
+	# Cota de cada instância da Evolution na janela; `rate_limit_instance_limits` sobrescreve por instância.
+	rate_limit_instance_limit: int = 1000
+	rate_limit_instance_limits: dict[str, int] = {}
+	rate_limit_notice_cooldown_seconds: int = 10 * 60
+	rate_limit_prefix: str = "nf_bot_zap:rate_limit:"
+	rate_limit_tiers_key: str = "nf_bot_zap:rate_limit:tiers"
+
+	# Respostas ao usuário: agrupadas por conversa e enviadas com ritmo controlado (app.services.queue.outbox).
+	outbox_coalesce_window_seconds: float = 3.0
+	outbox_max_wait_seconds: float = 15.0
+	outbox_send_concurrency: int = 8
+	outbox_chat_interval_seconds: float = 2.0
+	outbox_poll_interval_seconds: float = 0.5
+	outbox_retry_delay_seconds: float = 30.0
+	outbox_max_attempts: int = 5
+	outbox_prefix: str = "nf_bot_zap:outbox:"
+
+	extraction_cache_max_bytes: int = 64 * 1024 * 1024
+	extraction_cache_ttl_seconds: int = 30 * 24 * 60 * 60
+	extraction_cache_prefix: str = "nf_bot_zap:extraction:"
+	known_access_keys_redis_key: str = "nf_bot_zap:access_keys"
+
+	storage_backend: Literal["local", "s3"] = "local"
+	storage_local_path: str = "/tmp/notes/documents"
+	storage_key_prefix: str = "notes/"
+	storage_s3_bucket: str | None = None
+	storage_s3_endpoint_url: str | None = None
+	storage_s3_region: str | None = None
+	storage_s3_access_key_id: str | None = None
+	storage_s3_secret_access_key: str | None = None
+	storage_s3_max_connections: int = 20
+	storage_presign_expiry_seconds: int = 300
+
+	export_chunk_size: int = 5000
+	export_read_size: int = 256 * 1024
+
 	admin_username: str
 	admin_password: str
 	secret_key: str
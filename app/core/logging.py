@@ -0,0 +1,109 @@
+"""
+Configuração do loguru para API, worker e CLI.
+
+- Sinks com `enqueue=True`: a escrita (stdout/arquivo) acontece numa thread
+  própria e não bloqueia o event loop.
+- JSON estruturado (`LOG_JSON`), com os campos de `logger.bind(...)` em `extra`.
+- Mensagens longas são truncadas e base64, telefones e CNPJs mascarados antes
+  de sair do processo, de modo que o custo do log não cresce com o payload.
+- Logs de caminho quente marcados com `logger.bind(event="...")` são amostrados:
+  no máximo `LOG_SAMPLE_PER_SECOND` por evento a cada segundo; o primeiro
+  registro da janela seguinte informa quantos foram suprimidos.
+"""
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, TextIO
+
+from loguru import logger
+
+from app.core.config import settings
+
+_TEXT_FORMAT = (
+	"<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+	"<cyan>{name}</cyan>:<cyan>{function}</cyan> | <level>{message}</level>"
+)
+
+_BASE64_RE = re.compile(r"[A-Za-z0-9+/]{200,}={0,2}")
+_CNPJ_RE = re.compile(r"(?<![\d.])\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?(\d{2})(?![\d/-])")
+# Números brasileiros (DDI 55) como aparecem no remoteJid do WhatsApp.
+_PHONE_RE = re.compile(r"(?<!\d)55\d{6,7}(\d{4})(?!\d)")
+
+
+def redact(text: str, max_chars: Optional[int] = None) -> str:
+	"""Trunca e mascara base64, CNPJs e telefones (mantém só os últimos dígitos)."""
+	max_chars = settings.log_max_message_chars if max_chars is None else max_chars
+	if len(text) > max_chars:
+		text = f"{text[:max_chars]}… (+{len(text) - max_chars} caracteres)"
+	text = _BASE64_RE.sub(lambda m: f"<base64 {len(m.group(0))} caracteres>", text)
+	text = _CNPJ_RE.sub(r"**.***.***/****-\1", text)
+	return _PHONE_RE.sub(r"55*****\1", text)
+
+
+class _EventSampler:
+	"""Janela de 1s por evento; o que passa do limite é descartado e contado."""
+
+	def __init__(self, per_second: int) -> None:
+		self.per_second = per_second
+		self._windows: Dict[str, list] = {}
+		self._lock = threading.Lock()
+
+	def allow(self, event: str) -> tuple[bool, int]:
+		now = int(time.monotonic())
+		with self._lock:
+			window = self._windows.get(event)
+			if window is None or window[0] != now:
+				suppressed = window[2] if window else 0
+				self._windows[event] = [now, 1, 0]
+				return True, suppressed
+			if window[1] < self.per_second:
+				window[1] += 1
+				return True, 0
+			window[2] += 1
+			return False, 0
+
+
+_sampler = _EventSampler(settings.log_sample_per_second)
+
+
+def _patch(record: Dict[str, Any]) -> None:
+	record["message"] = redact(record["message"])
+
+	event = record["extra"].get("event")
+	# WARNING e acima nunca são amostrados.
+	if event and _sampler.per_second > 0 and record["level"].no < 30:
+		allowed, suppressed = _sampler.allow(event)
+		if not allowed:
+			record["extra"]["_sampled_out"] = True
+		elif suppressed:
+			record["extra"]["suppressed"] = suppressed
+
+
+def _not_sampled_out(record: Dict[str, Any]) -> bool:
+	return not record["extra"].get("_sampled_out")
+
+
+def setup_logging(stream: TextIO = sys.stdout, level: Optional[str] = None, log_file: Optional[str] = None) -> None:
+	"""Substitui os sinks padrão do loguru. Chamada uma vez no início de cada processo."""
+	level = level or settings.log_level
+	logger.remove()
+	logger.configure(patcher=_patch)
+	logger.add(
+		stream,
+		level=level,
+		format=_TEXT_FORMAT,
+		serialize=settings.log_json,
+		filter=_not_sampled_out,
+		enqueue=True,
+	)
+	if log_file:
+		logger.add(
+			log_file,
+			level=level,
+			rotation="500 MB",
+			retention="10 days",
+			serialize=settings.log_json,
+			filter=_not_sampled_out,
+			enqueue=True,
+		)
@@ -0,0 +1,183 @@
+"""
+Métricas Prometheus do pipeline de ingestão.
+
+A API expõe `GET /metrics`; o worker sobe um servidor HTTP próprio em
+`settings.worker_metrics_port`. Cada processo publica as próprias séries (os
+rótulos `instance`/`pod` do Prometheus separam réplicas).
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional
+
+import httpx
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Buckets cobrindo de chamadas rápidas (Redis, parser local) a extrações de dezenas de segundos.
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+WEBHOOK_DURATION = Histogram(
+	"nfbot_webhook_duration_seconds",
+	"Tempo de tratamento do webhook da Evolution",
+	buckets=_LATENCY_BUCKETS,
+)
+WEBHOOKS_RECEIVED = Counter("nfbot_webhooks_received_total", "Webhooks recebidos da Evolution")
+WEBHOOKS_IGNORED = Counter(
+	"nfbot_webhooks_ignored_total",
+	"Webhooks descartados, por motivo",
+	["reason"],
+)
+
+RATE_LIMIT_DEFERRED = Counter(
+	"nfbot_rate_limit_deferred_total",
+	"Documentos adiados por cota da instância ou global, inclusive os adiados de novo ao sair da fila",
+)
+
+REPLIES = Counter(
+	"nfbot_replies_total",
+	"Respostas ao usuário processadas pelo outbox, por resultado",
+	["outcome"],
+)
+REPLY_BATCH_SIZE = Histogram(
+	"nfbot_reply_batch_size",
+	"Respostas agrupadas em cada mensagem enviada",
+	buckets=(1, 2, 5, 10, 20, 50, 100),
+)
+
+JOBS_IN_FLIGHT = Gauge("nfbot_jobs_in_flight", "Jobs de documento em processamento neste processo")
+JOB_DURATION = Histogram(
+	"nfbot_job_duration_seconds",
+	"Tempo total de um job de documento (download, extração, persistência e resposta)",
+	["document_type", "outcome"],
+	buckets=_LATENCY_BUCKETS,
+)
+
+# Agendador do Gemini (app.services.langchain.scheduler), por faixa de prioridade (interactive/batch).
+LLM_QUEUE_DEPTH = Gauge(
+	"nfbot_llm_queue_depth",
+	"Chamadas ao Gemini aguardando vaga no agendador, por faixa de prioridade",
+	["lane"],
+)
+LLM_IN_FLIGHT = Gauge(
+	"nfbot_llm_in_flight",
+	"Chamadas ao Gemini em andamento, por faixa de prioridade",
+	["lane"],
+)
+LLM_CONCURRENCY_WINDOW = Gauge(
+	"nfbot_llm_concurrency_window",
+	"Janela de concorrência AIMD do agendador do Gemini",
+)
+
+MEDIA_DOWNLOAD_DURATION = Histogram(
+	"nfbot_media_download_duration_seconds",
+	"Tempo de download da mídia na Evolution",
+	["source"],
+	buckets=_LATENCY_BUCKETS,
+)
+MEDIA_DOWNLOAD_BYTES = Histogram(
+	"nfbot_media_download_bytes",
+	"Tamanho das mídias baixadas",
+	buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6),
+)
+
+EXTRACTION_DURATION = Histogram(
+	"nfbot_extraction_duration_seconds",
+	"Tempo de extração por estágio do extrator",
+	["stage", "model", "accepted"],
+	buckets=_LATENCY_BUCKETS,
+)
+
+EXTRACTION_CACHE = Counter(
+	"nfbot_extraction_cache_total",
+	"Consultas ao cache de extrações, por resultado (local_hit, redis_hit, miss)",
+	["result"],
+)
+
+PREPROCESS_DURATION = Histogram(
+	"nfbot_preprocess_duration_seconds",
+	"Tempo do pré-processamento do documento antes da extração",
+	["source"],
+	buckets=_LATENCY_BUCKETS,
+)
+PREPROCESS_BYTES = Histogram(
+	"nfbot_preprocess_bytes",
+	"Tamanho do documento antes (received) e depois (payload) do pré-processamento",
+	["source", "stage"],
+	buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6),
+)
+
+PERSIST_DURATION = Histogram(
+	"nfbot_persist_duration_seconds",
+	"Tempo de persistência da nota (upsert, itens e relatórios)",
+	["created"],
+	buckets=_LATENCY_BUCKETS,
+)
+
+EVOLUTION_REQUEST_DURATION = Histogram(
+	"nfbot_evolution_request_duration_seconds",
+	"Tempo das chamadas de saída à Evolution API (respostas ao usuário)",
+	["endpoint", "status"],
+	buckets=_LATENCY_BUCKETS,
+)
+
+
+@contextmanager
+def observe(histogram: Histogram, **labels: str) -> Iterator[dict]:
+	"""
+	Mede o bloco no histograma. Rótulos podem ser completados dentro do bloco
+	pelo dicionário retornado (ex.: resultado conhecido só no final).
+	"""
+	labels = dict(labels)
+	t0 = time.perf_counter()
+	try:
+		yield labels
+	finally:
+		elapsed = time.perf_counter() - t0
+		(histogram.labels(**labels) if labels else histogram).observe(elapsed)
+
+
+class PoolCollector(Collector):
+	"""Uso dos pools de conexão (SQLAlchemy e httpx), lido no momento da coleta."""
+
+	def __init__(self, engine: AsyncEngine, http_clients: Callable[[], Iterable[tuple[str, Optional[httpx.AsyncClient]]]]) -> None:
+		self._engine = engine
+		self._http_clients = http_clients
+
+	def collect(self):
+		db = GaugeMetricFamily("nfbot_db_pool_connections", "Conexões do pool do banco", labels=["state"])
+		pool = self._engine.sync_engine.pool
+		for state, getter in (("size", "size"), ("checked_out", "checkedout"), ("checked_in", "checkedin"), ("overflow", "overflow")):
+			value = getattr(pool, getter, None)
+			if value is not None:
+				# `overflow()` do QueuePool é negativo enquanto o pool base não está cheio.
+				db.add_metric([state], max(0, value()))
+		yield db
+
+		http = GaugeMetricFamily("nfbot_http_pool_connections", "Conexões do pool httpx", labels=["client", "state"])
+		for name, client in self._http_clients():
+			connections = _httpx_connections(client)
+			idle = sum(1 for c in connections if c.is_idle())
+			http.add_metric([name, "active"], len(connections) - idle)
+			http.add_metric([name, "idle"], idle)
+		yield http
+
+
+def _httpx_connections(client: Optional[httpx.AsyncClient]) -> list:
+	# O httpx não expõe o pool publicamente; o httpcore sim (`AsyncConnectionPool.connections`).
+	pool = getattr(getattr(client, "_transport", None), "_pool", None)
+	return list(getattr(pool, "connections", []))
+
+
+_pool_collector: Optional[PoolCollector] = None
+
+
+def register_pool_collector(
+		engine: AsyncEngine,
+		http_clients: Callable[[], Iterable[tuple[str, Optional[httpx.AsyncClient]]]],
+) -> None:
+	global _pool_collector
+	if _pool_collector is None:
+		_pool_collector = PoolCollector(engine, http_clients)
+		REGISTRY.register(_pool_collector)
@@ -0,0 +1,149 @@
+"""
+Tracing distribuído (OpenTelemetry).
+
+O trace começa no webhook, segue no `DocumentJob` (contexto W3C `traceparent`)
+até o worker e cobre as chamadas HTTP à Evolution, as chamadas ao Gemini (com
+contagem de tokens) e cada statement SQL.
+
+Desligado por padrão: sem `OTEL_ENABLED=true` o SDK nem é configurado e a API do
+OpenTelemetry fica em modo no-op. A amostragem é `ParentBased(TraceIdRatioBased)`,
+com a fração em `OTEL_SAMPLE_RATIO`; jobs herdam a decisão tomada no webhook.
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from loguru import logger
+from opentelemetry import context, propagate, trace
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+
+tracer = trace.get_tracer("nf_bot_zap")
+
+_SQL_SPAN_KEY = "_otel_span"
+_SQL_STATEMENT_MAX_CHARS = 2000
+
+
+def setup_tracing(service_name: str, engine: Optional[AsyncEngine] = None) -> None:
+	"""Configura o provider/exporter OTLP do processo e instrumenta o engine do SQLAlchemy."""
+	if not settings.otel_enabled:
+		return
+
+	from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+	from opentelemetry.sdk.resources import Resource
+	from opentelemetry.sdk.trace import TracerProvider
+	from opentelemetry.sdk.trace.export import BatchSpanProcessor
+	from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+	provider = TracerProvider(
+		resource=Resource.create({"service.name": service_name}),
+		sampler=ParentBased(TraceIdRatioBased(settings.otel_sample_ratio)),
+	)
+	provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=settings.otel_exporter_otlp_endpoint)))
+	trace.set_tracer_provider(provider)
+
+	if engine is not None:
+		instrument_engine(engine)
+	logger.info(
+		f"🔭 Tracing ativo para {service_name} (amostragem {settings.otel_sample_ratio}, "
+		f"exporter {settings.otel_exporter_otlp_endpoint})"
+	)
+
+
+def shutdown_tracing() -> None:
+	provider = trace.get_tracer_provider()
+	if hasattr(provider, "shutdown"):
+		provider.shutdown()
+
+
+def inject_context() -> Dict[str, str]:
+	"""Serializa o contexto atual (traceparent/tracestate) para viajar dentro do job."""
+	carrier: Dict[str, str] = {}
+	propagate.inject(carrier)
+	return carrier
+
+
+def extract_context(carrier: Optional[Dict[str, str]]) -> context.Context:
+	return propagate.extract(carrier or {})
+
+
+def record_exception(span: Span, exc: BaseException) -> None:
+	span.record_exception(exc)
+	span.set_status(Status(StatusCode.ERROR, str(exc)))
+
+
+@contextmanager
+def http_span(method: str, url: str, inject: bool = True) -> Iterator[Tuple[Span, Dict[str, str]]]:
+	"""
+	Span CLIENT de uma chamada HTTP de saída. Devolve também os headers de
+	propagação (`traceparent`) para repassar ao servidor quando `inject=True`.
+	A query string fica de fora dos atributos (URLs pré-assinadas carregam credenciais).
+	"""
+	parts = urlsplit(url)
+	with tracer.start_as_current_span(
+			f"{method} {parts.path}",
+			kind=SpanKind.CLIENT,
+			attributes={
+				"http.request.method": method,
+				"server.address": parts.hostname or "",
+				"url.full": f"{parts.scheme}://{parts.netloc}{parts.path}",
+			},
+	) as span:
+		yield span, (inject_context() if inject else {})
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+	"""Um span por statement SQL, filho do span corrente (as chamadas do asyncpg rodam no mesmo contexto)."""
+	sync_engine = engine.sync_engine
+	if getattr(sync_engine, "_otel_instrumented", False):
+		return
+	sync_engine._otel_instrumented = True
+	db_name = sync_engine.url.database
+
+	@event.listens_for(sync_engine, "before_cursor_execute")
+	def _before(conn, cursor, statement, parameters, exec_context, executemany) -> None:
+		if exec_context is None:
+			return
+		span = tracer.start_span(
+			f"SQL {statement.split(None, 1)[0].upper() if statement else ''}",
+			kind=SpanKind.CLIENT,
+			attributes={
+				"db.system": "postgresql",
+				"db.name": db_name or "",
+				"db.statement": statement[:_SQL_STATEMENT_MAX_CHARS],
+				"db.executemany": executemany,
+			},
+		)
+		setattr(exec_context, _SQL_SPAN_KEY, span)
+
+	@event.listens_for(sync_engine, "after_cursor_execute")
+	def _after(conn, cursor, statement, parameters, exec_context, executemany) -> None:
+		span = getattr(exec_context, _SQL_SPAN_KEY, None)
+		if span is not None:
+			rowcount = getattr(cursor, "rowcount", -1)
+			if rowcount is not None and rowcount >= 0:
+				span.set_attribute("db.rowcount", rowcount)
+			span.end()
+
+	@event.listens_for(sync_engine, "handle_error")
+	def _error(exception_context) -> None:
+		span = getattr(exception_context.execution_context, _SQL_SPAN_KEY, None)
+		if span is not None:
+			record_exception(span, exception_context.original_exception)
+			span.end()
+
+
+def set_llm_usage(span: Span, usage: Optional[Dict[str, Any]]) -> None:
+	if not usage:
+		return
+	for attribute, key in (
+			("gen_ai.usage.input_tokens", "input_tokens"),
+			("gen_ai.usage.output_tokens", "output_tokens"),
+			("gen_ai.usage.total_tokens", "total_tokens"),
+	):
+		if usage.get(key) is not None:
+			span.set_attribute(attribute, usage[key])
+
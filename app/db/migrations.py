@@ -0,0 +1,130 @@
+"""
+Migrações incrementais do schema.
+
+`Base.metadata.create_all` só cria tabelas que ainda não existem; alterações em
+tabelas já existentes (índices, colunas novas, extensões) ficam registradas aqui
+como passos idempotentes, aplicados uma única vez e em ordem por `run_migrations`.
+"""
+from typing import List, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# Chave arbitrária para o advisory lock que serializa réplicas subindo em paralelo.
+_MIGRATIONS_LOCK_ID = 7_310_452_001
+
+MIGRATIONS: List[Tuple[str, List[str]]] = [
+	(
+		"0001_notes_access_key_unique",
+		[
+			"UPDATE notes SET access_key = NULLIF(regexp_replace(access_key, '\\D', '', 'g'), '') "
+			"WHERE access_key IS NOT NULL",
+			# Duplicatas (mantém a nota mais antiga de cada chave) são copiadas, com os
+			# itens, para tabelas *_duplicates_0001 antes de remover; cada uma vai ao log.
+			"CREATE TABLE IF NOT EXISTS notes_duplicates_0001 (LIKE notes)",
+			"CREATE TABLE IF NOT EXISTS note_items_duplicates_0001 (LIKE note_items)",
+			"INSERT INTO notes_duplicates_0001 SELECT n.* FROM notes n "
+			"WHERE EXISTS (SELECT 1 FROM notes d WHERE d.access_key = n.access_key AND d.id < n.id)",
+			"INSERT INTO note_items_duplicates_0001 SELECT i.* FROM note_items i "
+			"JOIN notes_duplicates_0001 n ON n.id = i.note_id",
+			"DELETE FROM notes n USING notes d "
+			"WHERE n.access_key = d.access_key AND n.id > d.id "
+			"RETURNING n.id AS removed_note_id, n.access_key",
+			"CREATE UNIQUE INDEX IF NOT EXISTS uq_notes_access_key ON notes (access_key) "
+			"WHERE access_key IS NOT NULL",
+		],
+	),
+	(
+		"0002_notes_extractor_stage",
+		[
+			"ALTER TABLE notes ADD COLUMN IF NOT EXISTS extractor_stage VARCHAR(50)",
+		],
+	),
+	(
+		"0003_notes_content_hash",
+		[
+			"ALTER TABLE notes ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+			"CREATE INDEX IF NOT EXISTS ix_notes_content_hash ON notes (content_hash)",
+		],
+	),
+	(
+		"0004_admin_listing_indexes",
+		[
+			"CREATE INDEX IF NOT EXISTS ix_note_items_note_id ON note_items (note_id)",
+			"CREATE INDEX IF NOT EXISTS ix_note_items_ncm ON note_items (ncm)",
+			"CREATE INDEX IF NOT EXISTS ix_note_items_cfop ON note_items (cfop)",
+			"CREATE INDEX IF NOT EXISTS ix_notes_date_of_issue_id ON notes (date_of_issue, id)",
+			# pg_trgm vem no contrib (presente na imagem oficial); sem ele a busca só perde o índice.
+			"DO $$ BEGIN "
+			"IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN "
+			"CREATE EXTENSION IF NOT EXISTS pg_trgm; "
+			"CREATE INDEX IF NOT EXISTS ix_notes_provider_trgm ON notes USING gin (provider gin_trgm_ops); "
+			"CREATE INDEX IF NOT EXISTS ix_note_items_product_name_trgm ON note_items "
+			"USING gin (product_name gin_trgm_ops); "
+			"ELSE RAISE WARNING 'pg_trgm indisponível: índices de busca por trigramas não criados'; "
+			"END IF; END $$",
+			"ANALYZE notes",
+			"ANALYZE note_items",
+		],
+	),
+	(
+		"0005_reports_backfill",
+		[
+			"CREATE INDEX IF NOT EXISTS ix_notes_issuer_cnpj_date_of_issue ON notes (issuer_cnpj, date_of_issue)",
+			# As tabelas report_* são criadas pelo create_all; aqui só o cálculo inicial,
+			# depois mantido de forma incremental por app.services.reports_service.
+			"INSERT INTO report_issuer_monthly (issuer_cnpj, month, provider, notes_count, total_value) "
+			"SELECT COALESCE(issuer_cnpj, ''), date_trunc('month', date_of_issue)::date, "
+			"max(provider), count(*), sum(total_value) "
+			"FROM notes GROUP BY 1, 2 "
+			"ON CONFLICT DO NOTHING",
+			"INSERT INTO report_item_monthly (issuer_cnpj, month, ncm, cfop, items_count, quantity, "
+			"gross_value, discount_value, icms_value, ipi_value) "
+			"SELECT COALESCE(n.issuer_cnpj, ''), date_trunc('month', n.date_of_issue)::date, "
+			"COALESCE(i.ncm, ''), COALESCE(i.cfop, ''), count(*), COALESCE(sum(i.quantity), 0), "
+			"COALESCE(sum(i.quantity * i.unit_value), 0), COALESCE(sum(i.discount_value), 0), "
+			"COALESCE(sum(i.icms_value), 0), COALESCE(sum(i.ipi_value), 0) "
+			"FROM note_items i JOIN notes n ON n.id = i.note_id GROUP BY 1, 2, 3, 4 "
+			"ON CONFLICT DO NOTHING",
+		],
+	),
+	(
+		"0006_notes_storage_key",
+		[
+			"ALTER TABLE notes ADD COLUMN IF NOT EXISTS storage_key VARCHAR(255)",
+		],
+	),
+	(
+		"0007_notes_preprocess_stats",
+		[
+			"ALTER TABLE notes ADD COLUMN IF NOT EXISTS source_size INTEGER",
+			"ALTER TABLE notes ADD COLUMN IF NOT EXISTS payload_size INTEGER",
+			"ALTER TABLE notes ADD COLUMN IF NOT EXISTS preprocess_ms INTEGER",
+		],
+	),
+]
+
+
+async def run_migrations(conn: AsyncConnection) -> None:
+	"""Aplica, dentro da transação de `conn`, as migrações ainda não registradas."""
+	await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": _MIGRATIONS_LOCK_ID})
+	await conn.execute(text(
+		"CREATE TABLE IF NOT EXISTS schema_migrations ("
+		"name VARCHAR(100) PRIMARY KEY, "
+		"applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+	))
+
+	applied = set((await conn.execute(text("SELECT name FROM schema_migrations"))).scalars())
+	for name, statements in MIGRATIONS:
+		if name in applied:
+			continue
+
+		logger.info(f"🧱 Aplicando migração {name}")
+		for statement in statements:
+			result = await conn.execute(text(statement))
+			# Passos com RETURNING (remoção de dados) deixam no log o que foi afetado.
+			if result.returns_rows:
+				for row in result.mappings():
+					logger.warning(f"⚠️ Migração {name}: {dict(row)}")
+		await conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
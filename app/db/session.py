@@ -1,11 +1,26 @@
-from typing import AsyncGenerator
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 
 from app.core.config import settings
 from app.db.base import Base
+from app.db.migrations import run_migrations
 
-async_engine = create_async_engine(settings.sqlalchemy_database_uri, future=True)
+async_engine = create_async_engine(
+	settings.sqlalchemy_database_uri,
+	future=True,
+	pool_size=settings.db_pool_size,
+	max_overflow=settings.db_max_overflow,
+	pool_timeout=settings.db_pool_timeout_seconds,
+	pool_recycle=settings.db_pool_recycle_seconds,
+	pool_pre_ping=settings.db_pool_pre_ping,
+	connect_args={
+		# Cache do SQLAlchemy (por conexão) e do próprio asyncpg.
+		"prepared_statement_cache_size": settings.db_statement_cache_size,
+		"statement_cache_size": settings.db_statement_cache_size,
+	},
+)
 
 AsyncSessionLocal = async_sessionmaker(
 	async_engine,
@@ -28,9 +43,27 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
 			await session.close()
 
 
+@asynccontextmanager
+async def job_session() -> AsyncIterator[AsyncSession]:
+	"""
+	Sessão própria de um job (worker, ingestão em lote), nunca compartilhada entre
+	tarefas concorrentes. Em erro a transação é desfeita; a conexão volta ao pool
+	ao sair do bloco em qualquer caso.
+	"""
+	session = AsyncSessionLocal()
+	try:
+		yield session
+	except BaseException:
+		await session.rollback()
+		raise
+	finally:
+		await session.close()
+
+
 async def init_db():
 	"""Inicializa o banco de dados (cria tabelas se necessário)."""
 	import app.models  # noqa: F401
 
 	async with async_engine.begin() as conn:
 		await conn.run_sync(Base.metadata.create_all)
+		await run_migrations(conn)
@@ -1,3 +1,173 @@
+"""
+Armazenamento dos documentos originais (PDF das notas).
+
+As chaves são endereçadas pelo conteúdo (`<prefixo><sha256[:2]>/<sha256>.pdf`):
+o mesmo arquivo recebido várias vezes é gravado uma vez só, e réplicas do bot
+compartilham o mesmo bucket. O backend S3 (AWS, MinIO, R2...) entrega downloads
+por URL pré-assinada, sem passar os bytes pelo processo da aplicação; o backend
+local existe para desenvolvimento e instâncias únicas.
+
+`note_storage` é o storage legado da coluna `Note.pdf_file` (fastapi-storages).
+"""
+import asyncio
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from functools import cached_property
+from pathlib import Path
+from typing import Optional
+
 from fastapi_storages import FileSystemStorage
 
+from app.core.config import settings
+
 note_storage = FileSystemStorage(path="/tmp/notes")
+
+
+def content_key(content_hash: str, suffix: str = ".pdf") -> str:
+	return f"{settings.storage_key_prefix}{content_hash[:2]}/{content_hash}{suffix}"
+
+
+class DocumentStorage(ABC):
+	@abstractmethod
+	async def save(
+			self,
+			data: bytes,
+			content_hash: str,
+			content_type: str = "application/pdf",
+			suffix: str = ".pdf",
+	) -> str:
+		"""Grava o documento (se ainda não existir) e retorna a chave."""
+
+	@abstractmethod
+	async def load(self, key: str) -> bytes:
+		"""Lê o documento inteiro."""
+
+	@abstractmethod
+	async def presigned_url(self, key: str, filename: Optional[str] = None) -> Optional[str]:
+		"""URL temporária de download, ou `None` quando o backend não oferece."""
+
+	def local_path(self, key: str) -> Optional[Path]:
+		"""Caminho no disco, para backends que servem o arquivo pelo próprio processo."""
+		return None
+
+
+class LocalDocumentStorage(DocumentStorage):
+	def __init__(self, root: str) -> None:
+		self.root = Path(root)
+
+	def local_path(self, key: str) -> Path:
+		path = (self.root / key).resolve()
+		if not path.is_relative_to(self.root.resolve()):
+			raise ValueError(f"Chave de documento inválida: {key}")
+		return path
+
+	async def save(
+			self,
+			data: bytes,
+			content_hash: str,
+			content_type: str = "application/pdf",
+			suffix: str = ".pdf",
+	) -> str:
+		key = content_key(content_hash, suffix)
+		await asyncio.to_thread(self._write, self.local_path(key), data)
+		return key
+
+	async def load(self, key: str) -> bytes:
+		return await asyncio.to_thread(self.local_path(key).read_bytes)
+
+	@staticmethod
+	def _write(path: Path, data: bytes) -> None:
+		if path.exists():
+			return
+		path.parent.mkdir(parents=True, exist_ok=True)
+		# Escreve num temporário e renomeia: leitores nunca veem um arquivo pela metade.
+		fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".part")
+		try:
+			with os.fdopen(fd, "wb") as f:
+				f.write(data)
+			os.replace(tmp, path)
+		except BaseException:
+			os.unlink(tmp)
+			raise
+
+	async def presigned_url(self, key: str, filename: Optional[str] = None) -> Optional[str]:
+		return None
+
+
+class S3DocumentStorage(DocumentStorage):
+	"""Bucket S3-compatível via boto3; as chamadas bloqueantes rodam em `asyncio.to_thread`."""
+
+	def __init__(self, bucket: str) -> None:
+		self.bucket = bucket
+
+	@cached_property
+	def client(self):
+		# boto3 é importado sob demanda: o backend local não precisa dele carregado.
+		import boto3
+		from botocore.config import Config
+
+		return boto3.client(
+			"s3",
+			endpoint_url=settings.storage_s3_endpoint_url,
+			region_name=settings.storage_s3_region,
+			aws_access_key_id=settings.storage_s3_access_key_id,
+			aws_secret_access_key=settings.storage_s3_secret_access_key,
+			config=Config(
+				signature_version="s3v4",
+				s3={"addressing_style": "path" if settings.storage_s3_endpoint_url else "auto"},
+				max_pool_connections=settings.storage_s3_max_connections,
+				retries={"max_attempts": 3, "mode": "standard"},
+			),
+		)
+
+	async def save(
+			self,
+			data: bytes,
+			content_hash: str,
+			content_type: str = "application/pdf",
+			suffix: str = ".pdf",
+	) -> str:
+		key = content_key(content_hash, suffix)
+		await asyncio.to_thread(self._put, key, data, content_type)
+		return key
+
+	async def load(self, key: str) -> bytes:
+		return await asyncio.to_thread(self._get, key)
+
+	def _get(self, key: str) -> bytes:
+		return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+	def _put(self, key: str, data: bytes, content_type: str) -> None:
+		from botocore.exceptions import ClientError
+
+		try:
+			self.client.head_object(Bucket=self.bucket, Key=key)
+			return
+		except ClientError as exc:
+			if exc.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+				raise
+		self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+	async def presigned_url(self, key: str, filename: Optional[str] = None) -> Optional[str]:
+		params = {"Bucket": self.bucket, "Key": key}
+		if filename:
+			params["ResponseContentDisposition"] = f'inline; filename="{filename}"'
+		# Assinatura local (sem rede), mas a criação do client pode ler credenciais do ambiente.
+		return await asyncio.to_thread(
+			self.client.generate_presigned_url,
+			"get_object",
+			Params=params,
+			ExpiresIn=settings.storage_presign_expiry_seconds,
+		)
+
+
+def _build_document_storage() -> DocumentStorage:
+	if settings.storage_backend == "s3":
+		if not settings.storage_s3_bucket:
+			raise RuntimeError("STORAGE_BACKEND=s3 exige STORAGE_S3_BUCKET")
+		return S3DocumentStorage(settings.storage_s3_bucket)
+	return LocalDocumentStorage(settings.storage_local_path)
+
+
+document_storage: DocumentStorage = _build_document_storage()
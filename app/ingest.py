@@ -0,0 +1,57 @@
+"""
+Ingestão em lote pela linha de comando.
+
+Uso: python -m app.ingest <arquivo|diretório|.zip> [--concurrency N]
+
+Pode ser interrompido e executado novamente: documentos cujo hash já está
+registrado são pulados.
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+
+from app.core.config import settings
+from app.core.logging import setup_logging
+from app.db.session import async_engine, init_db
+from app.services.ingest_service import BatchIngestor, BatchProgress, UnsafeArchiveError, iter_documents
+
+setup_logging(stream=sys.stderr, level="WARNING")
+
+
+async def print_progress(progress: BatchProgress) -> None:
+	print(
+		f"\r{progress.processed}/{progress.discovered} processados | "
+		f"{progress.created} novos | {progress.duplicates} duplicados | "
+		f"{progress.skipped} pulados | {progress.failed} com erro",
+		end="",
+		flush=True,
+	)
+
+
+async def main(path: Path, concurrency: int) -> int:
+	await init_db()
+	try:
+		progress = await BatchIngestor(concurrency=concurrency, on_progress=print_progress).run(iter_documents(path))
+	except UnsafeArchiveError as e:
+		print(f"\nerro: {e}")
+		return 1
+	finally:
+		await async_engine.dispose()
+
+	print()
+	for error in progress.errors:
+		print(f"  erro: {error}")
+	return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Ingestão em lote de notas fiscais (PDF/XML/.zip)")
+	parser.add_argument("path", type=Path)
+	parser.add_argument("--concurrency", type=int, default=settings.ingest_concurrency)
+	args = parser.parse_args()
+
+	if not args.path.exists():
+		parser.error(f"{args.path} não existe")
+	sys.exit(asyncio.run(main(args.path, args.concurrency)))
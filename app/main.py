@@ -1,4 +1,3 @@
-import sys
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
@@ -6,21 +5,19 @@ from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 
 from app.admin import init_admin
+from app.api.ingest import router as ingest_router
+from app.api.metrics import router as metrics_router
+from app.api.reports import router as reports_router
 from app.api.webhook import router
-from app.db.session import init_db, async_engine
+from app.core.config import settings
+from app.core.logging import setup_logging
+from app.core.metrics import register_pool_collector
+from app.core.tracing import setup_tracing, shutdown_tracing
+from app.db.session import AsyncSessionLocal, init_db, async_engine
+from app.services.access_key import known_access_keys
+from app.services.evolution.evolution_integration import evolution_clients
 
-logger.remove()
-logger.add(
-	sys.stdout,
-	format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan> | <level>{message}</level>",
-	level="INFO"
-)
-logger.add(
-	"logs/app_{time}.log",
-	rotation="500 MB",
-	retention="10 days",
-	level="DEBUG"
-)
+setup_logging(log_file=settings.log_file)
 
 
 @asynccontextmanager
@@ -32,8 +29,22 @@ async def lifespan(app: FastAPI):
 	await init_db()
 	logger.info("✅ Banco de dados inicializado com sucesso.")
 
+	async with AsyncSessionLocal() as db:
+		await known_access_keys.warm(db)
+
+	if settings.evolution_webhook_url:
+		for instance in evolution_clients.instances:
+			try:
+				await evolution_clients.get(instance).set_webhook(settings.evolution_webhook_url, settings.evolution_webhook_events)
+				logger.info(f"🔗 Webhook da instância {instance} registrado para {settings.evolution_webhook_events}")
+			except Exception as e:
+				logger.warning(f"Não foi possível registrar o webhook da instância {instance} na Evolution: {e}")
+
 	yield
 	logger.info("🛑 Finalizando aplicação")
+	await evolution_clients.close()
+	shutdown_tracing()
+	await logger.complete()
 
 
 app = FastAPI(
@@ -54,8 +65,13 @@ app.add_middleware(
 	allow_headers=["*"],
 )
 
+setup_tracing("nf_bot_zap-api", async_engine)
 init_admin(app, async_engine)
+register_pool_collector(async_engine, evolution_clients.pool_clients)
 app.include_router(router, prefix="/evolution", tags=["Webhook Evolution"])
+app.include_router(ingest_router, prefix="/ingest", tags=["Ingestão em lote"])
+app.include_router(reports_router, prefix="/reports", tags=["Relatórios"])
+app.include_router(metrics_router, tags=["Métricas"])
 
 if __name__ == "__main__":
 	import uvicorn
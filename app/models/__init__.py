@@ -1,3 +1,4 @@
 from app.models.notes import Note, ItemNote
+from app.models.reports import IssuerMonthlyReport, ItemMonthlyReport
 
-__all__ = ["Note", "ItemNote"]
+__all__ = ["Note", "ItemNote", "IssuerMonthlyReport", "ItemMonthlyReport"]
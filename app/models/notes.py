@@ -1,5 +1,5 @@
 from fastapi_storages.integrations.sqlalchemy import FileType
-from sqlalchemy import Column, Integer, String, Date, Numeric, Text, DateTime, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Date, Numeric, Text, DateTime, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 
 from app.db.base import Base
@@ -26,10 +26,28 @@ class Note(Base):
 	total_value = Column(Numeric(12, 2), nullable=False)
 	pdf_url = Column(Text, nullable=False)
 	pdf_file = Column(FileType(storage=note_storage))
+	extractor_stage = Column(String(50), nullable=True)
+	content_hash = Column(String(64), nullable=True, index=True)
+	storage_key = Column(String(255), nullable=True)
+	source_size = Column(Integer, nullable=True)
+	payload_size = Column(Integer, nullable=True)
+	preprocess_ms = Column(Integer, nullable=True)
 	created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 	items = relationship("ItemNote", back_populates="note", cascade="all, delete-orphan")
 
+	__table_args__ = (
+		Index(
+			"uq_notes_access_key",
+			access_key,
+			unique=True,
+			postgresql_where=access_key.isnot(None),
+		),
+		Index("ix_notes_date_of_issue_id", date_of_issue, id),
+		Index("ix_notes_issuer_cnpj_date_of_issue", issuer_cnpj, date_of_issue),
+		# ix_notes_provider_trgm (GIN/pg_trgm, para o ILIKE do admin) fica só na migração 0004.
+	)
+
 	def __str__(self) -> str:
 		return f"Nota {self.note_number} - {self.provider}"
 
@@ -53,5 +71,12 @@ class ItemNote(Base):
 
 	note = relationship("Note", back_populates="items")
 
+	__table_args__ = (
+		Index("ix_note_items_note_id", note_id),
+		Index("ix_note_items_ncm", ncm),
+		Index("ix_note_items_cfop", cfop),
+		# ix_note_items_product_name_trgm (GIN/pg_trgm) fica só na migração 0004.
+	)
+
 	def __str__(self) -> str:
 		return self.product_name
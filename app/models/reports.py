@@ -0,0 +1,42 @@
+from sqlalchemy import Column, Date, DateTime, Index, Integer, Numeric, String, func
+
+from app.db.base import Base
+
+
+class IssuerMonthlyReport(Base):
+	"""Totais de notas por emitente e mês de emissão (mantido por `reports_service`)."""
+
+	__tablename__ = "report_issuer_monthly"
+
+	issuer_cnpj = Column(String(20), primary_key=True, server_default="")
+	month = Column(Date, primary_key=True)
+	provider = Column(String(255), nullable=True)
+	notes_count = Column(Integer, nullable=False, server_default="0")
+	total_value = Column(Numeric(16, 2), nullable=False, server_default="0")
+	updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+	__table_args__ = (
+		Index("ix_report_issuer_monthly_month", month),
+	)
+
+
+class ItemMonthlyReport(Base):
+	"""Totais de itens por emitente, mês, NCM e CFOP, com ICMS/IPI (mantido por `reports_service`)."""
+
+	__tablename__ = "report_item_monthly"
+
+	issuer_cnpj = Column(String(20), primary_key=True, server_default="")
+	month = Column(Date, primary_key=True)
+	ncm = Column(String(20), primary_key=True, server_default="")
+	cfop = Column(String(10), primary_key=True, server_default="")
+	items_count = Column(Integer, nullable=False, server_default="0")
+	quantity = Column(Numeric(18, 4), nullable=False, server_default="0")
+	gross_value = Column(Numeric(18, 4), nullable=False, server_default="0")
+	discount_value = Column(Numeric(18, 4), nullable=False, server_default="0")
+	icms_value = Column(Numeric(18, 4), nullable=False, server_default="0")
+	ipi_value = Column(Numeric(18, 4), nullable=False, server_default="0")
+	updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+	__table_args__ = (
+		Index("ix_report_item_monthly_month", month),
+	)
@@ -0,0 +1,29 @@
+import time
+import uuid
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class DocumentJob(BaseModel):
+	"""Job compacto enfileirado pelo webhook para processamento de um documento recebido."""
+
+	id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+	message_id: str
+	phone_number: str
+	title: str
+	pdf_url: str
+	media_url: str | None = None
+	document_type: Literal["pdf", "xml", "image"] = "pdf"
+	# Instância da Evolution que recebeu a mensagem; `None` é a instância padrão.
+	instance: str | None = None
+	# Jobs da ingestão em lote: o documento já está no storage e o resultado vai para o progresso do lote.
+	batch_id: str | None = None
+	storage_key: str | None = None
+	# Adiado por cota da instância/global: a cota é cobrada (ou o job adiado de novo) quando ele sai da fila de atrasados.
+	quota_pending: bool = False
+	attempts: int = 0
+	enqueued_at: float = Field(default_factory=time.time)
+	last_error: str | None = None
+	# Contexto W3C (traceparent/tracestate) do webhook que originou o job.
+	trace_context: dict[str, str] = Field(default_factory=dict)
@@ -1,3 +1,4 @@
+import re
 from datetime import date, datetime
 from decimal import Decimal
 from typing import List, Optional
@@ -45,6 +46,13 @@ class NoteBase(BaseModel):
 	date_of_issue: date
 	total_value: Decimal
 	pdf_url: Optional[str] = None
+	extractor_stage: Optional[str] = None
+	content_hash: Optional[str] = None
+	storage_key: Optional[str] = None
+	# Bytes recebidos, bytes enviados ao extrator e tempo do pré-processamento.
+	source_size: Optional[int] = None
+	payload_size: Optional[int] = None
+	preprocess_ms: Optional[int] = None
 
 	@field_validator("date_of_issue", mode="before")
 	@classmethod
@@ -59,6 +67,14 @@ class NoteBase(BaseModel):
 					continue
 		raise ValueError("Formato de data inválido")
 
+	@field_validator("access_key", mode="before")
+	@classmethod
+	def normalize_access_key(cls, v):
+		if v is None:
+			return None
+		digits = re.sub(r"\D", "", str(v))
+		return digits or None
+
 
 class NoteCreate(NoteBase):
 	items: List[ItemNoteBase]
@@ -70,3 +86,10 @@ class NoteRead(NoteBase):
 	items: List[ItemNoteRead] = []
 
 	model_config = ConfigDict(from_attributes=True)
+
+
+class NoteProcessResult(BaseModel):
+	note_id: int
+	created: bool
+	access_key: Optional[str] = None
+	extractor_stage: Optional[str] = None
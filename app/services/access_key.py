@@ -0,0 +1,162 @@
+import io
+import re
+from typing import Optional
+
+from loguru import logger
+from pypdf import PdfReader
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.redis import get_redis_client
+from app.models.notes import Note
+
+# Modelo do documento fiscal (posições 21-22 da chave, tag `mod` do XML).
+NOTE_TYPE_BY_MODEL = {"55": "NFE", "65": "NFCE"}
+
+# A DANFE imprime a chave de acesso em 11 blocos de 4 dígitos separados por espaços.
+_ACCESS_KEY_RE = re.compile(r"(?<!\d)(?:\d[ .]?){43}\d(?!\d)")
+
+
+def is_valid_access_key(key: str) -> bool:
+	"""Valida o tamanho e o dígito verificador (módulo 11) da chave de acesso."""
+	if len(key) != 44 or not key.isdigit():
+		return False
+
+	total, weight = 0, 2
+	for digit in reversed(key[:43]):
+		total += int(digit) * weight
+		weight = 2 if weight == 9 else weight + 1
+
+	remainder = total % 11
+	dv = 0 if remainder < 2 else 11 - remainder
+	return dv == int(key[43])
+
+
+def find_access_key(text: str) -> Optional[str]:
+	for match in _ACCESS_KEY_RE.finditer(text):
+		candidate = re.sub(r"\D", "", match.group())
+		if is_valid_access_key(candidate):
+			return candidate
+	return None
+
+
+def extract_access_key_from_pdf(pdf_bytes: bytes, max_pages: int = 2) -> Optional[str]:
+	"""
+	Procura a chave de acesso na camada de texto das primeiras páginas do PDF.
+	PDFs escaneados (sem camada de texto) retornam None e seguem para o LLM.
+	"""
+	try:
+		reader = PdfReader(io.BytesIO(pdf_bytes))
+		for page in reader.pages[:max_pages]:
+			key = find_access_key(page.extract_text() or "")
+			if key:
+				return key
+	except Exception as e:
+		logger.warning(f"Não foi possível ler a camada de texto do PDF: {e}")
+	return None
+
+
+class KnownAccessKeys:
+	"""
+	Índice das chaves de acesso já registradas (chave de acesso -> id da nota).
+
+	Depois de `warm` carregar todas as chaves do banco, o hash no Redis ganha o
+	campo `_COMPLETE_FIELD` e passa a responder as ausências: chave nova não
+	consulta o banco. Chaves encontradas no hash são sempre confirmadas no índice
+	único `uq_notes_access_key` (uma consulta indexada), que continua sendo a fonte
+	da verdade; entradas que não batem com o banco são corrigidas na hora.
+
+	O índice é mantido por `add`/`remove`/`replace` (upsert e painel). Se uma
+	dessas gravações falhar, o marcador é removido e as ausências voltam a ser
+	confirmadas no banco até o próximo `warm`. Se o hash for perdido (eviction,
+	FLUSHDB) o marcador some junto.
+	"""
+
+	_COMPLETE_FIELD = "__complete__"
+	_WARM_BATCH = 5000
+
+	def __init__(self, redis_key: str = settings.known_access_keys_redis_key) -> None:
+		self.redis_key = redis_key
+		# Falso se nem a remoção do marcador funcionou: este processo deixa de confiar nele.
+		self._trust_complete = True
+
+	async def lookup(self, access_key: str, db: AsyncSession) -> Optional[int]:
+		"""Retorna o id da nota já registrada com esta chave, se existir."""
+		cached = None
+		try:
+			redis = await get_redis_client()
+			cached, complete = await redis.hmget(self.redis_key, [access_key, self._COMPLETE_FIELD])
+			if cached is None and complete is not None and self._trust_complete:
+				return None
+		except RedisError as e:
+			logger.warning(f"Índice de chaves de acesso indisponível no Redis: {e}")
+
+		note_id = await db.scalar(select(Note.id).where(Note.access_key == access_key))
+		if cached is not None and note_id != int(cached):
+			logger.warning(f"Índice de chaves de acesso desatualizado para {access_key}: {cached} -> {note_id}")
+			if note_id is None:
+				await self.remove(access_key)
+		if note_id is not None and cached != str(note_id):
+			await self.add(access_key, note_id)
+		return note_id
+
+	async def warm(self, db: AsyncSession) -> None:
+		"""Copia todas as chaves do banco para o Redis, se o índice ainda não estiver completo."""
+		try:
+			redis = await get_redis_client()
+			if self._trust_complete and await redis.hexists(self.redis_key, self._COMPLETE_FIELD):
+				return
+			total = 0
+			result = await db.stream(
+				select(Note.access_key, Note.id)
+				.where(Note.access_key.isnot(None))
+				.execution_options(yield_per=self._WARM_BATCH)
+			)
+			async for rows in result.partitions(self._WARM_BATCH):
+				await redis.hset(self.redis_key, mapping={key: note_id for key, note_id in rows})
+				total += len(rows)
+			# Notas criadas durante a carga já foram gravadas por `add` depois do commit.
+			await redis.hset(self.redis_key, self._COMPLETE_FIELD, 1)
+			self._trust_complete = True
+			logger.info(f"🔑 Índice de chaves de acesso carregado no Redis ({total} chaves)")
+		except RedisError as e:
+			logger.warning(f"Falha ao carregar o índice de chaves de acesso no Redis: {e}")
+
+	async def add(self, access_key: str, note_id: int) -> None:
+		try:
+			redis = await get_redis_client()
+			await redis.hset(self.redis_key, access_key, note_id)
+		except RedisError as e:
+			logger.warning(f"Falha ao registrar chave de acesso no Redis: {e}")
+			await self._mark_incomplete()
+
+	async def remove(self, access_key: str) -> None:
+		try:
+			redis = await get_redis_client()
+			await redis.hdel(self.redis_key, access_key)
+		except RedisError as e:
+			logger.warning(f"Falha ao remover chave de acesso do Redis: {e}")
+			await self._mark_incomplete()
+
+	async def _mark_incomplete(self) -> None:
+		"""O hash deixou de refletir o banco: ausências voltam a ser confirmadas até o próximo `warm`."""
+		try:
+			redis = await get_redis_client()
+			await redis.hdel(self.redis_key, self._COMPLETE_FIELD)
+		except RedisError as e:
+			self._trust_complete = False
+			logger.error(f"Não foi possível invalidar o índice de chaves de acesso no Redis: {e}")
+
+	async def replace(self, old_key: Optional[str], new_key: Optional[str], note_id: int) -> None:
+		"""Chave alterada no painel: a antiga deixa de apontar para a nota e a nova passa a apontar."""
+		if old_key == new_key:
+			return
+		if old_key:
+			await self.remove(old_key)
+		if new_key:
+			await self.add(new_key, note_id)
+
+
+known_access_keys: KnownAccessKeys = KnownAccessKeys()
@@ -0,0 +1,67 @@
+import time
+
+
+class CircuitOpenError(RuntimeError):
+	"""Levantada quando o circuito está aberto e a chamada nem chega a ser feita."""
+
+
+class CircuitBreaker:
+	"""
+	Circuit breaker simples (fechado -> aberto -> meio-aberto).
+
+	Após `failure_threshold` falhas consecutivas o circuito abre e as chamadas
+	falham imediatamente por `reset_timeout` segundos. Passado esse tempo, uma
+	chamada de teste é liberada: se der certo o circuito fecha, senão reabre.
+	"""
+
+	def __init__(self, failure_threshold: int, reset_timeout: float, name: str = "") -> None:
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.name = name
+		self._failures = 0
+		self._opened_at: float | None = None
+		self._half_open_in_flight = False
+
+	@property
+	def state(self) -> str:
+		if self._opened_at is None:
+			return "closed"
+		if time.monotonic() - self._opened_at >= self.reset_timeout:
+			return "half_open"
+		return "open"
+
+	def before_call(self) -> bool:
+		"""
+		Libera (ou bloqueia) uma chamada. Retorna True se ela é a chamada de teste do
+		meio-aberto; o chamador repassa esse valor a `record_*` e `release`.
+		"""
+		state = self.state
+		if state == "open" or (state == "half_open" and self._half_open_in_flight):
+			raise CircuitOpenError(f"Circuito '{self.name}' aberto: chamada bloqueada")
+		if state == "half_open":
+			self._half_open_in_flight = True
+			return True
+		return False
+
+	def release(self, probe: bool) -> None:
+		"""
+		Encerra a chamada iniciada em `before_call`. Se a chamada de teste terminou
+		sem veredito (exceção que não é falha da Evolution, cancelamento), libera o
+		meio-aberto para a próxima tentativa em vez de bloquear o circuito para sempre.
+		Chamadas comuns que terminam durante o teste não mexem nele.
+		"""
+		if probe:
+			self._half_open_in_flight = False
+
+	def record_success(self, probe: bool = False) -> None:
+		self._failures = 0
+		self._opened_at = None
+		if probe:
+			self._half_open_in_flight = False
+
+	def record_failure(self, probe: bool = False) -> None:
+		self._failures += 1
+		if probe:
+			self._half_open_in_flight = False
+		if self._opened_at is not None or self._failures >= self.failure_threshold:
+			self._opened_at = time.monotonic()
@@ -1,57 +1,250 @@
+import importlib.util
+import time
 from typing import Any, Dict, List, Optional
 
 import httpx
 from loguru import logger
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 
 from app.core.config import settings
+from app.core.metrics import EVOLUTION_REQUEST_DURATION, MEDIA_DOWNLOAD_BYTES, MEDIA_DOWNLOAD_DURATION, observe
+from app.core.tracing import http_span
+from app.services.evolution.circuit_breaker import CircuitBreaker
+from app.services.evolution.media import JsonBase64FieldReader, MediaBuffer
+
+# Erros em que a requisição comprovadamente não chegou ao servidor: seguros para
+# repetir mesmo em chamadas que não são idempotentes (envio de mensagens).
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def _is_retryable(exc: BaseException, idempotent: bool) -> bool:
+	if isinstance(exc, _NOT_SENT_ERRORS):
+		return True
+	if not idempotent:
+		return False
+	if isinstance(exc, httpx.HTTPStatusError):
+		return exc.response.status_code >= 500
+	return isinstance(exc, httpx.TransportError)
+
+
+def _payload_summary(payload: Dict[str, Any]) -> Dict[str, Any]:
+	"""Chaves do payload com o tamanho dos valores longos (mídia em base64, textos) no lugar do conteúdo."""
+	return {
+		key: f"<{len(value)} caracteres>" if isinstance(value, str) and len(value) > 64 else value
+		for key, value in payload.items()
+	}
 
 
 class EvolutionIntegration:
 	"""
 	Client to interact with the Evolution API.
 	https://doc.evolution-api.com/v2/pt/get-started/introduction
+
+	Cada instância tem o próprio client (ver `EvolutionClientRegistry`). O
+	`httpx.AsyncClient` é criado sob demanda com pool e keep-alive explícitos e
+	deve ser fechado com `close()` no encerramento da aplicação (lifespan/worker).
 	"""
 
-	def __init__(self):
+	def __init__(self, instance_name: str = settings.evolution_instance_name, api_key: str | None = None):
 		self.base_url = settings.evolution_api_url
-		self.api_key = settings.authentication_api_key
-		self.instance_name = settings.evolution_instance_name
+		self.api_key = api_key or settings.authentication_api_key
+		self.instance_name = instance_name
 		self.headers = {
 			"apikey": self.api_key,
 			"Content-Type": "application/json",
 		}
-		self._client = httpx.AsyncClient(timeout=20.0)
+		self.send_timeout = httpx.Timeout(
+			settings.evolution_send_timeout_seconds,
+			connect=settings.evolution_connect_timeout_seconds,
+		)
+		self.media_timeout = httpx.Timeout(
+			settings.evolution_media_timeout_seconds,
+			connect=settings.evolution_connect_timeout_seconds,
+		)
+		self.circuit_breaker = CircuitBreaker(
+			failure_threshold=settings.evolution_circuit_failure_threshold,
+			reset_timeout=settings.evolution_circuit_reset_seconds,
+			name=f"evolution:{instance_name}",
+		)
+		self._client: httpx.AsyncClient | None = None
+
+	@property
+	def client(self) -> httpx.AsyncClient:
+		if self._client is None:
+			http2 = settings.evolution_http2
+			if http2 and importlib.util.find_spec("h2") is None:
+				logger.warning("[Evolution] EVOLUTION_HTTP2 ativo, mas o pacote 'h2' não está instalado; usando HTTP/1.1")
+				http2 = False
+
+			self._client = httpx.AsyncClient(
+				headers=self.headers,
+				timeout=self.send_timeout,
+				http2=http2,
+				limits=httpx.Limits(
+					max_connections=settings.evolution_max_connections,
+					max_keepalive_connections=settings.evolution_max_keepalive_connections,
+					keepalive_expiry=settings.evolution_keepalive_expiry_seconds,
+				),
+			)
+		return self._client
+
+	@property
+	def active_client(self) -> httpx.AsyncClient | None:
+		"""Client atual, sem criá-lo (usado pelas métricas de pool)."""
+		return self._client
 
 	async def close(self):
-		await self._client.aclose()
+		if self._client is not None:
+			await self._client.aclose()
+			self._client = None
 
-	async def _post(self, path: str, json: Dict[str, Any]) -> Dict[str, Any]:
+	async def _post(
+			self,
+			path: str,
+			json: Dict[str, Any],
+			timeout: httpx.Timeout | None = None,
+			idempotent: bool = False,
+	) -> Dict[str, Any]:
 		url = f"{self.base_url}{path}/{self.instance_name}"
 
+		with observe(EVOLUTION_REQUEST_DURATION, endpoint=path, status="error") as labels:
+			async for attempt in self._retrying(idempotent):
+				with attempt:
+					result = await self._send(url, json, timeout or self.send_timeout)
+			labels["status"] = "ok"
+		return result
+
+	@staticmethod
+	def _retrying(idempotent: bool) -> AsyncRetrying:
+		return AsyncRetrying(
+			stop=stop_after_attempt(settings.evolution_max_attempts),
+			wait=wait_random_exponential(multiplier=0.5, max=5),
+			retry=retry_if_exception(lambda exc: _is_retryable(exc, idempotent)),
+			reraise=True,
+		)
+
+	async def _send(self, url: str, json: Dict[str, Any], timeout: httpx.Timeout) -> Dict[str, Any]:
+		probe = self.circuit_breaker.before_call()
 		try:
-			resp = await self._client.post(url, headers=self.headers, json=json)
-			resp.raise_for_status()
+			with http_span("POST", url) as (span, headers):
+				resp = await self.client.post(url, json=json, timeout=timeout, headers=headers)
+				span.set_attribute("http.response.status_code", resp.status_code)
+				resp.raise_for_status()
+			self.circuit_breaker.record_success(probe)
 			return resp.json()
 
 		except httpx.HTTPStatusError as exc:
+			if exc.response.status_code >= 500:
+				self.circuit_breaker.record_failure(probe)
+			else:
+				self.circuit_breaker.record_success(probe)
 			logger.error(
-				"[Evolution] HTTP error %s for %s payload=%s body=%s",
+				"[Evolution] HTTP error {} for {} payload={} body={}",
 				exc.response.status_code,
 				url,
-				json,
-				exc.response.text,
+				_payload_summary(json),
+				exc.response.text[:500],
 			)
 			raise
 
 		except httpx.RequestError as exc:
+			self.circuit_breaker.record_failure(probe)
 			logger.error(
-				"[Evolution] Request error for %s payload=%s detail=%s",
+				"[Evolution] Request error for {} payload={} detail={}",
 				url,
-				json,
+				_payload_summary(json),
 				str(exc),
 			)
 			raise
 
+		finally:
+			self.circuit_breaker.release(probe)
+
+	async def download_media(self, message_id: str, media_url: str | None = None) -> MediaBuffer:
+		"""
+		Baixa a mídia de uma mensagem direto para um `MediaBuffer`, sem montar o
+		documento inteiro em memória.
+
+		Com `media_url` (a `mediaUrl` que a Evolution publica quando o storage S3/MinIO
+		está ativo) os bytes crus são baixados em streaming. Sem ela, a resposta de
+		`getBase64FromMediaMessage` é lida em pedaços e o base64 decodificado à medida
+		que chega. O chamador deve fechar o buffer.
+		"""
+		t0 = time.perf_counter()
+		async for attempt in self._retrying(idempotent=True):
+			with attempt:
+				media = MediaBuffer()
+				try:
+					if media_url:
+						await self._stream_into(media, "GET", media_url, headers={"apikey": self.api_key})
+					else:
+						reader = JsonBase64FieldReader(media)
+						await self._stream_into(
+							media,
+							"POST",
+							f"{self.base_url}/chat/getBase64FromMediaMessage/{self.instance_name}",
+							json={"message": {"key": {"id": message_id}}, "convertToMp4": False},
+							reader=reader,
+						)
+						if not reader.found:
+							raise ValueError(f"Resposta da Evolution sem base64 para a mensagem {message_id}")
+				except BaseException:
+					media.close()
+					raise
+
+		elapsed = time.perf_counter() - t0
+		MEDIA_DOWNLOAD_DURATION.labels(source="media_url" if media_url else "base64").observe(elapsed)
+		MEDIA_DOWNLOAD_BYTES.observe(media.size)
+		logger.bind(event="media_downloaded").info(
+			"[Evolution] Mídia {} baixada: {} bytes em {:.2f}s ({}); mídia viva no processo: {}",
+			message_id,
+			media.size,
+			elapsed,
+			"memória" if media.in_memory else "disco",
+			MediaBuffer.stats(),
+		)
+		return media
+
+	async def _stream_into(
+			self,
+			media: MediaBuffer,
+			method: str,
+			url: str,
+			reader: JsonBase64FieldReader | None = None,
+			**kwargs: Any,
+	) -> None:
+		probe = self.circuit_breaker.before_call()
+		try:
+			with http_span(method, url, inject=False) as (span, _):
+				async with self.client.stream(method, url, timeout=self.media_timeout, **kwargs) as resp:
+					span.set_attribute("http.response.status_code", resp.status_code)
+					if resp.is_error:
+						await resp.aread()
+					resp.raise_for_status()
+					async for chunk in resp.aiter_bytes(settings.media_chunk_size):
+						if reader is None:
+							media.write(chunk)
+						else:
+							reader.feed(chunk)
+				span.set_attribute("nfbot.media.size", media.size)
+			self.circuit_breaker.record_success(probe)
+
+		except httpx.HTTPStatusError as exc:
+			if exc.response.status_code >= 500:
+				self.circuit_breaker.record_failure(probe)
+			else:
+				self.circuit_breaker.record_success(probe)
+			logger.error("[Evolution] HTTP error {} ao baixar mídia de {}", exc.response.status_code, url)
+			raise
+
+		except httpx.RequestError as exc:
+			self.circuit_breaker.record_failure(probe)
+			logger.error("[Evolution] Request error ao baixar mídia de {} detail={}", url, str(exc))
+			raise
+
+		finally:
+			self.circuit_breaker.release(probe)
+
 	async def get_base64_from_media_message(self, message_id: str) -> str:
 		"""
 		Gets the base64 representation of a media message by its ID.
@@ -62,20 +255,43 @@ class EvolutionIntegration:
 			"message": {"key": {"id": message_id}},
 			"convertToMp4": False,
 		}
-		resp = await self._post("/chat/getBase64FromMediaMessage", payload)
+		resp = await self._post(
+			"/chat/getBase64FromMediaMessage",
+			payload,
+			timeout=self.media_timeout,
+			idempotent=True,
+		)
 		return resp.get("base64", "")
 
-	async def send_text_message(self, phone_number: str, message: str) -> dict:
+	async def set_webhook(self, url: str, events: List[str]) -> dict:
+		"""
+		Registra o webhook da instância só com os eventos que o bot trata e sem
+		mídia em base64 no corpo (a mídia é baixada sob demanda pelo worker).
+		"""
+		payload: Dict[str, Any] = {
+			"webhook": {
+				"enabled": True,
+				"url": url,
+				"webhookByEvents": False,
+				"webhookBase64": False,
+				"events": events,
+			}
+		}
+		return await self._post("/webhook/set", payload, idempotent=True)
+
+	async def send_text_message(self, phone_number: str, message: str, delay: int | None = None) -> dict:
 		"""
 		Sends a text message to the specified phone number via the Evolution API.
+		Respostas do bot devem passar por `reply_outbox`, que agrupa e controla o ritmo.
 		:param phone_number:
 		:param message:
+		:param delay: ms de "digitando..." antes do envio (padrão `EVOLUTION_SEND_DELAY_MS`)
 		:return:
 		"""
 		payload: dict = {
 			"number": phone_number,
 			"text": message,
-			"delay": 1000,
+			"delay": settings.evolution_send_delay_ms if delay is None else delay,
 		}
 		return await self._post("/message/sendText", payload)
 
@@ -288,4 +504,49 @@ class EvolutionIntegration:
 		return await self._post("/message/sendWhatsAppAudio", payload)
 
 
-evolution_client: EvolutionIntegration = EvolutionIntegration()
+class EvolutionClientRegistry:
+	"""
+	Clients da Evolution por instância (número de WhatsApp), indexados pelo campo
+	`instance` do webhook. Cada instância tem pool de conexões e circuit breaker
+	próprios: uma instância lenta ou fora do ar não consome as conexões das outras.
+	"""
+
+	def __init__(self) -> None:
+		self.default_instance = settings.evolution_instance_name
+		self._clients: Dict[str, EvolutionIntegration] = {
+			self.default_instance: EvolutionIntegration(self.default_instance),
+		}
+		for name, api_key in settings.evolution_instances.items():
+			self._clients.setdefault(name, EvolutionIntegration(name, api_key or None))
+
+	@property
+	def default(self) -> EvolutionIntegration:
+		return self._clients[self.default_instance]
+
+	@property
+	def instances(self) -> List[str]:
+		return list(self._clients)
+
+	def __contains__(self, instance: str) -> bool:
+		return instance in self._clients
+
+	def get(self, instance: str | None = None) -> EvolutionIntegration:
+		"""Client da instância; `None` é a instância padrão (jobs anteriores ao multi-instância)."""
+		if instance is None:
+			return self.default
+		try:
+			return self._clients[instance]
+		except KeyError:
+			raise KeyError(f"Instância da Evolution não configurada: {instance}") from None
+
+	def pool_clients(self) -> List[tuple[str, httpx.AsyncClient | None]]:
+		"""Pares (rótulo, client ativo) para o coletor de métricas de pool."""
+		return [(f"evolution:{name}", client.active_client) for name, client in self._clients.items()]
+
+	async def close(self) -> None:
+		for client in self._clients.values():
+			await client.close()
+
+
+evolution_clients: EvolutionClientRegistry = EvolutionClientRegistry()
+evolution_client: EvolutionIntegration = evolution_clients.default
@@ -0,0 +1,161 @@
+"""
+Buffers para download de mídia da Evolution API.
+
+Em vez de receber o documento como uma string base64 dentro de um JSON (≈33%
+maior, e ainda copiado para `str` e depois para `bytes`), os bytes são gravados
+em um `SpooledTemporaryFile`: arquivos pequenos ficam em memória e os grandes
+vão para disco a partir de `settings.media_spool_max_memory_bytes`. O SHA-256 e
+o tamanho são calculados durante o download.
+"""
+import base64
+import binascii
+import hashlib
+import tempfile
+from typing import BinaryIO, Dict
+
+from app.core.config import settings
+
+
+class MediaTooLargeError(ValueError):
+	"""Levantada quando a mídia ultrapassa `settings.media_max_bytes`."""
+
+
+class MediaBuffer:
+	# Contadores do processo: bytes de mídia vivos em memória/disco e o pico observado.
+	live_bytes = 0
+	peak_live_bytes = 0
+	live_buffers = 0
+
+	def __init__(
+			self,
+			max_bytes: int = settings.media_max_bytes,
+			spool_max_memory: int = settings.media_spool_max_memory_bytes,
+	) -> None:
+		self.max_bytes = max_bytes
+		self.size = 0
+		self._sha256 = hashlib.sha256()
+		self._file = tempfile.SpooledTemporaryFile(max_size=spool_max_memory)
+		self._closed = False
+		MediaBuffer.live_buffers += 1
+
+	def __enter__(self) -> "MediaBuffer":
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.close()
+
+	@property
+	def sha256(self) -> str:
+		return self._sha256.hexdigest()
+
+	@property
+	def in_memory(self) -> bool:
+		return not self._file._rolled
+
+	def write(self, chunk: bytes) -> None:
+		if not chunk:
+			return
+		if self.size + len(chunk) > self.max_bytes:
+			raise MediaTooLargeError(f"Mídia maior que o limite de {self.max_bytes} bytes")
+		self._file.write(chunk)
+		self._sha256.update(chunk)
+		self.size += len(chunk)
+		MediaBuffer.live_bytes += len(chunk)
+		MediaBuffer.peak_live_bytes = max(MediaBuffer.peak_live_bytes, MediaBuffer.live_bytes)
+
+	def stream(self) -> BinaryIO:
+		"""Arquivo posicionado no início, para leitores que aceitam streams (iterparse, upload)."""
+		self._file.seek(0)
+		return self._file
+
+	def read(self) -> bytes:
+		return self.stream().read()
+
+	def close(self) -> None:
+		if self._closed:
+			return
+		self._closed = True
+		self._file.close()
+		MediaBuffer.live_bytes -= self.size
+		MediaBuffer.live_buffers -= 1
+
+	@classmethod
+	def stats(cls) -> Dict[str, int]:
+		return {
+			"live_buffers": cls.live_buffers,
+			"live_bytes": cls.live_bytes,
+			"peak_live_bytes": cls.peak_live_bytes,
+		}
+
+
+class Base64StreamDecoder:
+	"""Decodifica base64 recebido em pedaços de tamanho arbitrário, gravando no buffer."""
+
+	def __init__(self, target: MediaBuffer) -> None:
+		self._target = target
+		self._pending = b""
+
+	def feed(self, data: bytes) -> None:
+		# JSON pode escapar "/" como "\/"; quebras de linha também são toleradas.
+		data = self._pending + data.replace(b"\\", b"").replace(b"\n", b"").replace(b"\r", b"")
+		usable = len(data) - len(data) % 4
+		self._pending = data[usable:]
+		if usable:
+			self._target.write(base64.b64decode(data[:usable], validate=True))
+
+	def finish(self) -> None:
+		if self._pending.rstrip(b"="):
+			raise binascii.Error("Base64 truncado no fim do stream")
+		self._pending = b""
+
+
+class JsonBase64FieldReader:
+	"""
+	Extrai o valor de um campo string base64 (ex.: `"base64": "..."`) de um corpo
+	JSON recebido em pedaços, sem montar o documento inteiro em memória.
+	"""
+
+	def __init__(self, target: MediaBuffer, field: str = "base64") -> None:
+		self._decoder = Base64StreamDecoder(target)
+		self._marker = f'"{field}"'.encode()
+		self._head = b""
+		self._state = "seek"
+		self.found = False
+
+	def feed(self, chunk: bytes) -> None:
+		if self._state == "done":
+			return
+		if self._state != "value":
+			chunk = self._seek_value(chunk)
+			if chunk is None:
+				return
+
+		end = chunk.find(b'"')
+		if end == -1:
+			self._decoder.feed(chunk)
+			return
+		self._decoder.feed(chunk[:end])
+		self._decoder.finish()
+		self._state = "done"
+		self.found = True
+
+	def _seek_value(self, chunk: bytes) -> bytes | None:
+		data = self._head + chunk
+		if self._state == "seek":
+			start = data.find(self._marker)
+			if start == -1:
+				# Mantém o final do bloco caso o nome do campo esteja dividido entre pedaços.
+				self._head = data[-len(self._marker):]
+				return None
+			data = data[start + len(self._marker):]
+			self._state = "colon"
+
+		stripped = data.lstrip(b" \t\r\n:")
+		if not stripped:
+			self._head = b""
+			return None
+		if not stripped.startswith(b'"'):
+			raise ValueError("Campo base64 da resposta não é uma string")
+		self._head = b""
+		self._state = "value"
+		return stripped[1:]
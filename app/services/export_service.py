@@ -0,0 +1,250 @@
+"""
+Exportação em streaming de notas e itens (CSV, XLSX e Parquet).
+
+As linhas vêm de um cursor do lado do servidor (`AsyncConnection.stream`) em
+blocos de `settings.export_chunk_size`, de modo que a memória fica constante
+independente do período exportado.
+
+- CSV é gerado e enviado bloco a bloco.
+- XLSX (`xlsxwriter`, modo `constant_memory`) e Parquet (`pyarrow`, um row group
+  por bloco) precisam do arquivo completo para fechar o formato: os blocos são
+  gravados em um arquivo temporário numa thread e o arquivo só é enviado depois
+  de pronto, ou seja, não há streaming: o primeiro byte sai quando a consulta
+  inteira terminou, e o disco precisa comportar o arquivo. As duas bibliotecas
+  estão fixadas no requirements.txt; numa instalação sem elas o formato fica
+  indisponível.
+"""
+import asyncio
+import csv
+import datetime
+import importlib.util
+import io
+import os
+import tempfile
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import Select, select
+
+from app.core.config import settings
+from app.db.session import async_engine
+from app.models.notes import ItemNote, Note
+
+EXPORT_COLUMNS: List[Tuple[str, Any]] = [
+	("note_id", Note.id),
+	("note_type", Note.note_type),
+	("note_number", Note.note_number),
+	("series", Note.series),
+	("access_key", Note.access_key),
+	("issuer_cnpj", Note.issuer_cnpj),
+	("issuer_state", Note.issuer_state),
+	("provider", Note.provider),
+	("date_of_issue", Note.date_of_issue),
+	("total_value", Note.total_value),
+	("item_id", ItemNote.id),
+	("product_name", ItemNote.product_name),
+	("product_code", ItemNote.product_code),
+	("ncm", ItemNote.ncm),
+	("cfop", ItemNote.cfop),
+	("quantity", ItemNote.quantity),
+	("unit_of_measure", ItemNote.unit_of_measure),
+	("unit_value", ItemNote.unit_value),
+	("discount_value", ItemNote.discount_value),
+	("icms_value", ItemNote.icms_value),
+	("ipi_value", ItemNote.ipi_value),
+]
+
+EXPORT_FORMATS: Dict[str, Tuple[str, Optional[str]]] = {
+	# formato: (content type, módulo opcional necessário)
+	"csv": ("text/csv; charset=utf-8", None),
+	"xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsxwriter"),
+	"parquet": ("application/vnd.apache.parquet", "pyarrow"),
+}
+
+Row = Sequence[Any]
+
+
+class ExportFormatUnavailableError(RuntimeError):
+	"""Formato conhecido, mas a biblioteca opcional que o gera não está instalada."""
+
+
+class ExportFilters(BaseModel):
+	date_from: Optional[datetime.date] = None
+	date_to: Optional[datetime.date] = None
+	issuer_cnpj: Optional[str] = None
+	ncm: Optional[str] = None
+	cfop: Optional[str] = None
+
+
+def available_formats() -> List[str]:
+	return [
+		name for name, (_, module) in EXPORT_FORMATS.items()
+		if module is None or importlib.util.find_spec(module) is not None
+	]
+
+
+def build_export_query(filters: ExportFilters) -> Select:
+	stmt = select(*(column for _, column in EXPORT_COLUMNS)).join(ItemNote, ItemNote.note_id == Note.id)
+	if filters.date_from:
+		stmt = stmt.where(Note.date_of_issue >= filters.date_from)
+	if filters.date_to:
+		stmt = stmt.where(Note.date_of_issue <= filters.date_to)
+	if filters.issuer_cnpj:
+		stmt = stmt.where(Note.issuer_cnpj == filters.issuer_cnpj)
+	if filters.ncm:
+		stmt = stmt.where(ItemNote.ncm == filters.ncm)
+	if filters.cfop:
+		stmt = stmt.where(ItemNote.cfop == filters.cfop)
+	return stmt.order_by(Note.date_of_issue, Note.id, ItemNote.id)
+
+
+async def iter_row_chunks(filters: ExportFilters, chunk_size: int = settings.export_chunk_size) -> AsyncIterator[List[Row]]:
+	"""Lê as linhas com cursor do lado do servidor, `chunk_size` por vez."""
+	async with async_engine.connect() as conn:
+		result = await conn.stream(build_export_query(filters).execution_options(yield_per=chunk_size))
+		async for partition in result.partitions(chunk_size):
+			yield partition
+
+
+def _csv_value(value: Any) -> Any:
+	return value.isoformat() if isinstance(value, datetime.date) else value
+
+
+async def _stream_csv(chunks: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	# BOM para o Excel reconhecer UTF-8 (acentos em nomes de produtos/fornecedores).
+	writer.writerow([name for name, _ in EXPORT_COLUMNS])
+	yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+
+	async for rows in chunks:
+		buffer.seek(0)
+		buffer.truncate()
+		writer.writerows([_csv_value(v) for v in row] for row in rows)
+		yield buffer.getvalue().encode("utf-8")
+
+
+class _XlsxFileWriter:
+	# Limite de linhas por planilha do Excel; o restante continua em novas abas.
+	MAX_ROWS = 1_048_576
+
+	def __init__(self, path: str) -> None:
+		import xlsxwriter
+
+		self._workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "tmpdir": tempfile.gettempdir()})
+		self._date_format = self._workbook.add_format({"num_format": "dd/mm/yyyy"})
+		self._sheets = 0
+		self._new_sheet()
+
+	def _new_sheet(self) -> None:
+		self._sheets += 1
+		self._sheet = self._workbook.add_worksheet(f"notas_{self._sheets}" if self._sheets > 1 else "notas")
+		self._sheet.write_row(0, 0, [name for name, _ in EXPORT_COLUMNS])
+		self._row = 0
+
+	def write(self, rows: List[Row]) -> None:
+		for row in rows:
+			if self._row + 1 >= self.MAX_ROWS:
+				self._new_sheet()
+			self._row += 1
+			for col, value in enumerate(row):
+				if value is None:
+					continue
+				if isinstance(value, datetime.date):
+					self._sheet.write_datetime(self._row, col, value, self._date_format)
+				else:
+					self._sheet.write(self._row, col, float(value) if isinstance(value, Decimal) else value)
+
+	def close(self) -> None:
+		self._workbook.close()
+
+
+class _ParquetFileWriter:
+	def __init__(self, path: str) -> None:
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+
+		self._pa = pa
+		self._schema = pa.schema([
+			("note_id", pa.int64()),
+			("note_type", pa.string()),
+			("note_number", pa.string()),
+			("series", pa.string()),
+			("access_key", pa.string()),
+			("issuer_cnpj", pa.string()),
+			("issuer_state", pa.string()),
+			("provider", pa.string()),
+			("date_of_issue", pa.date32()),
+			("total_value", pa.decimal128(12, 2)),
+			("item_id", pa.int64()),
+			("product_name", pa.string()),
+			("product_code", pa.string()),
+			("ncm", pa.string()),
+			("cfop", pa.string()),
+			("quantity", pa.decimal128(14, 4)),
+			("unit_of_measure", pa.string()),
+			("unit_value", pa.decimal128(12, 4)),
+			("discount_value", pa.decimal128(12, 4)),
+			("icms_value", pa.decimal128(12, 4)),
+			("ipi_value", pa.decimal128(12, 4)),
+		])
+		self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+	def write(self, rows: List[Row]) -> None:
+		columns = list(zip(*rows))
+		self._writer.write_batch(self._pa.RecordBatch.from_arrays(
+			[self._pa.array(values, type=field.type) for values, field in zip(columns, self._schema)],
+			schema=self._schema,
+		))
+
+	def close(self) -> None:
+		self._writer.close()
+
+
+_FILE_WRITERS = {"xlsx": _XlsxFileWriter, "parquet": _ParquetFileWriter}
+
+
+async def _stream_via_file(export_format: str, chunks: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+	fd, path = tempfile.mkstemp(prefix="nf_export_", suffix=f".{export_format}")
+	os.close(fd)
+	try:
+		writer = await asyncio.to_thread(_FILE_WRITERS[export_format], path)
+		try:
+			async for rows in chunks:
+				await asyncio.to_thread(writer.write, rows)
+		finally:
+			await asyncio.to_thread(writer.close)
+
+		with open(path, "rb") as fh:
+			while data := await asyncio.to_thread(fh.read, settings.export_read_size):
+				yield data
+	finally:
+		os.unlink(path)
+
+
+def stream_export(export_format: str, filters: ExportFilters) -> AsyncIterator[bytes]:
+	"""
+	Gera o arquivo exportado em pedaços, pronto para um `StreamingResponse`.
+	Só CSV é gerado enquanto é enviado; XLSX e Parquet são gravados por inteiro
+	num arquivo temporário e enviados depois de fechados.
+	"""
+	if export_format not in EXPORT_FORMATS:
+		raise ValueError(f"Formato de exportação desconhecido: {export_format}")
+	if export_format not in available_formats():
+		module = EXPORT_FORMATS[export_format][1]
+		raise ExportFormatUnavailableError(f"Exportação {export_format} requer o pacote '{module}'")
+
+	chunks = iter_row_chunks(filters)
+	if export_format == "csv":
+		return _stream_csv(chunks)
+	return _stream_via_file(export_format, chunks)
+
+
+def export_filename(export_format: str, filters: ExportFilters) -> str:
+	period = "_".join(str(d) for d in (filters.date_from, filters.date_to) if d) or "completo"
+	return f"notas_{period}.{export_format}"
+
+
+def export_content_type(export_format: str) -> str:
+	return EXPORT_FORMATS[export_format][0]
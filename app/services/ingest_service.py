@@ -0,0 +1,313 @@
+"""
+Ingestão em lote de documentos fiscais (backfill de clientes novos).
+
+Arquivos PDF/XML, soltos ou dentro de .zip, passam pelo mesmo pipeline de
+extração e persistência do webhook, com concorrência limitada. Documentos cujo
+hash SHA-256 já está registrado em `notes.content_hash` são pulados, o que
+torna a ingestão retomável: basta reenviar o mesmo lote.
+
+Pela API, `enqueue_batch` só grava cada documento no storage e publica um job
+no stream de lote (`batch_queue`); a extração roda nos workers, com prioridade
+de lote no agendador do Gemini, e cada resultado é somado ao progresso do lote
+no Redis. A CLI (`python -m app.ingest`) processa no próprio processo com
+`BatchIngestor`.
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, Iterator, List, Literal, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel, Field
+from redis.exceptions import RedisError
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.redis import get_redis_client
+from app.db.session import job_session
+from app.db.storage import document_storage
+from app.models.notes import Note
+from app.schemas.jobs import DocumentJob
+from app.services.langchain.scheduler import Priority
+from app.services.notes_service import process_pdf_bytes, process_xml_bytes
+from app.services.queue.broker import batch_queue
+
+DocumentLoader = Callable[[], bytes]
+Document = Tuple[str, DocumentLoader]
+
+SUPPORTED_SUFFIXES = (".pdf", ".xml")
+
+IngestOutcome = Literal["created", "duplicates", "skipped"]
+
+_COUNTERS = ("discovered", "processed", "created", "duplicates", "skipped", "failed")
+_MAX_ERRORS = 50
+
+
+class UnsafeArchiveError(ValueError):
+	"""O .zip excede os limites de membros, tamanho descompactado ou taxa de compressão."""
+
+
+class BatchProgress(BaseModel):
+	batch_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+	status: str = "running"
+	discovered: int = 0
+	processed: int = 0
+	created: int = 0
+	duplicates: int = 0
+	skipped: int = 0
+	failed: int = 0
+	errors: List[str] = []
+
+
+def detect_document_type(name: str, content: bytes) -> Optional[str]:
+	lowered = name.lower()
+	if lowered.endswith(".pdf") or content.startswith(b"%PDF"):
+		return "pdf"
+	if lowered.endswith(".xml") or content.lstrip().startswith(b"<"):
+		return "xml"
+	return None
+
+
+def _read_file(path: Path) -> DocumentLoader:
+	return path.read_bytes
+
+
+def check_archive(archive: zipfile.ZipFile, name: str) -> None:
+	"""
+	Valida o índice do .zip antes de extrair qualquer membro. Os tamanhos
+	declarados são confiáveis: `ZipFile.read` não entrega mais que `file_size`.
+	"""
+	members = [info for info in archive.infolist() if not info.is_dir()]
+	if len(members) > settings.ingest_zip_max_members:
+		raise UnsafeArchiveError(f"{name}: {len(members)} arquivos (máximo {settings.ingest_zip_max_members})")
+
+	total = sum(info.file_size for info in members)
+	if total > settings.ingest_zip_max_uncompressed_bytes:
+		raise UnsafeArchiveError(
+			f"{name}: {total} bytes descompactados (máximo {settings.ingest_zip_max_uncompressed_bytes})"
+		)
+
+	for info in members:
+		if info.file_size > settings.ingest_zip_max_ratio * max(info.compress_size, 1):
+			raise UnsafeArchiveError(
+				f"{name}: {info.filename} comprimido {info.file_size // max(info.compress_size, 1)}x "
+				f"(máximo {settings.ingest_zip_max_ratio}x)"
+			)
+
+
+def check_archives(path: Path) -> None:
+	"""Valida todos os .zip de `path` antes de o lote começar."""
+	archives = [path] if path.is_file() else sorted(path.rglob("*"))
+	for archive_path in archives:
+		if archive_path.suffix.lower() == ".zip":
+			with zipfile.ZipFile(archive_path) as archive:
+				check_archive(archive, archive_path.name)
+
+
+def iter_zip(archive: zipfile.ZipFile, prefix: str = "") -> Iterator[Document]:
+	# O conteúdo é lido aqui (e não no worker) porque o .zip é fechado assim que o
+	# iterador termina, possivelmente antes de os últimos membros serem processados.
+	for member in archive.namelist():
+		if member.lower().endswith(SUPPORTED_SUFFIXES):
+			content = archive.read(member)
+			yield f"{prefix}{member}", lambda content=content: content
+
+
+def iter_documents(path: Path) -> Iterator[Document]:
+	"""Percorre um arquivo, diretório ou .zip e produz os documentos suportados sob demanda."""
+	if path.is_dir():
+		for root, _dirs, files in os.walk(path):
+			for file_name in sorted(files):
+				yield from iter_documents(Path(root) / file_name)
+	elif path.suffix.lower() == ".zip":
+		with zipfile.ZipFile(path) as archive:
+			check_archive(archive, path.name)
+			yield from iter_zip(archive, prefix=f"{path.name}/")
+	elif path.suffix.lower() in SUPPORTED_SUFFIXES:
+		yield str(path), _read_file(path)
+
+
+class BatchIngestor:
+	def __init__(
+			self,
+			concurrency: int = settings.ingest_concurrency,
+			on_progress: Callable[[BatchProgress], Awaitable[None]] | None = None,
+	) -> None:
+		self.concurrency = concurrency
+		self.on_progress = on_progress
+
+	async def run(self, documents: Iterable[Document], progress: BatchProgress | None = None) -> BatchProgress:
+		progress = progress or BatchProgress()
+		queue: asyncio.Queue[Document | None] = asyncio.Queue(maxsize=self.concurrency * 2)
+		workers = [asyncio.create_task(self._worker(queue, progress)) for _ in range(self.concurrency)]
+
+		iterator = iter(documents)
+		try:
+			# Percorrer diretórios e ler .zip é bloqueante: cada passo roda em thread.
+			while (document := await asyncio.to_thread(next, iterator, None)) is not None:
+				progress.discovered += 1
+				await queue.put(document)
+		finally:
+			for _ in workers:
+				await queue.put(None)
+			await asyncio.gather(*workers)
+
+		progress.status = "finished"
+		await self._report(progress)
+		return progress
+
+	async def _worker(self, queue: "asyncio.Queue[Document | None]", progress: BatchProgress) -> None:
+		while (document := await queue.get()) is not None:
+			name, loader = document
+			try:
+				await self._ingest_one(name, loader, progress)
+			except Exception as e:
+				logger.exception(f"Erro ao ingerir {name}: {e}")
+				progress.failed += 1
+				progress.errors = (progress.errors + [f"{name}: {e}"])[-_MAX_ERRORS:]
+			progress.processed += 1
+			await self._report(progress)
+
+	async def _ingest_one(self, name: str, loader: DocumentLoader, progress: BatchProgress) -> None:
+		outcome = await ingest_document(name, await asyncio.to_thread(loader))
+		setattr(progress, outcome, getattr(progress, outcome) + 1)
+
+	async def _report(self, progress: BatchProgress) -> None:
+		if self.on_progress is not None:
+			await self.on_progress(progress)
+
+
+async def ingest_document(name: str, content: bytes) -> IngestOutcome:
+	"""Registra um documento do lote; usado pela CLI e pelos workers."""
+	document_type = detect_document_type(name, content)
+	if document_type is None:
+		return "skipped"
+
+	content_hash = hashlib.sha256(content).hexdigest()
+	async with job_session() as db:
+		if await db.scalar(select(Note.id).where(Note.content_hash == content_hash).limit(1)):
+			return "skipped"
+
+		source = f"ingest://{name}"
+		if document_type == "xml":
+			result = await process_xml_bytes(content, db, pdf_url=source, content_hash=content_hash)
+		else:
+			result = await process_pdf_bytes(
+				content,
+				db,
+				pdf_url=source,
+				priority=Priority.BATCH,
+				content_hash=content_hash,
+			)
+
+	return "created" if result.created else "duplicates"
+
+
+async def enqueue_batch(path: Path, progress: BatchProgress) -> BatchProgress:
+	"""Grava os documentos de `path` no storage e publica um job por documento no stream de lote."""
+	await _start_progress(progress)
+	redis = await get_redis_client()
+	key = _progress_key(progress.batch_id)
+	iterator = iter_documents(path)
+	queued = skipped = 0
+	try:
+		# Percorrer diretórios e ler .zip é bloqueante: cada passo roda em thread.
+		while (document := await asyncio.to_thread(next, iterator, None)) is not None:
+			name, loader = document
+			content = await asyncio.to_thread(loader)
+			document_type = detect_document_type(name, content)
+			if document_type is None:
+				skipped += 1
+				continue
+			# Arquivos soltos vêm com o caminho do diretório temporário; o nome no lote é relativo a ele.
+			name = name.removeprefix(f"{path}{os.sep}")
+
+			storage_key = await document_storage.save(
+				content,
+				hashlib.sha256(content).hexdigest(),
+				content_type="application/xml" if document_type == "xml" else "application/pdf",
+				suffix=f".{document_type}",
+			)
+			await batch_queue.enqueue(DocumentJob(
+				message_id=f"ingest:{progress.batch_id}",
+				phone_number="",
+				title=name,
+				pdf_url=f"ingest://{name}",
+				document_type=document_type,
+				batch_id=progress.batch_id,
+				storage_key=storage_key,
+			))
+			queued += 1
+	except Exception:
+		# Os jobs já publicados seguem nos workers; o lote só deixa de ser dado como em andamento.
+		async with redis.pipeline(transaction=True) as pipe:
+			pipe.hincrby(key, "discovered", queued)
+			pipe.hset(key, "status", "failed")
+			await pipe.execute()
+		raise
+	finally:
+		iterator.close()
+
+	async with redis.pipeline(transaction=True) as pipe:
+		pipe.hincrby(key, "discovered", queued + skipped)
+		pipe.hincrby(key, "skipped", skipped)
+		pipe.hincrby(key, "processed", skipped)
+		pipe.hset(key, "status", "running")
+		pipe.expire(key, settings.ingest_progress_ttl_seconds)
+		await pipe.execute()
+	return await load_progress(progress.batch_id)
+
+
+def _progress_key(batch_id: str) -> str:
+	return f"nf_bot_zap:ingest:{batch_id}"
+
+
+def _errors_key(batch_id: str) -> str:
+	return f"{_progress_key(batch_id)}:errors"
+
+
+async def _start_progress(progress: BatchProgress) -> None:
+	redis = await get_redis_client()
+	key = _progress_key(progress.batch_id)
+	async with redis.pipeline(transaction=True) as pipe:
+		pipe.hset(key, mapping={"status": "queueing", **{name: 0 for name in _COUNTERS}})
+		pipe.expire(key, settings.ingest_progress_ttl_seconds)
+		await pipe.execute()
+
+
+async def record_batch_result(batch_id: str, outcome: IngestOutcome | Literal["failed"], error: str | None = None) -> None:
+	"""Soma o resultado de um documento ao progresso do lote (chamado pelos workers)."""
+	try:
+		redis = await get_redis_client()
+		key = _progress_key(batch_id)
+		async with redis.pipeline(transaction=True) as pipe:
+			pipe.hincrby(key, outcome, 1)
+			pipe.hincrby(key, "processed", 1)
+			pipe.expire(key, settings.ingest_progress_ttl_seconds)
+			if error:
+				pipe.rpush(_errors_key(batch_id), error)
+				pipe.ltrim(_errors_key(batch_id), -_MAX_ERRORS, -1)
+				pipe.expire(_errors_key(batch_id), settings.ingest_progress_ttl_seconds)
+			await pipe.execute()
+	except RedisError as e:
+		logger.warning(f"Falha ao gravar progresso do lote {batch_id}: {e}")
+
+
+async def load_progress(batch_id: str) -> Optional[BatchProgress]:
+	redis = await get_redis_client()
+	raw = await redis.hgetall(_progress_key(batch_id))
+	if not raw:
+		return None
+	progress = BatchProgress(
+		batch_id=batch_id,
+		status=raw.get("status", "running"),
+		errors=await redis.lrange(_errors_key(batch_id), 0, -1),
+		**{name: int(raw.get(name, 0)) for name in _COUNTERS},
+	)
+	# Os workers só somam contadores; o lote termina quando todos os documentos publicados voltaram.
+	if progress.status == "running" and progress.processed >= progress.discovered:
+		progress.status = "finished"
+	return progress
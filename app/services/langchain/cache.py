@@ -0,0 +1,75 @@
+import hashlib
+from typing import Any, Dict, Optional
+
+import orjson
+from cachetools import LRUCache
+from loguru import logger
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.metrics import EXTRACTION_CACHE
+from app.core.redis import get_redis_client
+
+
+class ExtractionCache:
+	"""
+	Cache de extrações endereçado por conteúdo, em dois níveis:
+
+	- LRU em memória do processo, limitado pelo tamanho em bytes do JSON armazenado;
+	- Redis com TTL, compartilhado entre todos os workers.
+
+	A chave combina o hash SHA-256 do PDF decodificado com o nome do modelo e a
+	versão do prompt, de modo que trocar qualquer um deles invalida o cache.
+	"""
+
+	def __init__(
+			self,
+			max_bytes: int = settings.extraction_cache_max_bytes,
+			ttl_seconds: int = settings.extraction_cache_ttl_seconds,
+			prefix: str = settings.extraction_cache_prefix,
+	) -> None:
+		self.ttl_seconds = ttl_seconds
+		self.prefix = prefix
+		self._local: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=len)
+
+	@staticmethod
+	def make_key(pdf_bytes: bytes, model_name: str, prompt_version: str) -> str:
+		digest = hashlib.sha256(pdf_bytes).hexdigest()
+		return f"{digest}:{model_name}:{prompt_version}"
+
+	async def get(self, key: str) -> Optional[Dict[str, Any]]:
+		raw = self._local.get(key)
+		if raw is not None:
+			EXTRACTION_CACHE.labels(result="local_hit").inc()
+			return orjson.loads(raw)
+
+		try:
+			redis = await get_redis_client()
+			raw = await redis.get(f"{self.prefix}{key}")
+		except RedisError as e:
+			logger.warning(f"Cache de extração indisponível no Redis: {e}")
+			raw = None
+
+		if raw is None:
+			EXTRACTION_CACHE.labels(result="miss").inc()
+			return None
+
+		EXTRACTION_CACHE.labels(result="redis_hit").inc()
+		self._store_local(key, raw.encode())
+		return orjson.loads(raw)
+
+	async def set(self, key: str, value: Dict[str, Any]) -> None:
+		raw = orjson.dumps(value)
+		self._store_local(key, raw)
+		try:
+			redis = await get_redis_client()
+			await redis.set(f"{self.prefix}{key}", raw, ex=self.ttl_seconds)
+		except RedisError as e:
+			logger.warning(f"Falha ao gravar extração no cache Redis: {e}")
+
+	def _store_local(self, key: str, raw: bytes) -> None:
+		if len(raw) <= self._local.maxsize:
+			self._local[key] = raw
+
+
+extraction_cache: ExtractionCache = ExtractionCache()
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Protocol
+
+from loguru import logger
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.metrics import EXTRACTION_DURATION
+from app.core.tracing import tracer
+from app.services.langchain.danfe_parser import DanfeTextParser
+from app.services.langchain.extractor import NFExtractor, nf_extractor
+from app.services.langchain.scheduler import Priority
+
+
+class ExtractionResult(BaseModel):
+	data: Dict[str, Any]
+	stage: str
+	confidence: float
+
+
+class ExtractorStage(Protocol):
+	name: str
+	model: str
+
+	async def extract(self, pdf_bytes: bytes, priority: Priority) -> ExtractionResult:
+		...
+
+
+class DanfeTextStage:
+	"""Lê a camada de texto do PDF sem chamar o modelo (layouts padrão de DANFE)."""
+
+	name = "danfe_text"
+	model = ""
+
+	def __init__(self, parser: DanfeTextParser | None = None) -> None:
+		self._parser = parser or DanfeTextParser()
+
+	async def extract(self, pdf_bytes: bytes, priority: Priority) -> ExtractionResult:
+		try:
+			data, confidence = await asyncio.to_thread(self._parser.parse, pdf_bytes)
+		except Exception as e:
+			logger.warning(f"Parser de DANFE falhou, seguindo para o próximo estágio: {e}")
+			data, confidence = {}, 0.0
+		return ExtractionResult(data=data, stage=self.name, confidence=confidence)
+
+
+class LLMStage:
+	"""Extração via Gemini, usada como fallback para qualquer layout."""
+
+	def __init__(self, extractor: NFExtractor) -> None:
+		self._extractor = extractor
+		self.model = extractor.model_name
+		self.name = f"llm:{extractor.model_name}"
+
+	async def extract(self, pdf_bytes: bytes, priority: Priority) -> ExtractionResult:
+		data = await self._extractor.extract_from_bytes(pdf_bytes, priority)
+		return ExtractionResult(data=data, stage=self.name, confidence=1.0)
+
+
+class ExtractorChain:
+	"""
+	Executa os estágios em ordem e retorna o primeiro resultado com confiança
+	suficiente; o último estágio é sempre aceito.
+	"""
+
+	def __init__(self, stages: List[ExtractorStage], min_confidence: float) -> None:
+		if not stages:
+			raise ValueError("ExtractorChain precisa de pelo menos um estágio")
+		self.stages = stages
+		self.min_confidence = min_confidence
+
+	async def extract(self, pdf_bytes: bytes, priority: Priority = Priority.INTERACTIVE) -> ExtractionResult:
+		*fast_stages, fallback = self.stages
+		for stage in fast_stages:
+			t0 = time.perf_counter()
+			with tracer.start_as_current_span(f"extract {stage.name}") as span:
+				result = await stage.extract(pdf_bytes, priority)
+				accepted = result.confidence >= self.min_confidence
+				span.set_attributes({"nfbot.confidence": result.confidence, "nfbot.accepted": accepted})
+			elapsed = time.perf_counter() - t0
+			self._observe(stage, elapsed, accepted)
+			if accepted:
+				logger.bind(event="extraction_stage").info(f"Extração pelo estágio {stage.name} em {elapsed:.2f}s (confiança {result.confidence})")
+				return result
+			logger.bind(event="extraction_stage").info(f"Estágio {stage.name} com confiança {result.confidence} em {elapsed:.2f}s, tentando o próximo")
+
+		t0 = time.perf_counter()
+		with tracer.start_as_current_span(f"extract {fallback.name}"):
+			result = await fallback.extract(pdf_bytes, priority)
+		elapsed = time.perf_counter() - t0
+		self._observe(fallback, elapsed, True)
+		logger.bind(event="extraction_stage").info(f"Extração pelo estágio {fallback.name} em {elapsed:.2f}s")
+		return result
+
+	@staticmethod
+	def _observe(stage: ExtractorStage, elapsed: float, accepted: bool) -> None:
+		stage_label = stage.name.split(":", 1)[0]
+		EXTRACTION_DURATION.labels(stage=stage_label, model=stage.model, accepted=str(accepted).lower()).observe(elapsed)
+
+
+nf_extractor_chain: ExtractorChain = ExtractorChain(
+	stages=[DanfeTextStage(), LLMStage(nf_extractor)],
+	min_confidence=settings.local_parser_min_confidence,
+)
@@ -0,0 +1,150 @@
+"""
+Parser determinístico da camada de texto de DANFE (NF-e) e DANFE NFC-e.
+
+Preenche o mesmo dicionário descrito em `NF_PDF_EXTRACT_PROMPT` e devolve uma
+confiança entre 0 e 1. A maior parte do cabeçalho é derivada da própria chave de
+acesso (UF, CNPJ, modelo, série e número), e os itens só são considerados
+confiáveis quando a soma das linhas bate com o total de produtos da nota.
+"""
+import io
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from pypdf import PdfReader
+
+from app.services.access_key import NOTE_TYPE_BY_MODEL, find_access_key
+
+UF_BY_CODE = {
+	"11": "RO", "12": "AC", "13": "AM", "14": "RR", "15": "PA", "16": "AP", "17": "TO",
+	"21": "MA", "22": "PI", "23": "CE", "24": "RN", "25": "PB", "26": "PE", "27": "AL",
+	"28": "SE", "29": "BA", "31": "MG", "32": "ES", "33": "RJ", "35": "SP", "41": "PR",
+	"42": "SC", "43": "RS", "50": "MS", "51": "MT", "52": "GO", "53": "DF",
+}
+
+_NUMBER = r"\d{1,3}(?:\.\d{3})*,\d{2,4}|\d+,\d{2,4}"
+_DATE_RE = re.compile(r"(\d{2}/\d{2}/\d{4})")
+_ISSUE_DATE_RE = re.compile(r"(?:DATA\s+(?:DE|DA)\s+EMISS[ÃA]O|EMISS[ÃA]O)\s*:?\s*(\d{2}/\d{2}/\d{4})", re.I)
+_TOTAL_NOTE_RE = re.compile(rf"(?:VALOR\s+TOTAL\s+DA\s+NOTA|VALOR\s+A\s+PAGAR|VALOR\s+TOTAL)\s*(?:R\$)?\s*:?\s*({_NUMBER})", re.I)
+_TOTAL_PRODUCTS_RE = re.compile(rf"VALOR\s+TOTAL\s+DOS\s+PRODUTOS\s*(?:R\$)?\s*:?\s*({_NUMBER})", re.I)
+_PROVIDER_RE = re.compile(r"RECEBEMOS\s+DE\s+(.+?)\s+OS\s+PRODUTOS", re.I | re.S)
+_PROTOCOL_RE = re.compile(r"PROTOCOLO[^\d]{0,40}(\d{15})", re.I)
+_NATURE_RE = re.compile(r"NATUREZA\s+DA\s+OPERA[ÇC][ÃA]O\s*:?\s*\n?\s*([^\n]+)", re.I)
+_IE_RE = re.compile(r"INSCRI[ÇC][ÃA]O\s+ESTADUAL\s*:?\s*\n?\s*([\d./-]{8,20})", re.I)
+_ZIP_RE = re.compile(r"CEP\s*:?\s*(\d{5}-?\d{3})", re.I)
+
+# CÓDIGO DESCRIÇÃO NCM CST CFOP UN QTD V.UNIT V.TOTAL [BC ICMS V.ICMS V.IPI ...]
+_NFE_ITEM_RE = re.compile(
+	rf"^(?P<code>\S+)\s+(?P<name>.+?)\s+(?P<ncm>\d{{8}})\s+(?P<cst>\d{{3,4}})\s+(?P<cfop>\d{{4}})\s+"
+	rf"(?P<unit>[A-Za-z]{{1,6}})\s+(?P<qty>{_NUMBER})\s+(?P<unit_value>{_NUMBER})\s+(?P<total>{_NUMBER})"
+	rf"(?P<rest>(?:\s+{_NUMBER})*)\s*$"
+)
+# SEQ CÓDIGO DESCRIÇÃO QTD UN x V.UNIT V.TOTAL
+_NFCE_ITEM_RE = re.compile(
+	rf"^(?P<seq>\d{{1,3}})\s+(?P<code>\d+)\s+(?P<name>.+?)\s+(?P<qty>{_NUMBER}|\d+)\s*(?P<unit>[A-Za-z]{{1,6}})\s*[xX]\s*"
+	rf"(?P<unit_value>{_NUMBER})\s+(?P<total>{_NUMBER})\s*$"
+)
+
+
+def parse_br_number(value: Optional[str]) -> Optional[float]:
+	if not value:
+		return None
+	return float(value.replace(".", "").replace(",", "."))
+
+
+def read_pdf_text(pdf_bytes: bytes) -> str:
+	reader = PdfReader(io.BytesIO(pdf_bytes))
+	return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+class DanfeTextParser:
+	def parse(self, pdf_bytes: bytes) -> Tuple[Dict[str, Any], float]:
+		return self.parse_text(read_pdf_text(pdf_bytes))
+
+	def parse_text(self, text: str) -> Tuple[Dict[str, Any], float]:
+		access_key = find_access_key(text)
+		if not access_key:
+			return {}, 0.0
+
+		items, items_total = self._parse_items(text)
+		data: Dict[str, Any] = {
+			"note_type": NOTE_TYPE_BY_MODEL.get(access_key[20:22]),
+			"note_number": str(int(access_key[25:34])),
+			"series": str(int(access_key[22:25])),
+			"access_key": access_key,
+			"issuer_cnpj": access_key[6:20],
+			"issuer_ie": self._search(_IE_RE, text),
+			"issuer_city": None,
+			"issuer_state": UF_BY_CODE.get(access_key[:2]),
+			"issuer_zip_code": self._search(_ZIP_RE, text),
+			"provider": self._parse_provider(text),
+			"nature_of_operation": self._search(_NATURE_RE, text),
+			"protocol_number": self._search(_PROTOCOL_RE, text),
+			"date_of_issue": self._search(_ISSUE_DATE_RE, text) or self._search(_DATE_RE, text),
+			"total_value": parse_br_number(self._search(_TOTAL_NOTE_RE, text)),
+			"items": items,
+		}
+
+		products_total = parse_br_number(self._search(_TOTAL_PRODUCTS_RE, text))
+		return data, self._confidence(data, items_total, products_total)
+
+	@staticmethod
+	def _search(pattern: re.Pattern, text: str) -> Optional[str]:
+		match = pattern.search(text)
+		return match.group(1).strip() if match else None
+
+	@staticmethod
+	def _parse_provider(text: str) -> Optional[str]:
+		match = _PROVIDER_RE.search(text)
+		if match:
+			return " ".join(match.group(1).split())
+
+		# NFC-e: a razão social do emitente é a primeira linha do cupom.
+		for line in text.splitlines():
+			line = line.strip()
+			if line and not line.upper().startswith(("DANFE", "DOCUMENTO AUXILIAR")):
+				return line
+		return None
+
+	@staticmethod
+	def _parse_items(text: str) -> Tuple[List[Dict[str, Any]], float]:
+		items: List[Dict[str, Any]] = []
+		total = 0.0
+		for line in text.splitlines():
+			line = " ".join(line.split())
+			match = _NFE_ITEM_RE.match(line) or _NFCE_ITEM_RE.match(line)
+			if not match:
+				continue
+
+			groups = match.groupdict()
+			rest = re.findall(_NUMBER, groups.get("rest") or "")
+			items.append({
+				"product_name": groups["name"],
+				"product_code": groups["code"],
+				"ncm": groups.get("ncm"),
+				"cfop": groups.get("cfop"),
+				"discount_value": None,
+				"icms_value": parse_br_number(rest[1]) if len(rest) > 1 else None,
+				"ipi_value": parse_br_number(rest[2]) if len(rest) > 2 else None,
+				"quantity": parse_br_number(groups["qty"]) if "," in groups["qty"] else float(groups["qty"]),
+				"unit_of_measure": groups["unit"].upper(),
+				"unit_value": parse_br_number(groups["unit_value"]),
+			})
+			total += parse_br_number(groups["total"]) or 0.0
+		return items, round(total, 2)
+
+	@staticmethod
+	def _confidence(data: Dict[str, Any], items_total: float, products_total: Optional[float]) -> float:
+		score = 0.25  # chave de acesso válida (dígito verificador conferido)
+		if data["provider"]:
+			score += 0.15
+		if data["date_of_issue"]:
+			score += 0.15
+		if data["total_value"] is not None:
+			score += 0.15
+		if data["items"]:
+			score += 0.1
+
+			reference = products_total if products_total is not None else data["total_value"]
+			if reference and abs(items_total - reference) <= max(0.05, reference * 0.001):
+				score += 0.2
+		return round(score, 2)
@@ -1,44 +1,179 @@
-import json
-from typing import Any, Dict
+import asyncio
+import base64
+from typing import Any, Dict, List, Tuple
+
+import orjson
 
 from langchain_core.messages import HumanMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 from loguru import logger
 
 from app.core.config import settings
-from app.services.langchain.prompts import NF_PDF_EXTRACT_PROMPT
+from app.core.tracing import set_llm_usage, tracer
+from app.services.langchain.cache import ExtractionCache, extraction_cache
+from app.services.langchain.pdf_chunks import count_pages, merge_chunk_items, split_pdf_pages
+from app.services.langchain.prompts import (
+	NF_PDF_EXTRACT_PROMPT,
+	NF_PDF_EXTRACT_PROMPT_VERSION,
+	NF_PDF_HEADER_PROMPT,
+	NF_PDF_ITEMS_CONTINUE_PROMPT,
+	NF_PDF_ITEMS_PROMPT,
+)
+from app.services.langchain.scheduler import LLMScheduler, Priority, llm_scheduler
+from app.services.langchain.structured import (
+	ITEMS_SCHEMA,
+	NOTE_SCHEMA,
+	clean_items,
+	header_schema,
+	missing_header_fields,
+	parse_model_json,
+)
 
 
 class NFExtractor:
-	def __init__(self, model_name: str = "gemini-2.0-flash") -> None:
+	def __init__(
+			self,
+			model_name: str = "gemini-2.0-flash",
+			cache: ExtractionCache | None = None,
+			scheduler: LLMScheduler | None = None,
+	) -> None:
+		self.model_name = model_name
+		self._cache = cache
+		self._scheduler = scheduler or LLMScheduler()
 		self._model = ChatGoogleGenerativeAI(
 			model=model_name,
 			api_key=settings.google_api_key,
+			# Retentativas e backoff ficam a cargo do LLMScheduler.
+			max_retries=0,
 		)
 
-	async def _extract_json_string(self, raw: str) -> str:
-		start = raw.find("{")
-		end = raw.rfind("}")
-		if start == -1 or end == -1 or end <= start:
-			raise ValueError(f"No JSON object found in model output: {raw!r}")
-		return raw[start:end + 1]
-
-	async def extract_from_b64(self, pdf_b64: str) -> Dict[str, Any]:
+	async def extract_from_b64(self, pdf_b64: str, priority: Priority = Priority.INTERACTIVE) -> Dict[str, Any]:
 		if isinstance(pdf_b64, bytes):
 			pdf_b64 = pdf_b64.decode("utf-8")
+		return await self.extract_from_bytes(base64.b64decode(pdf_b64), priority)
+
+	async def extract_from_bytes(self, pdf_bytes: bytes, priority: Priority = Priority.INTERACTIVE) -> Dict[str, Any]:
+		if self._cache is None:
+			return await self._extract(pdf_bytes, priority)
+
+		cache_key = ExtractionCache.make_key(pdf_bytes, self.model_name, NF_PDF_EXTRACT_PROMPT_VERSION)
+		cached = await self._cache.get(cache_key)
+		if cached is not None:
+			logger.bind(event="extraction_cache_hit").info(f"♻️ Extração reaproveitada do cache ({cache_key[:12]}...)")
+			return cached
+
+		result = await self._extract(pdf_bytes, priority)
+		await self._cache.set(cache_key, result)
+		return result
+
+	async def _extract(self, pdf_bytes: bytes, priority: Priority) -> Dict[str, Any]:
+		try:
+			pages = await asyncio.to_thread(count_pages, pdf_bytes)
+		except Exception as e:
+			logger.warning(f"Não foi possível contar as páginas do PDF, extraindo de uma vez: {e}")
+			pages = 0
+		if pages < settings.llm_chunk_min_pages:
+			return await self._invoke(pdf_bytes, priority)
+		return await self._extract_chunked(pdf_bytes, pages, priority)
+
+	async def _extract_chunked(self, pdf_bytes: bytes, pages: int, priority: Priority) -> Dict[str, Any]:
+		"""
+		Notas longas: a primeira faixa de páginas é extraída com o prompt completo
+		(cabeçalho e itens) e as demais só com o prompt de itens, todas em paralelo
+		(até `LLM_CHUNK_CONCURRENCY` por nota, além dos limites do LLMScheduler).
+		O tempo total acompanha a faixa mais lenta, e cada resposta fica pequena o
+		bastante para não estourar o limite de tokens de saída.
+		"""
+		chunks = await asyncio.to_thread(split_pdf_pages, pdf_bytes, settings.llm_chunk_pages)
+		semaphore = asyncio.Semaphore(settings.llm_chunk_concurrency)
+
+		async def run(index: int, chunk: bytes) -> Dict[str, Any]:
+			async with semaphore:
+				if index == 0:
+					return await self._invoke(chunk, priority)
+				return await self._invoke(chunk, priority, NF_PDF_ITEMS_PROMPT, ITEMS_SCHEMA)
+
+		with tracer.start_as_current_span(
+				"extract chunked",
+				attributes={"nfbot.pages": pages, "nfbot.chunks": len(chunks)},
+		):
+			results: List[Dict[str, Any]] = await asyncio.gather(
+				*(run(index, chunk) for index, (_, chunk) in enumerate(chunks))
+			)
 
+		header = results[0]
+		header["items"] = merge_chunk_items([
+			(pages, result.get("items") or []) for (pages, _), result in zip(chunks, results)
+		])
+		logger.info(f"Extração em {len(chunks)} partes ({pages} páginas): {len(header['items'])} itens")
+		return header
+
+	async def _invoke(
+			self,
+			pdf_bytes: bytes,
+			priority: Priority,
+			prompt: str = NF_PDF_EXTRACT_PROMPT,
+			schema: Dict[str, Any] = NOTE_SCHEMA,
+	) -> Dict[str, Any]:
+		"""
+		Extrai com a resposta presa ao schema. Quando algo vem incompleto, só a parte
+		que faltou é pedida de novo: os itens depois do último lido, se a saída foi
+		cortada, e os campos obrigatórios do cabeçalho, se vieram nulos.
+		"""
+		pdf_b64 = base64.b64encode(pdf_bytes).decode("ascii")
+		data, truncated = await self._ask(pdf_b64, priority, prompt, schema)
+		data["items"] = clean_items(data.get("items"))
+
+		for _ in range(settings.llm_max_continuations):
+			if not truncated:
+				break
+			items = data["items"]
+			logger.info(f"Resposta cortada após {len(items)} itens, pedindo a continuação")
+			continuation, truncated = await self._ask(
+				pdf_b64,
+				priority,
+				NF_PDF_ITEMS_CONTINUE_PROMPT.format(
+					count=len(items),
+					last_item=orjson.dumps(items[-1]).decode() if items else "(nenhum)",
+				),
+				ITEMS_SCHEMA,
+			)
+			# A continuação relê o documento inteiro: as duas respostas cobrem as mesmas páginas.
+			document = range(0, 1)
+			data["items"] = merge_chunk_items([(document, items), (document, clean_items(continuation.get("items")))])
+
+		if schema is NOTE_SCHEMA:
+			missing = missing_header_fields(data)
+			if missing:
+				logger.info(f"Campos obrigatórios nulos na extração, perguntando de novo: {missing}")
+				header, _ = await self._ask(
+					pdf_b64,
+					priority,
+					NF_PDF_HEADER_PROMPT.format(fields=", ".join(missing)),
+					header_schema(missing),
+				)
+				data.update({name: header[name] for name in missing if header.get(name) not in (None, "")})
+		return data
+
+	async def _ask(
+			self,
+			pdf_b64: str,
+			priority: Priority,
+			prompt: str,
+			schema: Dict[str, Any],
+	) -> Tuple[Dict[str, Any], bool]:
 		message = HumanMessage(
 			content=[
-				{"type": "text", "text": NF_PDF_EXTRACT_PROMPT},
-				{
-					"type": "file",
-					"mime_type": "application/pdf",
-					"base64": pdf_b64,
-				},
+				{"type": "text", "text": prompt},
+				{"type": "file", "mime_type": "application/pdf", "base64": pdf_b64},
 			]
 		)
 
-		resp = await self._model.ainvoke([message])
+		resp = await self._scheduler.submit(
+			lambda: self._call_model(message, schema),
+			priority=priority,
+			count_tokens=lambda r: (r.usage_metadata or {}).get("total_tokens"),
+		)
 		raw = resp.content
 
 		if isinstance(raw, list):
@@ -48,8 +183,24 @@ class NFExtractor:
 				if isinstance(part, dict) and "text" in part
 			)
 
-		json_str = await self._extract_json_string(raw)
-		return json.loads(json_str)
+		return parse_model_json(raw)
+
+	async def _call_model(self, message: HumanMessage, schema: Dict[str, Any]):
+		with tracer.start_as_current_span(
+				f"chat {self.model_name}",
+				attributes={
+					"gen_ai.system": "gemini",
+					"gen_ai.operation.name": "chat",
+					"gen_ai.request.model": self.model_name,
+					"nfbot.prompt_version": NF_PDF_EXTRACT_PROMPT_VERSION,
+				},
+		) as span:
+			# Mesmo mecanismo de `with_structured_output(method="json_schema")`, mas mantendo
+			# a AIMessage crua: o uso de tokens alimenta o LLMScheduler e o span.
+			model = self._model.bind(response_mime_type="application/json", response_json_schema=schema)
+			resp = await model.ainvoke([message])
+			set_llm_usage(span, resp.usage_metadata)
+			return resp
 
 
-nf_extractor: NFExtractor = NFExtractor()
+nf_extractor: NFExtractor = NFExtractor(cache=extraction_cache, scheduler=llm_scheduler)
@@ -0,0 +1,79 @@
+"""
+Divisão de PDFs longos em faixas de páginas e junção dos itens extraídos de cada faixa.
+"""
+import io
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+from pypdf import PdfReader, PdfWriter
+
+PageChunk = Tuple[range, bytes]
+# Itens extraídos e as páginas do documento que a extração leu.
+ChunkItems = Tuple[range, List[Dict[str, Any]]]
+
+# Quando duas leituras cobrem a mesma página, ela pode aparecer no fim de uma e no começo da outra.
+_MAX_BOUNDARY_OVERLAP = 2
+_ITEM_KEYS = ("product_code", "product_name", "ncm", "cfop", "quantity", "unit_of_measure", "unit_value")
+
+
+def count_pages(pdf_bytes: bytes) -> int:
+	return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def split_pdf_pages(pdf_bytes: bytes, pages_per_chunk: int) -> List[PageChunk]:
+	"""Quebra o PDF em documentos menores de até `pages_per_chunk` páginas, na ordem original."""
+	reader = PdfReader(io.BytesIO(pdf_bytes))
+	total = len(reader.pages)
+	chunks: List[PageChunk] = []
+	for start in range(0, total, pages_per_chunk):
+		pages = range(start, min(start + pages_per_chunk, total))
+		writer = PdfWriter()
+		for index in pages:
+			writer.add_page(reader.pages[index])
+		buffer = io.BytesIO()
+		writer.write(buffer)
+		chunks.append((pages, buffer.getvalue()))
+	return chunks
+
+
+def _item_key(item: Dict[str, Any]) -> tuple:
+	return tuple(
+		str(item.get(key)).strip().upper() if item.get(key) is not None else None
+		for key in _ITEM_KEYS
+	)
+
+
+def _shares_pages(previous: range, pages: range) -> bool:
+	return max(previous.start, pages.start) < min(previous.stop, pages.stop)
+
+
+def merge_chunk_items(chunks: List[ChunkItems]) -> List[Dict[str, Any]]:
+	"""
+	Concatena os itens das leituras na ordem das páginas.
+
+	Só leituras que cobrem páginas em comum (ex.: a continuação de uma resposta
+	cortada, que relê o mesmo documento) podem repetir linhas: nesse caso os
+	primeiros itens que repetem os últimos da leitura anterior (até
+	`_MAX_BOUNDARY_OVERLAP`) são descartados, e o descarte vai para o log. Faixas
+	de páginas disjuntas, como as de `split_pdf_pages`, são concatenadas sem
+	descarte: a nota pode ter o mesmo produto em linhas seguidas.
+	"""
+	merged: List[Dict[str, Any]] = []
+	previous_pages: range | None = None
+	previous: List[tuple] = []
+	for pages, items in chunks:
+		keys = [_item_key(item) for item in items]
+		overlap = 0
+		if previous_pages is not None and _shares_pages(previous_pages, pages):
+			for size in range(min(len(previous), len(keys), _MAX_BOUNDARY_OVERLAP), 0, -1):
+				if previous[-size:] == keys[:size]:
+					overlap = size
+					break
+		if overlap:
+			logger.info(
+				f"{overlap} item(ns) repetido(s) na junção das leituras descartado(s): "
+				f"{[item.get('product_name') for item in items[:overlap]]}"
+			)
+		merged.extend(items[overlap:])
+		previous_pages, previous = pages, keys
+	return merged
@@ -0,0 +1,115 @@
+"""
+Pré-processamento do documento antes da extração: reduz o que é enviado ao modelo.
+
+DANFEs escaneados chegam como PDFs só de imagem, de vários MB, e o base64
+inteiro ia para o Gemini. Páginas sem camada de texto têm as imagens
+reamostradas para `PREPROCESS_TARGET_DPI`, convertidas para tons de cinza e
+recodificadas em JPEG; objetos órfãos ou repetidos são removidos. Páginas com
+texto não são tocadas (o parser de DANFE e a chave de acesso dependem dele).
+
+Fotos de cupons NFC-e (`imageMessage` do WhatsApp) passam pelo mesmo caminho e
+viram um PDF de uma página, então o restante do pipeline só lida com PDF.
+"""
+import io
+import time
+from dataclasses import dataclass
+
+from loguru import logger
+from PIL import Image, ImageOps
+from pypdf import PdfReader, PdfWriter
+
+from app.core.config import settings
+
+
+@dataclass
+class PreparedDocument:
+	pdf_bytes: bytes
+	source_size: int
+	payload_size: int
+	elapsed_ms: int
+	reencoded_images: int = 0
+
+
+def _reduce(image: Image.Image, max_width: int, max_height: int) -> Image.Image:
+	if settings.preprocess_grayscale:
+		image = image.convert("L")
+	elif image.mode not in ("L", "RGB"):
+		image = image.convert("RGB")
+	if image.width > max_width or image.height > max_height:
+		image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+	return image
+
+
+def preprocess_pdf(pdf_bytes: bytes) -> PreparedDocument:
+	"""Recodifica as imagens das páginas sem texto; devolve o original se não ficar menor."""
+	t0 = time.perf_counter()
+	source_size = len(pdf_bytes)
+	result = pdf_bytes
+	reencoded = 0
+
+	if settings.preprocess_enabled:
+		try:
+			result, reencoded = _shrink_pdf(pdf_bytes)
+		except Exception as e:
+			logger.warning(f"Pré-processamento do PDF falhou, enviando o original: {e}")
+		if len(result) >= source_size:
+			result, reencoded = pdf_bytes, 0
+
+	return PreparedDocument(
+		pdf_bytes=result,
+		source_size=source_size,
+		payload_size=len(result),
+		elapsed_ms=round((time.perf_counter() - t0) * 1000),
+		reencoded_images=reencoded,
+	)
+
+
+def _shrink_pdf(pdf_bytes: bytes) -> tuple[bytes, int]:
+	reader = PdfReader(io.BytesIO(pdf_bytes))
+	image_pages = [
+		index for index, page in enumerate(reader.pages)
+		if not (page.extract_text() or "").strip()
+	]
+	if not image_pages:
+		return pdf_bytes, 0
+
+	writer = PdfWriter(clone_from=reader)
+	reencoded = 0
+	dpi = settings.preprocess_target_dpi
+	for index in image_pages:
+		page = writer.pages[index]
+		# Nenhuma imagem da página precisa de mais pixels do que a própria página no DPI alvo.
+		max_width = max(1, round(float(page.mediabox.width) / 72 * dpi))
+		max_height = max(1, round(float(page.mediabox.height) / 72 * dpi))
+		for image_file in page.images:
+			# Imagens inline não podem ser trocadas; bitonais (CCITT/JBIG2) já são menores que um JPEG.
+			if image_file.indirect_reference is None or image_file.image.mode == "1":
+				continue
+			reduced = _reduce(image_file.image, max_width, max_height)
+			image_file.replace(reduced, resolution=dpi, quality=settings.preprocess_jpeg_quality)
+			reencoded += 1
+
+	writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+	buffer = io.BytesIO()
+	writer.write(buffer)
+	return buffer.getvalue(), reencoded
+
+
+def preprocess_image(image_bytes: bytes) -> PreparedDocument:
+	"""Converte a foto (JPEG, PNG, WebP...) num PDF de uma página, já reduzida."""
+	t0 = time.perf_counter()
+	max_side = settings.preprocess_image_max_px
+	with Image.open(io.BytesIO(image_bytes)) as image:
+		# Fotos de celular vêm deitadas com a rotação só no EXIF.
+		image = _reduce(ImageOps.exif_transpose(image), max_side, max_side)
+		buffer = io.BytesIO()
+		image.save(buffer, "PDF", resolution=settings.preprocess_target_dpi, quality=settings.preprocess_jpeg_quality)
+
+	pdf_bytes = buffer.getvalue()
+	return PreparedDocument(
+		pdf_bytes=pdf_bytes,
+		source_size=len(image_bytes),
+		payload_size=len(pdf_bytes),
+		elapsed_ms=round((time.perf_counter() - t0) * 1000),
+		reencoded_images=1,
+	)
@@ -1,3 +1,6 @@
+# Incrementar sempre que o prompt mudar: faz parte da chave do cache de extração.
+NF_PDF_EXTRACT_PROMPT_VERSION = "2"
+
 NF_PDF_EXTRACT_PROMPT = (
     "Você é um extrator de dados para NOTAS FISCAIS brasileiras (documentos fiscais eletrônicos) em PDF.\n"
     "O documento pode ser NF-e, NFC-e, NFS-e (nota de serviços), CT-e, MDF-e ou outro modelo fiscal, em qualquer layout.\n"
@@ -37,7 +40,7 @@ NF_PDF_EXTRACT_PROMPT = (
     "  \"provider\": string|null,\n"
     "  \"nature_of_operation\": string|null,\n"
     "  \"protocol_number\": string|null,\n"
-    "  \"date_of_issue\": \"DD/MM/YYYY\"|null,\n"
+    "  \"date_of_issue\": \"YYYY-MM-DD\"|null,\n"
     "  \"total_value\": number|null,\n"
     "  \"items\": [\n"
     "    {\n"
@@ -50,7 +53,7 @@ NF_PDF_EXTRACT_PROMPT = (
     "      \"ipi_value\": number|null,\n"
     "      \"quantity\": number|null,\n"
     "      \"unit_of_measure\": string|null,\n"
-    "      \"unit_value\": number|null,\n"
+    "      \"unit_value\": number|null\n"
     "    }\n"
     "  ]\n"
     "}\n\n"
@@ -74,3 +77,54 @@ NF_PDF_EXTRACT_PROMPT = (
     "- Se o valor total da nota não estiver claramente visível, use null em \"total_value\".\n"
     "- Garanta que o JSON final seja sintaticamente válido.\n"
 )
+
+# Prompt das faixas de páginas seguintes à primeira no modo em partes (PDFs longos).
+NF_PDF_ITEMS_PROMPT = (
+    "Você é um extrator de dados para NOTAS FISCAIS brasileiras em PDF.\n"
+    "Este PDF contém APENAS algumas páginas de uma nota fiscal maior (a continuação da tabela de itens).\n"
+    "Retorne SOMENTE um objeto JSON válido, sem textos fora do JSON, no formato:\n"
+    "{\n"
+    "  \"items\": [\n"
+    "    {\n"
+    "      \"product_name\": string|null,\n"
+    "      \"product_code\": string|null,\n"
+    "      \"ncm\": string|null,\n"
+    "      \"cfop\": string|null,\n"
+    "      \"discount_value\": number|null,\n"
+    "      \"icms_value\": number|null,\n"
+    "      \"ipi_value\": number|null,\n"
+    "      \"quantity\": number|null,\n"
+    "      \"unit_of_measure\": string|null,\n"
+    "      \"unit_value\": number|null\n"
+    "    }\n"
+    "  ]\n"
+    "}\n\n"
+    "REGRAS:\n"
+    "- Extraia todas as linhas da tabela de itens (produtos ou serviços) destas páginas, na ordem em que aparecem.\n"
+    "- Ignore cabeçalhos repetidos, dados do emitente/destinatário, totais e informações complementares.\n"
+    "- Inclua um item apenas se houver nome/descrição clara (product_name); campos ausentes ficam null.\n"
+    "- Números devem ser números JSON (sem aspas, com ponto como separador decimal).\n"
+    "- Não invente informações: se não houver itens nestas páginas, retorne {\"items\": []}.\n"
+)
+
+# Continuação de uma resposta cortada pelo limite de tokens de saída: pede só os itens que faltaram.
+NF_PDF_ITEMS_CONTINUE_PROMPT = (
+    "Você é um extrator de dados para NOTAS FISCAIS brasileiras em PDF.\n"
+    "Uma extração anterior deste PDF foi interrompida depois de {count} itens da tabela de itens.\n"
+    "O último item extraído foi:\n"
+    "{last_item}\n\n"
+    "Retorne SOMENTE um objeto JSON {{\"items\": [...]}} com os itens que vêm DEPOIS desse, na ordem em que aparecem,\n"
+    "no mesmo formato de item (product_name, product_code, ncm, cfop, discount_value, icms_value, ipi_value,\n"
+    "quantity, unit_of_measure, unit_value). Não repita itens já extraídos.\n"
+    "Se não houver mais itens, retorne {{\"items\": []}}.\n"
+)
+
+# Nova leitura apenas dos campos obrigatórios do cabeçalho que vieram nulos.
+NF_PDF_HEADER_PROMPT = (
+    "Você é um extrator de dados para NOTAS FISCAIS brasileiras em PDF.\n"
+    "Leia o PDF e retorne SOMENTE um objeto JSON com os campos: {fields}.\n"
+    "- provider: razão social/nome do emitente (prestador ou fornecedor).\n"
+    "- date_of_issue: data de emissão no formato \"YYYY-MM-DD\".\n"
+    "- total_value: valor total da nota, como número JSON.\n"
+    "Use null apenas se o campo realmente não constar no documento.\n"
+)
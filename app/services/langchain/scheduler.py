@@ -0,0 +1,307 @@
+"""
+Agendador das chamadas ao Gemini.
+
+- Token buckets no Redis limitam requisições e tokens por minuto. A quota do
+  Gemini é por projeto, então o bucket é um só para todos os workers:
+  `LLM_REQUESTS_PER_MINUTE`/`LLM_TOKENS_PER_MINUTE` valem para o conjunto.
+- Uma janela de concorrência AIMD cresce aditivamente a cada sucesso e cai pela
+  metade a cada 429, convergindo para a vazão que a quota suporta.
+- Erros transitórios (429, 5xx, timeouts) são repetidos com backoff exponencial
+  com jitter (tenacity).
+- Chamadas interativas (usuários no WhatsApp) passam à frente do backfill em lote.
+
+Fila e chamadas em andamento por faixa, e a janela atual, são publicadas nos
+gauges `nfbot_llm_*` (lidos no momento da coleta) do processo que chama o
+Gemini, normalmente o worker.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+from loguru import logger
+from redis.exceptions import RedisError
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from app.core.config import settings
+from app.core.metrics import LLM_CONCURRENCY_WINDOW, LLM_IN_FLIGHT, LLM_QUEUE_DEPTH
+from app.core.redis import get_redis_client
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+	INTERACTIVE = 0
+	BATCH = 1
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+	"""Procura um código HTTP na exceção ou nas causas encadeadas (o langchain embrulha os erros do SDK)."""
+	for _ in range(5):
+		if exc is None:
+			break
+		for attr in ("code", "status_code"):
+			value = getattr(exc, attr, None)
+			if isinstance(value, int):
+				return value
+		exc = exc.__cause__ or exc.__context__
+	return None
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+	return _status_code(exc) == 429 or "RESOURCE_EXHAUSTED" in str(exc)
+
+
+def is_retryable(exc: BaseException) -> bool:
+	if is_rate_limited(exc) or isinstance(exc, (httpx.TimeoutException, httpx.NetworkError, asyncio.TimeoutError)):
+		return True
+	code = _status_code(exc)
+	return code is not None and (code == 408 or code >= 500)
+
+
+# KEYS: hash do bucket (tokens, atualizado em ms)
+# ARGV: capacidade, reposição por ms, quantidade, "take" ou "adjust"
+# Retorno: 0 se a quantidade foi debitada; senão, ms até haver tokens suficientes.
+# O relógio é o do Redis, comum a todos os workers.
+_TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+
+local wait = 0
+if ARGV[4] == 'adjust' then
+	tokens = math.min(capacity, tokens - amount)
+elseif tokens >= amount then
+	tokens = tokens - amount
+else
+	wait = math.ceil((amount - tokens) / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) * 2)
+return wait
+"""
+
+
+class TokenBucket:
+	"""
+	Token bucket com reposição contínua, compartilhado pelos processos via Redis;
+	`per_minute <= 0` desativa o limite. Sem Redis a chamada segue sem limite
+	(os 429 do Gemini ainda reduzem a janela AIMD).
+	"""
+
+	def __init__(self, per_minute: float, key: str) -> None:
+		self.capacity = float(per_minute)
+		self.rate = per_minute / 60_000.0
+		self.key = key
+		# Um pedido por vez por processo: os demais esperam na ordem de chegada.
+		self._lock = asyncio.Lock()
+
+	@property
+	def enabled(self) -> bool:
+		return self.capacity > 0
+
+	async def _eval(self, amount: float, mode: str) -> int:
+		redis = await get_redis_client()
+		return int(await redis.eval(_TOKEN_BUCKET_SCRIPT, 1, self.key, self.capacity, self.rate, amount, mode))
+
+	async def acquire(self, amount: float = 1.0) -> None:
+		if not self.enabled:
+			return
+		amount = min(amount, self.capacity)
+		async with self._lock:
+			while True:
+				try:
+					wait_ms = await self._eval(amount, "take")
+				except RedisError as e:
+					logger.warning(f"Token bucket {self.key} indisponível no Redis, seguindo sem limite: {e}")
+					return
+				if wait_ms <= 0:
+					return
+				await asyncio.sleep(wait_ms / 1000)
+
+	async def adjust(self, amount: float) -> None:
+		"""Debita (ou devolve, se negativo) tokens após conhecer o consumo real; pode ficar em débito."""
+		if not self.enabled:
+			return
+		try:
+			await self._eval(amount, "adjust")
+		except RedisError as e:
+			logger.warning(f"Falha ao ajustar o token bucket {self.key}: {e}")
+
+
+class LLMScheduler:
+	def __init__(
+			self,
+			requests_per_minute: int = settings.llm_requests_per_minute,
+			tokens_per_minute: int = settings.llm_tokens_per_minute,
+			initial_concurrency: int = settings.llm_initial_concurrency,
+			max_concurrency: int = settings.llm_max_concurrency,
+			min_concurrency: int = 1,
+			max_attempts: int = settings.llm_max_attempts,
+			retry_max_wait: float = settings.llm_retry_max_wait_seconds,
+	) -> None:
+		self._requests = TokenBucket(requests_per_minute, f"{settings.llm_bucket_prefix}requests")
+		self._tokens = TokenBucket(tokens_per_minute, f"{settings.llm_bucket_prefix}tokens")
+		self.min_concurrency = min_concurrency
+		self.max_concurrency = max_concurrency
+		self.max_attempts = max_attempts
+		self.retry_max_wait = retry_max_wait
+
+		self._window = float(initial_concurrency)
+		self._in_flight = 0
+		self._in_flight_by_lane: Dict[Priority, int] = {p: 0 for p in Priority}
+		self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+		self._seq = itertools.count()
+		self._last_decrease = 0.0
+
+		self.completed_total = 0
+		self.retries_total = 0
+		self.rate_limited_total = 0
+
+	@property
+	def in_flight(self) -> int:
+		return self._in_flight
+
+	@property
+	def window(self) -> float:
+		return self._window
+
+	def queue_depth(self, priority: Priority | None = None) -> int:
+		return sum(
+			1 for p, _, fut in self._waiters
+			if not fut.done() and (priority is None or p == priority)
+		)
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"in_flight": self._in_flight,
+			"in_flight_by_lane": {p.name.lower(): n for p, n in self._in_flight_by_lane.items()},
+			"concurrency_window": round(self._window, 2),
+			"queue_depth": {p.name.lower(): self.queue_depth(p) for p in Priority},
+			"completed_total": self.completed_total,
+			"retries_total": self.retries_total,
+			"rate_limited_total": self.rate_limited_total,
+		}
+
+	def expose_metrics(self) -> None:
+		"""Liga os gauges do Prometheus a este agendador; os valores são lidos a cada coleta."""
+		for priority in Priority:
+			lane = priority.name.lower()
+			LLM_QUEUE_DEPTH.labels(lane=lane).set_function(lambda p=priority: self.queue_depth(p))
+			LLM_IN_FLIGHT.labels(lane=lane).set_function(lambda p=priority: self._in_flight_by_lane[p])
+		LLM_CONCURRENCY_WINDOW.set_function(lambda: self._window)
+
+	async def submit(
+			self,
+			fn: Callable[[], Awaitable[T]],
+			priority: Priority = Priority.INTERACTIVE,
+			estimated_tokens: int = settings.llm_estimated_tokens_per_request,
+			count_tokens: Callable[[T], Optional[int]] | None = None,
+	) -> T:
+		"""Executa `fn` respeitando janela de concorrência, quotas e política de retry."""
+		retrying = AsyncRetrying(
+			stop=stop_after_attempt(self.max_attempts),
+			wait=wait_random_exponential(multiplier=1, max=self.retry_max_wait),
+			retry=retry_if_exception(is_retryable),
+			before_sleep=self._before_retry,
+			reraise=True,
+		)
+		async for attempt in retrying:
+			with attempt:
+				return await self._attempt(fn, priority, estimated_tokens, count_tokens)
+
+	async def _attempt(
+			self,
+			fn: Callable[[], Awaitable[T]],
+			priority: Priority,
+			estimated_tokens: int,
+			count_tokens: Callable[[T], Optional[int]] | None,
+	) -> T:
+		await self._acquire_slot(priority)
+		try:
+			await self._requests.acquire(1)
+			await self._tokens.acquire(estimated_tokens)
+			try:
+				result = await fn()
+			except Exception as e:
+				if is_rate_limited(e):
+					self._on_rate_limited()
+				raise
+
+			self._on_success()
+			used = count_tokens(result) if count_tokens else None
+			if used is not None:
+				await self._tokens.adjust(used - estimated_tokens)
+			return result
+		finally:
+			self._release_slot(priority)
+
+	async def _acquire_slot(self, priority: Priority) -> None:
+		if not self._waiters and self._in_flight < self._limit():
+			self._take_slot(priority)
+			return
+
+		future = asyncio.get_running_loop().create_future()
+		heapq.heappush(self._waiters, (int(priority), next(self._seq), future))
+		try:
+			await future
+		except asyncio.CancelledError:
+			# A vaga pode ter sido concedida logo antes do cancelamento.
+			if future.done() and not future.cancelled():
+				self._release_slot(priority)
+			raise
+
+	def _take_slot(self, priority: Priority) -> None:
+		self._in_flight += 1
+		self._in_flight_by_lane[priority] += 1
+
+	def _release_slot(self, priority: Priority) -> None:
+		self._in_flight -= 1
+		self._in_flight_by_lane[priority] -= 1
+		self._wake()
+
+	def _wake(self) -> None:
+		while self._waiters and self._in_flight < self._limit():
+			priority, _, future = heapq.heappop(self._waiters)
+			if future.done():
+				continue
+			self._take_slot(Priority(priority))
+			future.set_result(None)
+
+	def _limit(self) -> int:
+		return max(self.min_concurrency, int(self._window))
+
+	def _on_success(self) -> None:
+		self.completed_total += 1
+		self._window = min(float(self.max_concurrency), self._window + 1.0 / self._window)
+		self._wake()
+
+	def _on_rate_limited(self) -> None:
+		self.rate_limited_total += 1
+		now = time.monotonic()
+		# Vários 429 da mesma rajada contam como um único sinal de congestionamento.
+		if now - self._last_decrease < 1.0:
+			return
+		self._last_decrease = now
+		self._window = max(float(self.min_concurrency), self._window / 2)
+		logger.warning(f"⏳ Gemini retornou 429, janela de concorrência reduzida para {self._window:.1f}")
+
+	def _before_retry(self, retry_state) -> None:
+		self.retries_total += 1
+		exc = retry_state.outcome.exception() if retry_state.outcome else None
+		logger.warning(f"Retentando chamada ao Gemini (tentativa {retry_state.attempt_number}): {exc}")
+
+
+llm_scheduler: LLMScheduler = LLMScheduler()
+llm_scheduler.expose_metrics()
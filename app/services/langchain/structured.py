@@ -0,0 +1,194 @@
+"""
+Saída estruturada do extrator: schemas JSON enviados ao Gemini e leitura
+tolerante da resposta.
+
+Os schemas são derivados de `NoteBase`/`ItemNoteBase` (todos os campos
+anuláveis, `Decimal` como número e datas como texto), então um campo novo na
+nota passa a ser pedido ao modelo sem mexer aqui.
+
+A resposta é lida com orjson. Se não for JSON válido (cercas de markdown,
+vírgula sobrando, saída cortada pelo limite de tokens), é reparada localmente
+sem nova chamada ao modelo; uma saída cortada é fechada no último item completo
+e sinalizada como truncada para que o extrator peça só os itens restantes.
+"""
+import re
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple, get_args
+
+import orjson
+from loguru import logger
+from pydantic import BaseModel
+
+from app.schemas.notes import ItemNoteBase, NoteBase
+
+# Campos da nota que não vêm do documento.
+_NOT_EXTRACTED = {
+	"pdf_url",
+	"extractor_stage",
+	"content_hash",
+	"storage_key",
+	"source_size",
+	"payload_size",
+	"preprocess_ms",
+}
+
+# Sem eles `build_note_create` não consegue montar a nota.
+REQUIRED_HEADER_FIELDS = ("provider", "date_of_issue", "total_value")
+
+_DESCRIPTIONS = {
+	"date_of_issue": "Data de emissão no formato YYYY-MM-DD",
+	"access_key": "Chave de acesso com 44 dígitos",
+	"note_type": "NFE, NFCE, NFSE, CTE ou MDFE",
+}
+
+
+def _json_type(annotation: Any) -> str:
+	args = [arg for arg in get_args(annotation) if arg is not type(None)]
+	annotation = args[0] if args else annotation
+	if annotation in (Decimal, float):
+		return "number"
+	if annotation is int:
+		return "integer"
+	if annotation in (str, date):
+		return "string"
+	raise TypeError(f"Tipo sem mapeamento para o schema de extração: {annotation!r}")
+
+
+def _object_schema(model: type[BaseModel], exclude: set = frozenset()) -> Dict[str, Any]:
+	properties = {}
+	for name, field in model.model_fields.items():
+		if name in exclude:
+			continue
+		prop: Dict[str, Any] = {"type": [_json_type(field.annotation), "null"]}
+		if name in _DESCRIPTIONS:
+			prop["description"] = _DESCRIPTIONS[name]
+		properties[name] = prop
+	return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+ITEM_SCHEMA = _object_schema(ItemNoteBase)
+ITEMS_SCHEMA: Dict[str, Any] = {
+	"type": "object",
+	"properties": {"items": {"type": "array", "items": ITEM_SCHEMA}},
+	"required": ["items"],
+}
+NOTE_SCHEMA: Dict[str, Any] = _object_schema(NoteBase, exclude=_NOT_EXTRACTED)
+NOTE_SCHEMA["properties"]["items"] = ITEMS_SCHEMA["properties"]["items"]
+NOTE_SCHEMA["required"].append("items")
+
+
+def header_schema(fields: List[str]) -> Dict[str, Any]:
+	return {
+		"type": "object",
+		"properties": {name: NOTE_SCHEMA["properties"][name] for name in fields},
+		"required": list(fields),
+	}
+
+
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+
+
+def parse_model_json(raw: str) -> Tuple[Dict[str, Any], bool]:
+	"""
+	Lê a resposta do modelo. Retorna o objeto e se a saída estava truncada.
+	Levanta `ValueError` só quando nada aproveitável é encontrado.
+	"""
+	try:
+		return _as_object(orjson.loads(raw)), False
+	except orjson.JSONDecodeError:
+		pass
+
+	text = _FENCE_RE.sub("", raw)
+	start = text.find("{")
+	if start == -1:
+		raise ValueError(f"Nenhum objeto JSON na resposta do modelo: {raw[:200]!r}")
+	text = _TRAILING_COMMA_RE.sub(r"\1", text[start:])
+	try:
+		return _as_object(orjson.loads(text)), False
+	except orjson.JSONDecodeError:
+		pass
+
+	closed = _close_truncated(text)
+	if closed is None:
+		raise ValueError(f"Resposta do modelo sem JSON recuperável: {raw[:200]!r}")
+	logger.warning(f"Resposta do modelo truncada/inválida, reparada ({len(raw)} caracteres)")
+	return _as_object(orjson.loads(closed)), True
+
+
+def _as_object(value: Any) -> Dict[str, Any]:
+	if not isinstance(value, dict):
+		raise ValueError(f"Resposta do modelo não é um objeto JSON: {type(value).__name__}")
+	return value
+
+
+def _close_truncated(text: str) -> Optional[str]:
+	"""Corta no último objeto/lista fechado por completo e fecha os que ficaram abertos."""
+	stack: List[str] = []
+	last_cut: Optional[Tuple[int, List[str]]] = None
+	in_string = escaped = False
+	for pos, char in enumerate(text):
+		if in_string:
+			if escaped:
+				escaped = False
+			elif char == "\\":
+				escaped = True
+			elif char == '"':
+				in_string = False
+			continue
+		if char == '"':
+			in_string = True
+		elif char in "{[":
+			stack.append("}" if char == "{" else "]")
+		elif char in "}]":
+			if not stack or stack.pop() != char:
+				return None
+			last_cut = (pos + 1, list(stack))
+			if not stack:
+				return text[:pos + 1]
+	if last_cut is None:
+		return None
+	cut, open_containers = last_cut
+	candidate = _TRAILING_COMMA_RE.sub(r"\1", text[:cut] + "".join(reversed(open_containers)))
+	try:
+		orjson.loads(candidate)
+	except orjson.JSONDecodeError:
+		return None
+	return candidate
+
+
+def clean_items(items: Any) -> List[Dict[str, Any]]:
+	"""
+	Descarta só os itens inválidos (sem `product_name`, que `ItemNoteBase` exige)
+	e normaliza números vindos como texto ("1.234,56"); o restante da nota é aproveitado.
+	"""
+	if not isinstance(items, list):
+		return []
+	numeric = [name for name, prop in ITEM_SCHEMA["properties"].items() if "number" in prop["type"]]
+	cleaned = []
+	for item in items:
+		if not isinstance(item, dict) or not str(item.get("product_name") or "").strip():
+			continue
+		for name in numeric:
+			value = item.get(name)
+			if isinstance(value, str):
+				item[name] = _parse_number(value)
+		cleaned.append(item)
+	if len(cleaned) < len(items):
+		logger.warning(f"{len(items) - len(cleaned)} item(ns) inválido(s) descartado(s) da resposta do modelo")
+	return cleaned
+
+
+def _parse_number(value: str) -> Optional[float]:
+	text = value.strip().replace("R$", "").strip()
+	if "," in text:
+		text = text.replace(".", "").replace(",", ".")
+	try:
+		return float(text)
+	except ValueError:
+		return None
+
+
+def missing_header_fields(data: Dict[str, Any]) -> List[str]:
+	return [name for name in REQUIRED_HEADER_FIELDS if data.get(name) in (None, "")]
@@ -0,0 +1,126 @@
+"""
+Leitura direta do XML autorizado de NF-e / NFC-e (nfeProc ou NFe).
+
+O XML traz exatamente os campos de `NoteCreate`/`ItemNoteBase`, então nenhuma
+chamada ao modelo é necessária. O parse usa `iterparse` e descarta cada `det`
+assim que ele é convertido, mantendo memória constante mesmo em notas com
+milhares de itens.
+"""
+import io
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Dict, List, Optional
+
+from loguru import logger
+
+from app.schemas.notes import ItemNoteBase, NoteCreate
+from app.services.access_key import NOTE_TYPE_BY_MODEL
+
+XML_MIMETYPES = {"application/xml", "text/xml"}
+
+
+def _local(tag: str) -> str:
+	return tag.rsplit("}", 1)[-1]
+
+
+def _find(elem: Optional[ET.Element], *path: str) -> Optional[ET.Element]:
+	"""Navega pelos filhos usando apenas o nome local das tags; `*` casa qualquer filho."""
+	for name in path:
+		if elem is None:
+			return None
+		elem = next((child for child in elem if name == "*" or _local(child.tag) == name), None)
+	return elem
+
+
+def _text(elem: Optional[ET.Element], *path: str) -> Optional[str]:
+	found = _find(elem, *path)
+	if found is None or found.text is None:
+		return None
+	return found.text.strip() or None
+
+
+def _item_from_det(det: ET.Element) -> Optional[ItemNoteBase]:
+	"""Converte um `det`; sem `xProd` (que `ItemNoteBase` exige) o item é descartado."""
+	prod = _find(det, "prod")
+	product_name = _text(prod, "xProd")
+	if not product_name:
+		return None
+	imposto = _find(det, "imposto")
+	return ItemNoteBase(
+		product_name=product_name,
+		product_code=_text(prod, "cProd"),
+		ncm=_text(prod, "NCM"),
+		cfop=_text(prod, "CFOP"),
+		discount_value=_text(prod, "vDesc"),
+		icms_value=_text(imposto, "ICMS", "*", "vICMS"),
+		ipi_value=_text(imposto, "IPI", "IPITrib", "vIPI"),
+		quantity=_text(prod, "qCom"),
+		unit_of_measure=_text(prod, "uCom"),
+		unit_value=_text(prod, "vUnCom"),
+	)
+
+
+def parse_nfe_xml(source: bytes | BinaryIO, pdf_url: str | None = None) -> NoteCreate:
+	if isinstance(source, (bytes, bytearray)):
+		source = io.BytesIO(source)
+
+	header: Dict[str, Optional[str]] = {}
+	items: List[ItemNoteBase] = []
+	skipped: List[str] = []
+	stack: List[ET.Element] = []
+
+	for event, elem in ET.iterparse(source, events=("start", "end")):
+		if event == "start":
+			stack.append(elem)
+			if _local(elem.tag) == "infNFe":
+				header["access_key"] = (elem.get("Id") or "").removeprefix("NFe") or None
+			continue
+
+		stack.pop()
+		name = _local(elem.tag)
+
+		if name == "det":
+			item = _item_from_det(elem)
+			if item is None:
+				skipped.append(elem.get("nItem") or "?")
+			else:
+				items.append(item)
+			if stack:
+				stack[-1].remove(elem)
+		elif name == "ide":
+			header["note_type"] = NOTE_TYPE_BY_MODEL.get(_text(elem, "mod") or "")
+			header["series"] = _text(elem, "serie")
+			header["note_number"] = _text(elem, "nNF")
+			header["nature_of_operation"] = _text(elem, "natOp")
+			issued = _text(elem, "dhEmi") or _text(elem, "dEmi")
+			header["date_of_issue"] = issued[:10] if issued else None
+		elif name == "emit":
+			header["issuer_cnpj"] = _text(elem, "CNPJ") or _text(elem, "CPF")
+			header["provider"] = _text(elem, "xNome")
+			header["issuer_ie"] = _text(elem, "IE")
+			header["issuer_city"] = _text(elem, "enderEmit", "xMun")
+			header["issuer_state"] = _text(elem, "enderEmit", "UF")
+			header["issuer_zip_code"] = _text(elem, "enderEmit", "CEP")
+		elif name == "ICMSTot":
+			header["total_value"] = _text(elem, "vNF")
+		elif name == "infProt":
+			header["protocol_number"] = _text(elem, "nProt")
+			header["access_key"] = header.get("access_key") or _text(elem, "chNFe")
+
+	if not header.get("provider") or not header.get("date_of_issue"):
+		raise ValueError("XML não parece ser uma NF-e/NFC-e autorizada (emitente ou data ausentes)")
+	if skipped:
+		logger.warning(
+			f"{len(skipped)} item(ns) sem descrição (xProd) descartado(s) do XML da nota "
+			f"{header.get('access_key')}: nItem {', '.join(skipped)}"
+		)
+
+	return NoteCreate(
+		**header,
+		pdf_url=pdf_url or "",
+		extractor_stage="nfe_xml",
+		items=items,
+	)
+
+
+def is_xml_document(mimetype: Optional[str], file_name: str) -> bool:
+	return mimetype in XML_MIMETYPES or file_name.lower().endswith(".xml")
@@ -1,20 +1,181 @@
+import asyncio
+import base64
+import hashlib
 import time
+from typing import BinaryIO, List
 
 from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import settings
+from app.core.metrics import PERSIST_DURATION, PREPROCESS_BYTES, PREPROCESS_DURATION, observe
+from app.db.storage import document_storage
 from app.models.notes import Note, ItemNote
-from app.schemas.notes import NoteCreate, ItemNoteBase
-from app.services.langchain.extractor import nf_extractor
+from app.schemas.notes import NoteCreate, ItemNoteBase, NoteProcessResult
+from app.services.access_key import extract_access_key_from_pdf, known_access_keys
+from app.services.langchain.chain import nf_extractor_chain
+from app.services.langchain.preprocess import PreparedDocument, preprocess_image, preprocess_pdf
+from app.services.langchain.scheduler import Priority
+from app.services.nfe_xml import parse_nfe_xml
+from app.services.reports_service import apply_note
 
 
-async def process_pdf_b64(pdf_b64: str, db: AsyncSession, pdf_url: str | None = None) -> None:
-	t0 = time.perf_counter()
-	nf_dict = await nf_extractor.extract_from_b64(pdf_b64)
-	logger.info(nf_dict)
-	t1 = time.perf_counter()
-	logger.info(f"extract_from_b64 levou {t1 - t0:.2f}s")
+async def process_pdf_b64(pdf_b64: str, db: AsyncSession, pdf_url: str | None = None) -> NoteProcessResult:
+	return await process_pdf_bytes(base64.b64decode(pdf_b64), db, pdf_url=pdf_url)
 
+
+async def process_pdf_bytes(
+		pdf_bytes: bytes,
+		db: AsyncSession,
+		pdf_url: str | None = None,
+		priority: Priority = Priority.INTERACTIVE,
+		content_hash: str | None = None,
+) -> NoteProcessResult:
+	access_key = await asyncio.to_thread(extract_access_key_from_pdf, pdf_bytes)
+	if access_key:
+		existing_id = await known_access_keys.lookup(access_key, db)
+		if existing_id is not None:
+			logger.bind(event="note_duplicate").info(f"Nota {access_key} já registrada (id={existing_id}), extração ignorada")
+			return NoteProcessResult(note_id=existing_id, created=False, access_key=access_key)
+
+	# Encerra a transação de leitura aberta até aqui (por esta função ou pelo chamador):
+	# a conexão volta ao pool durante a extração, que pode levar dezenas de segundos.
+	await db.rollback()
+
+	content_hash = content_hash or hashlib.sha256(pdf_bytes).hexdigest()
+	# O upload do original corre em paralelo com o pré-processamento e a extração.
+	upload = asyncio.create_task(_store_original(pdf_bytes, content_hash))
+	try:
+		prepared = await asyncio.to_thread(preprocess_pdf, pdf_bytes)
+	except BaseException:
+		upload.cancel()
+		raise
+	return await _extract_and_upsert(
+		prepared,
+		db,
+		pdf_url=pdf_url,
+		priority=priority,
+		content_hash=content_hash,
+		access_key=access_key,
+		upload=upload,
+		source="pdf",
+	)
+
+
+async def process_image_bytes(
+		image_bytes: bytes,
+		db: AsyncSession,
+		pdf_url: str | None = None,
+		priority: Priority = Priority.INTERACTIVE,
+		content_hash: str | None = None,
+) -> NoteProcessResult:
+	"""Foto de cupom (NFC-e): vira um PDF de uma página no pré-processamento e segue o caminho do PDF."""
+	await db.rollback()
+	content_hash = content_hash or hashlib.sha256(image_bytes).hexdigest()
+	prepared = await asyncio.to_thread(preprocess_image, image_bytes)
+	# Guarda o PDF gerado (e não a foto): é o que o painel sabe exibir.
+	upload = asyncio.create_task(_store_original(prepared.pdf_bytes, content_hash))
+	return await _extract_and_upsert(
+		prepared,
+		db,
+		pdf_url=pdf_url,
+		priority=priority,
+		content_hash=content_hash,
+		access_key=None,
+		upload=upload,
+		source="image",
+	)
+
+
+async def _extract_and_upsert(
+		prepared: PreparedDocument,
+		db: AsyncSession,
+		pdf_url: str | None,
+		priority: Priority,
+		content_hash: str,
+		access_key: str | None,
+		upload: "asyncio.Task[str | None]",
+		source: str,
+) -> NoteProcessResult:
+	PREPROCESS_DURATION.labels(source=source).observe(prepared.elapsed_ms / 1000)
+	PREPROCESS_BYTES.labels(source=source, stage="received").observe(prepared.source_size)
+	PREPROCESS_BYTES.labels(source=source, stage="payload").observe(prepared.payload_size)
+	logger.bind(event="document_preprocessed").info(
+		f"pré-processamento ({source}) levou {prepared.elapsed_ms}ms: "
+		f"{prepared.source_size} -> {prepared.payload_size} bytes, {prepared.reencoded_images} imagens recodificadas"
+	)
+
+	try:
+		t0 = time.perf_counter()
+		extraction = await nf_extractor_chain.extract(prepared.pdf_bytes, priority)
+		nf_dict = extraction.data
+		t1 = time.perf_counter()
+		logger.bind(event="pdf_extracted").info(
+			f"extração ({extraction.stage}) levou {t1 - t0:.2f}s: "
+			f"nota {nf_dict.get('note_number')}, {len(nf_dict.get('items') or [])} itens"
+		)
+
+		note_in = build_note_create(
+			nf_dict,
+			pdf_url=pdf_url,
+			access_key=access_key,
+			extractor_stage=extraction.stage,
+		)
+		note_in.content_hash = content_hash
+		note_in.source_size = prepared.source_size
+		note_in.payload_size = prepared.payload_size
+		note_in.preprocess_ms = prepared.elapsed_ms
+		note_in.storage_key = await upload
+	finally:
+		# Se a extração falhar, o upload não é mais aguardado por ninguém: cancela em vez de deixá-lo solto.
+		upload.cancel()
+	return await upsert_note(note_in, db)
+
+
+async def _store_original(pdf_bytes: bytes, content_hash: str) -> str | None:
+	"""Grava o PDF no storage de documentos; falha no upload não impede o registro da nota."""
+	try:
+		return await document_storage.save(pdf_bytes, content_hash)
+	except Exception as e:
+		logger.warning(f"Falha ao armazenar o PDF {content_hash[:12]}: {e}")
+		return None
+
+
+async def process_xml_bytes(
+		xml_source: bytes | BinaryIO,
+		db: AsyncSession,
+		pdf_url: str | None = None,
+		content_hash: str | None = None,
+) -> NoteProcessResult:
+	"""
+	Registra a nota a partir do XML autorizado, sem passar pelo extrator.
+	Aceita bytes ou um arquivo (ex.: `MediaBuffer.stream()`); neste caso `content_hash` é obrigatório.
+	"""
+	if content_hash is None:
+		if not isinstance(xml_source, (bytes, bytearray)):
+			raise ValueError("content_hash é obrigatório quando o XML é lido de um stream")
+		content_hash = hashlib.sha256(xml_source).hexdigest()
+
+	note_in = await asyncio.to_thread(parse_nfe_xml, xml_source, pdf_url)
+	note_in.content_hash = content_hash
+	if note_in.access_key:
+		existing_id = await known_access_keys.lookup(note_in.access_key, db)
+		if existing_id is not None:
+			logger.bind(event="note_duplicate").info(f"Nota {note_in.access_key} já registrada (id={existing_id})")
+			return NoteProcessResult(note_id=existing_id, created=False, access_key=note_in.access_key)
+
+	return await upsert_note(note_in, db)
+
+
+def build_note_create(
+		nf_dict: dict,
+		pdf_url: str | None = None,
+		access_key: str | None = None,
+		extractor_stage: str | None = None,
+) -> NoteCreate:
+	"""Converte o dicionário no formato de `NF_PDF_EXTRACT_PROMPT` em `NoteCreate`."""
 	raw_items = nf_dict.get("items") or []
 	valid_items = [
 		i for i in raw_items
@@ -24,11 +185,11 @@ async def process_pdf_b64(pdf_b64: str, db: AsyncSession, pdf_url: str | None =
 		   and i.get("unit_value") is not None
 	]
 
-	note_in = NoteCreate(
+	return NoteCreate(
 		note_type=nf_dict.get("note_type"),
 		note_number=nf_dict.get("note_number"),
 		series=nf_dict.get("series"),
-		access_key=nf_dict.get("access_key"),
+		access_key=access_key or nf_dict.get("access_key"),
 		issuer_cnpj=nf_dict.get("issuer_cnpj"),
 		issuer_ie=nf_dict.get("issuer_ie"),
 		issuer_city=nf_dict.get("issuer_city"),
@@ -40,6 +201,7 @@ async def process_pdf_b64(pdf_b64: str, db: AsyncSession, pdf_url: str | None =
 		date_of_issue=nf_dict["date_of_issue"],
 		total_value=nf_dict["total_value"],
 		pdf_url=pdf_url or "",
+		extractor_stage=extractor_stage,
 		items=[
 			ItemNoteBase(
 				product_name=i["product_name"],
@@ -57,41 +219,72 @@ async def process_pdf_b64(pdf_b64: str, db: AsyncSession, pdf_url: str | None =
 		],
 	)
 
-	note = Note(
-		note_type=note_in.note_type,
-		note_number=note_in.note_number,
-		series=note_in.series,
+
+async def upsert_note(note_in: NoteCreate, db: AsyncSession) -> NoteProcessResult:
+	"""
+	Insere a nota de forma idempotente pela chave de acesso.
+	Se outra execução já registrou a mesma chave, nada é inserido e o id existente é retornado.
+
+	A nota é inserida com `RETURNING id` e os itens em lote, direto do `NoteCreate`
+	(sem montar objetos ORM): executemany para notas comuns e COPY do asyncpg a
+	partir de `settings.items_copy_threshold` itens. Os relatórios pré-agregados são
+	atualizados na mesma transação.
+	"""
+	with observe(PERSIST_DURATION, created="error") as labels:
+		result = await _upsert_note(note_in, db)
+		labels["created"] = str(result.created).lower()
+	return result
+
+
+async def _upsert_note(note_in: NoteCreate, db: AsyncSession) -> NoteProcessResult:
+	stmt = (
+		insert(Note)
+		.values(**note_in.model_dump(exclude={"items"}))
+		.on_conflict_do_nothing(
+			index_elements=[Note.access_key],
+			index_where=Note.access_key.isnot(None),
+		)
+		.returning(Note.id)
+	)
+	note_id = await db.scalar(stmt)
+
+	if note_id is None:
+		await db.rollback()
+		existing_id = await db.scalar(select(Note.id).where(Note.access_key == note_in.access_key))
+		await known_access_keys.add(note_in.access_key, existing_id)
+		logger.bind(event="note_duplicate").info(f"Nota {note_in.access_key} já registrada (id={existing_id})")
+		return NoteProcessResult(note_id=existing_id, created=False, access_key=note_in.access_key)
+
+	await insert_items(db, note_id, note_in.items)
+	await apply_note(db, note_in)
+	await db.commit()
+
+	if note_in.access_key:
+		await known_access_keys.add(note_in.access_key, note_id)
+	return NoteProcessResult(
+		note_id=note_id,
+		created=True,
 		access_key=note_in.access_key,
-		issuer_cnpj=note_in.issuer_cnpj,
-		issuer_ie=note_in.issuer_ie,
-		issuer_city=note_in.issuer_city,
-		issuer_state=note_in.issuer_state,
-		issuer_zip_code=note_in.issuer_zip_code,
-		provider=note_in.provider,
-		nature_of_operation=note_in.nature_of_operation,
-		protocol_number=note_in.protocol_number,
-		date_of_issue=note_in.date_of_issue,
-		total_value=note_in.total_value,
-		pdf_url=note_in.pdf_url,
+		extractor_stage=note_in.extractor_stage,
 	)
-	db.add(note)
-	await db.flush()
-
-	for item_in in note_in.items:
-		db.add(
-			ItemNote(
-				note_id=note.id,
-				product_name=item_in.product_name,
-				product_code=item_in.product_code,
-				ncm=item_in.ncm,
-				cfop=item_in.cfop,
-				discount_value=item_in.discount_value,
-				icms_value=item_in.icms_value,
-				ipi_value=item_in.ipi_value,
-				quantity=item_in.quantity,
-				unit_of_measure=item_in.unit_of_measure,
-				unit_value=item_in.unit_value,
-			)
+
+
+async def insert_items(db: AsyncSession, note_id: int, items: List[ItemNoteBase]) -> None:
+	if not items:
+		return
+
+	if len(items) < settings.items_copy_threshold:
+		await db.execute(
+			insert(ItemNote),
+			[{**item.model_dump(), "note_id": note_id} for item in items],
 		)
+		return
 
-	await db.commit()
+	columns = ["note_id", *ItemNoteBase.model_fields]
+	conn = await db.connection()
+	raw = await conn.get_raw_connection()
+	await raw.driver_connection.copy_records_to_table(
+		ItemNote.__tablename__,
+		columns=columns,
+		records=[(note_id, *item.model_dump().values()) for item in items],
+	)
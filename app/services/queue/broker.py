@@ -0,0 +1,229 @@
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from app.core.config import settings
+from app.core.redis import get_redis_client
+from app.schemas.jobs import DocumentJob
+
+# Move atomicamente os jobs cujo horário de retentativa venceu do sorted set de
+# atrasados de volta para o stream principal.
+_PROMOTE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, payload in ipairs(due) do
+	redis.call('ZREM', KEYS[1], payload)
+	redis.call('XADD', KEYS[2], '*', 'job', payload)
+end
+return #due
+"""
+
+Entry = Tuple[str, DocumentJob]
+
+
+class JobQueue:
+	"""
+	Fila durável de jobs sobre Redis Streams com consumer groups.
+
+	- `enqueue` publica o job no stream principal.
+	- Workers leem com `read`, confirmam com `ack` e renovam a visibilidade de
+	  jobs longos com `touch`.
+	- Mensagens de consumidores que morreram são recuperadas com `claim_stale`
+	  após `visibility_timeout`.
+	- Falhas são reagendadas com backoff exponencial (`retry_later`) e, ao
+	  esgotar as tentativas, vão para o stream de dead-letter.
+
+	Há uma fila por instância da Evolution (`queue_for`); cada worker consome só
+	as instâncias que recebeu, então um número com pico de envios acumula jobs
+	apenas no próprio stream.
+	"""
+
+	def __init__(
+			self,
+			stream: str = settings.queue_stream_name,
+			group: str = settings.queue_group_name,
+			dead_letter_stream: str = settings.queue_dead_letter_stream,
+			delayed_key: str = settings.queue_delayed_key,
+			visibility_timeout: int = settings.queue_visibility_timeout_seconds,
+			max_attempts: int = settings.queue_max_attempts,
+	) -> None:
+		self.stream = stream
+		self.group = group
+		self.dead_letter_stream = dead_letter_stream
+		self.delayed_key = delayed_key
+		self.visibility_timeout = visibility_timeout
+		self.max_attempts = max_attempts
+
+	async def _redis(self) -> Redis:
+		return await get_redis_client()
+
+	async def ensure_group(self) -> None:
+		"""Cria o consumer group (e o stream) caso ainda não existam."""
+		redis = await self._redis()
+		try:
+			await redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+		except ResponseError as exc:
+			if "BUSYGROUP" not in str(exc):
+				raise
+
+	async def enqueue(self, job: DocumentJob) -> str:
+		redis = await self._redis()
+		return await redis.xadd(self.stream, {"job": job.model_dump_json()})
+
+	async def enqueue_delayed(self, job: DocumentJob, delay: float) -> None:
+		"""Agenda o job para entrar no stream daqui a `delay` segundos (promovido por `promote_due`)."""
+		redis = await self._redis()
+		await redis.zadd(self.delayed_key, {job.model_dump_json(): time.time() + delay})
+
+	async def delayed_count(self) -> int:
+		redis = await self._redis()
+		return await redis.zcard(self.delayed_key)
+
+	async def defer(self, entry_id: str, job: DocumentJob, delay: float) -> None:
+		"""Devolve o job à fila de atrasados sem contar uma tentativa."""
+		redis = await self._redis()
+		async with redis.pipeline(transaction=True) as pipe:
+			pipe.zadd(self.delayed_key, {job.model_dump_json(): time.time() + delay})
+			pipe.xack(self.stream, self.group, entry_id)
+			pipe.xdel(self.stream, entry_id)
+			await pipe.execute()
+
+	async def read(self, consumer: str, count: int = 1, block_ms: int = 5000) -> List[Entry]:
+		redis = await self._redis()
+		response = await redis.xreadgroup(
+			self.group,
+			consumer,
+			{self.stream: ">"},
+			count=count,
+			block=block_ms,
+		)
+		entries: List[Entry] = []
+		for _stream, messages in response or []:
+			entries.extend(await self._decode(messages))
+		return entries
+
+	async def claim_stale(
+			self,
+			consumer: str,
+			count: int = 10,
+			on_dead_letter: Optional[Callable[[DocumentJob], Awaitable[None]]] = None,
+	) -> List[Entry]:
+		"""
+		Assume jobs pendentes há mais de `visibility_timeout` segundos. Os que já
+		foram entregues demais vão para o dead-letter e são passados a `on_dead_letter`.
+		"""
+		redis = await self._redis()
+		_next, messages, _deleted = await redis.xautoclaim(
+			self.stream,
+			self.group,
+			consumer,
+			min_idle_time=self.visibility_timeout * 1000,
+			count=count,
+		)
+		entries: List[Entry] = []
+		for entry_id, job in await self._decode(messages):
+			pending = await redis.xpending_range(self.stream, self.group, entry_id, entry_id, 1)
+			deliveries = pending[0]["times_delivered"] if pending else 1
+			if deliveries > self.max_attempts:
+				error = "visibility timeout excedido repetidamente"
+				await self.dead_letter(entry_id, job, error)
+				if on_dead_letter is not None:
+					await on_dead_letter(job.model_copy(update={"last_error": error}))
+				continue
+			entries.append((entry_id, job))
+		return entries
+
+	async def touch(self, entry_id: str, consumer: str) -> None:
+		"""Renova o tempo de visibilidade de um job ainda em processamento."""
+		redis = await self._redis()
+		await redis.xclaim(self.stream, self.group, consumer, 0, [entry_id], justid=True)
+
+	async def ack(self, entry_id: str) -> None:
+		redis = await self._redis()
+		async with redis.pipeline(transaction=True) as pipe:
+			pipe.xack(self.stream, self.group, entry_id)
+			pipe.xdel(self.stream, entry_id)
+			await pipe.execute()
+
+	async def retry_later(self, entry_id: str, job: DocumentJob, error: str) -> bool:
+		"""
+		Reagenda o job com backoff exponencial ou o envia para o dead-letter.
+		:return: True se o job foi reagendado, False se foi para o dead-letter.
+		"""
+		job = job.model_copy(update={"attempts": job.attempts + 1, "last_error": error})
+		if job.attempts >= self.max_attempts:
+			await self.dead_letter(entry_id, job, error)
+			return False
+
+		delay = self.backoff(job.attempts)
+		redis = await self._redis()
+		async with redis.pipeline(transaction=True) as pipe:
+			pipe.zadd(self.delayed_key, {job.model_dump_json(): time.time() + delay})
+			pipe.xack(self.stream, self.group, entry_id)
+			pipe.xdel(self.stream, entry_id)
+			await pipe.execute()
+		logger.warning(f"🔁 Job {job.id} reagendado em {delay:.1f}s (tentativa {job.attempts})")
+		return True
+
+	async def dead_letter(self, entry_id: str, job: DocumentJob, error: str) -> None:
+		job = job.model_copy(update={"last_error": error})
+		redis = await self._redis()
+		async with redis.pipeline(transaction=True) as pipe:
+			pipe.xadd(self.dead_letter_stream, {"job": job.model_dump_json(), "error": error[:1000]})
+			pipe.xack(self.stream, self.group, entry_id)
+			pipe.xdel(self.stream, entry_id)
+			await pipe.execute()
+		logger.error(f"☠️ Job {job.id} enviado para dead-letter após {job.attempts} tentativas: {error}")
+
+	async def promote_due(self, limit: int = 100) -> int:
+		"""Devolve ao stream principal os jobs cujo backoff já expirou."""
+		redis = await self._redis()
+		return await redis.eval(_PROMOTE_DUE_SCRIPT, 2, self.delayed_key, self.stream, time.time(), limit)
+
+	@staticmethod
+	def backoff(attempt: int) -> float:
+		"""Backoff exponencial com jitter, limitado por `queue_retry_max_seconds`."""
+		ceiling = min(settings.queue_retry_max_seconds, settings.queue_retry_base_seconds * 2 ** (attempt - 1))
+		return random.uniform(ceiling / 2, ceiling)
+
+	async def _decode(self, messages) -> List[Entry]:
+		entries: List[Entry] = []
+		for entry_id, fields in messages or []:
+			try:
+				entries.append((entry_id, DocumentJob.model_validate_json(fields["job"])))
+			except (KeyError, TypeError, ValueError):
+				logger.error(f"Mensagem inválida descartada da fila: {entry_id}")
+				await self.ack(entry_id)
+		return entries
+
+
+_queues: Dict[str, JobQueue] = {}
+
+
+def queue_for(instance: str | None = None) -> JobQueue:
+	"""
+	Fila da instância. A instância padrão usa os nomes de `settings` sem sufixo,
+	o que mantém os jobs já enfileirados antes da divisão por instância.
+	"""
+	instance = instance or settings.evolution_instance_name
+	if instance not in _queues:
+		suffix = "" if instance == settings.evolution_instance_name else f":{instance}"
+		_queues[instance] = JobQueue(
+			stream=f"{settings.queue_stream_name}{suffix}",
+			dead_letter_stream=f"{settings.queue_dead_letter_stream}{suffix}",
+			delayed_key=f"{settings.queue_delayed_key}{suffix}",
+		)
+	return _queues[instance]
+
+
+job_queue: JobQueue = queue_for()
+
+# Documentos da ingestão em lote: stream próprio para um backfill não atrasar as mensagens do WhatsApp.
+batch_queue: JobQueue = JobQueue(
+	stream=settings.queue_batch_stream_name,
+	dead_letter_stream=f"{settings.queue_batch_stream_name}:dead",
+	delayed_key=f"{settings.queue_batch_stream_name}:delayed",
+)
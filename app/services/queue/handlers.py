@@ -0,0 +1,71 @@
+from loguru import logger
+
+from app.db.session import job_session
+from app.db.storage import document_storage
+from app.schemas.jobs import DocumentJob
+from app.services.evolution.evolution_integration import evolution_clients
+from app.services.ingest_service import ingest_document, record_batch_result
+from app.services.notes_service import process_image_bytes, process_pdf_bytes, process_xml_bytes
+from app.services.queue.outbox import reply_outbox
+
+
+async def handle_document_job(job: DocumentJob) -> None:
+	"""Baixa o documento (PDF, XML ou foto) da mensagem, extrai/persiste a nota e agenda a resposta ao usuário."""
+	if job.batch_id:
+		await handle_batch_job(job)
+		return
+
+	evolution_client = evolution_clients.get(job.instance)
+	with await evolution_client.download_media(job.message_id, job.media_url) as media:
+		async with job_session() as db:
+			if job.document_type == "xml":
+				result = await process_xml_bytes(
+					media.stream(),
+					db,
+					pdf_url=job.pdf_url,
+					content_hash=media.sha256,
+				)
+			elif job.document_type == "image":
+				result = await process_image_bytes(
+					media.read(),
+					db,
+					pdf_url=job.pdf_url,
+					content_hash=media.sha256,
+				)
+			else:
+				result = await process_pdf_bytes(
+					media.read(),
+					db,
+					pdf_url=job.pdf_url,
+					content_hash=media.sha256,
+				)
+
+	if result.created:
+		kind, reply = "created", f"Nota fiscal '{job.title}' processada com sucesso e registrada no sistema."
+	else:
+		kind, reply = "duplicate", f"Nota fiscal '{job.title}' já estava registrada no sistema."
+	await reply_outbox.add(job.instance, job.phone_number, kind, reply, title=job.title)
+
+
+async def handle_batch_job(job: DocumentJob) -> None:
+	"""Documento da ingestão em lote: lido do storage, sem resposta no WhatsApp."""
+	content = await document_storage.load(job.storage_key)
+	outcome = await ingest_document(job.title, content)
+	await record_batch_result(job.batch_id, outcome)
+
+
+async def handle_document_job_failure(job: DocumentJob) -> None:
+	"""Avisa o usuário quando o job esgota as tentativas e vai para o dead-letter."""
+	if job.batch_id:
+		await record_batch_result(job.batch_id, "failed", error=f"{job.title}: {job.last_error}")
+		return
+	try:
+		await reply_outbox.add(
+			job.instance,
+			job.phone_number,
+			"failed",
+			"Tive um erro ao processar sua nota fiscal. Tente novamente em alguns minutos.",
+			title=job.title,
+		)
+	except Exception as e:
+		logger.exception(f"Erro ao notificar falha do job {job.id}: {e}")
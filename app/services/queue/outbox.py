@@ -0,0 +1,327 @@
+"""
+Fila de respostas ao usuário, por conversa.
+
+Jobs e webhook não chamam mais a Evolution diretamente: registram a resposta
+com `reply_outbox.add`, numa lista por conversa (instância + número) no Redis.
+A conversa é agendada para `OUTBOX_COALESCE_WINDOW_SECONDS` depois da última
+resposta recebida (no máximo `OUTBOX_MAX_WAIT_SECONDS` depois da primeira), e
+tudo o que se acumulou até lá vira uma única mensagem de resumo. Quem encaminha
+30 PDFs de uma vez recebe "28 notas registradas, 2 com erro: ..." em vez de 30
+mensagens.
+
+Os envios são feitos pelo loop `run`, que roda nos workers: no máximo
+`OUTBOX_SEND_CONCURRENCY` envios simultâneos por processo e um por conversa de
+cada vez, com intervalo mínimo de `OUTBOX_CHAT_INTERVAL_SECONDS` entre
+mensagens para o mesmo número. A ordem das respostas de uma conversa é
+preservada, inclusive quando um envio falha e é reagendado. As respostas em
+envio ficam no Redis até a Evolution confirmar; se o worker morrer no meio,
+voltam para a agenda quando a trava da conversa expira (entrega ao menos uma vez).
+"""
+import asyncio
+import time
+from typing import List, Literal, Set
+
+import httpx
+from loguru import logger
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.metrics import REPLIES, REPLY_BATCH_SIZE
+from app.core.redis import get_redis_client
+from app.services.evolution.circuit_breaker import CircuitOpenError
+from app.services.evolution.evolution_integration import evolution_clients
+
+ReplyKind = Literal["created", "duplicate", "failed", "notice"]
+
+# KEYS: lista da conversa, zset de conversas pendentes, hash com o início da rajada
+# ARGV: resposta (json), conversa, agora (ms), janela (ms), espera máxima (ms), "front" para voltar ao início
+_ADD_SCRIPT = """
+if ARGV[6] == 'front' then
+	redis.call('LPUSH', KEYS[1], ARGV[1])
+else
+	redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+local first = tonumber(redis.call('HGET', KEYS[3], ARGV[2]))
+if not first then
+	first = tonumber(ARGV[3])
+	redis.call('HSET', KEYS[3], ARGV[2], first)
+end
+local due = math.min(tonumber(ARGV[3]) + tonumber(ARGV[4]), first + tonumber(ARGV[5]))
+redis.call('ZADD', KEYS[2], due, ARGV[2])
+return due
+"""
+
+# KEYS: zset de conversas pendentes, hash com o início da rajada, zset de envios em andamento (expiração da trava)
+# ARGV: agora (ms), limite, prefixo, duração da trava de envio (ms)
+# Retorno: {{conversa, {respostas...}}, ...} das conversas vencidas e livres.
+# As respostas reivindicadas passam para `inflight:<conversa>` e só saem de lá
+# depois do envio; se a trava expirar antes (worker morto), a conversa volta
+# para a agenda e o próximo claim reenvia o que ficou em andamento.
+# Conversas com envio em andamento (ou dentro do intervalo mínimo) são
+# reagendadas para quando a trava expirar.
+_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+for _, chat in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+	redis.call('ZREM', KEYS[3], chat)
+	if redis.call('EXISTS', ARGV[3] .. 'inflight:' .. chat) == 1 then
+		redis.call('ZADD', KEYS[1], now, chat)
+	end
+end
+
+local claimed = {}
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[2]))
+for _, chat in ipairs(due) do
+	local lock = ARGV[3] .. 'lock:' .. chat
+	if redis.call('SET', lock, '1', 'NX', 'PX', ARGV[4]) then
+		local list = ARGV[3] .. 'chat:' .. chat
+		local inflight = ARGV[3] .. 'inflight:' .. chat
+		if redis.call('EXISTS', inflight) == 0 then
+			if redis.call('EXISTS', list) == 1 then
+				redis.call('RENAME', list, inflight)
+			end
+		else
+			-- Sobra de um envio interrompido: vai antes das respostas novas.
+			for _, reply in ipairs(redis.call('LRANGE', list, 0, -1)) do
+				redis.call('RPUSH', inflight, reply)
+			end
+			redis.call('DEL', list)
+		end
+		redis.call('ZREM', KEYS[1], chat)
+		redis.call('HDEL', KEYS[2], chat)
+		local replies = redis.call('LRANGE', inflight, 0, -1)
+		if #replies > 0 then
+			redis.call('ZADD', KEYS[3], now + tonumber(ARGV[4]), chat)
+			table.insert(claimed, {chat, replies})
+		else
+			redis.call('DEL', lock)
+		end
+	else
+		redis.call('ZADD', KEYS[1], now + math.max(redis.call('PTTL', lock), 1), chat)
+	end
+end
+return claimed
+"""
+
+# Envio preso (worker morto no meio) libera a conversa depois disso, e as
+# respostas em andamento voltam para a agenda.
+_SEND_LOCK_MS = 120_000
+_MAX_LISTED_FAILURES = 5
+
+
+class OutboundReply(BaseModel):
+	kind: ReplyKind
+	text: str
+	title: str = ""
+	attempts: int = 0
+
+
+def _plural(count: int, singular: str, plural: str) -> str:
+	return f"{count} {singular if count == 1 else plural}"
+
+
+def summarize_replies(replies: List[OutboundReply]) -> str:
+	"""Junta as respostas acumuladas de uma conversa numa mensagem só."""
+	if len(replies) == 1:
+		return replies[0].text
+
+	created = sum(1 for reply in replies if reply.kind == "created")
+	duplicate = sum(1 for reply in replies if reply.kind == "duplicate")
+	failed = [reply.title or "sem nome" for reply in replies if reply.kind == "failed"]
+
+	lines = []
+	parts = []
+	if created:
+		parts.append(_plural(created, "nota registrada", "notas registradas"))
+	if duplicate:
+		parts.append(_plural(duplicate, "já estava registrada", "já estavam registradas"))
+	if failed:
+		listed = ", ".join(f"'{title}'" for title in failed[:_MAX_LISTED_FAILURES])
+		if len(failed) > _MAX_LISTED_FAILURES:
+			listed += f" e mais {len(failed) - _MAX_LISTED_FAILURES}"
+		parts.append(f"{len(failed)} com erro: {listed}")
+	if parts:
+		lines.append(", ".join(parts) + ".")
+	if failed:
+		lines.append("Reenvie as notas com erro em alguns minutos.")
+
+	# Avisos (limite de envio, arquivo inválido...) entram uma vez cada, na ordem.
+	for text in dict.fromkeys(reply.text for reply in replies if reply.kind == "notice"):
+		lines.append(text)
+	return "\n".join(lines)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+	if isinstance(exc, httpx.HTTPStatusError):
+		return exc.response.status_code >= 500 or exc.response.status_code == 429
+	return isinstance(exc, (httpx.RequestError, CircuitOpenError, RedisError))
+
+
+class ReplyOutbox:
+	def __init__(self, prefix: str = settings.outbox_prefix) -> None:
+		self.prefix = prefix
+
+	def _pending_key(self, instance: str) -> str:
+		return f"{self.prefix}pending:{instance}"
+
+	def _first_seen_key(self, instance: str) -> str:
+		return f"{self.prefix}first_seen:{instance}"
+
+	def _sending_key(self, instance: str) -> str:
+		return f"{self.prefix}sending:{instance}"
+
+	async def add(
+			self,
+			instance: str | None,
+			phone_number: str,
+			kind: ReplyKind,
+			text: str,
+			title: str = "",
+	) -> None:
+		"""Agenda uma resposta para a conversa; o envio sai agrupado com as vizinhas."""
+		await self._push(instance or evolution_clients.default_instance, phone_number, [
+			OutboundReply(kind=kind, text=text, title=title),
+		])
+
+	async def _push(
+			self,
+			instance: str,
+			phone_number: str,
+			replies: List[OutboundReply],
+			delay_ms: int = 0,
+			front: bool = False,
+	) -> None:
+		chat = f"{instance}|{phone_number}"
+		redis = await get_redis_client()
+		# Na frente da lista, empilha de trás para frente para manter a ordem original.
+		for reply in reversed(replies) if front else replies:
+			await redis.eval(
+				_ADD_SCRIPT,
+				3,
+				f"{self.prefix}chat:{chat}",
+				self._pending_key(instance),
+				self._first_seen_key(instance),
+				reply.model_dump_json(),
+				chat,
+				int(time.time() * 1000) + delay_ms,
+				int(settings.outbox_coalesce_window_seconds * 1000),
+				int(settings.outbox_max_wait_seconds * 1000),
+				"front" if front else "back",
+			)
+
+	async def run(self, instances: List[str], stopping: asyncio.Event) -> None:
+		"""Envia as conversas vencidas das `instances` até `stopping`; aguarda os envios em andamento."""
+		in_flight: Set[asyncio.Task] = set()
+		while not stopping.is_set():
+			try:
+				for instance in instances:
+					free = settings.outbox_send_concurrency - len(in_flight)
+					if free <= 0:
+						break
+					for chat, replies in await self._claim(instance, free):
+						task = asyncio.create_task(self._deliver(instance, chat, replies))
+						in_flight.add(task)
+						task.add_done_callback(in_flight.discard)
+			except Exception as e:
+				logger.exception(f"Erro ao ler a fila de respostas: {e}")
+			try:
+				await asyncio.wait_for(stopping.wait(), timeout=settings.outbox_poll_interval_seconds)
+			except asyncio.TimeoutError:
+				pass
+		if in_flight:
+			await asyncio.gather(*in_flight, return_exceptions=True)
+
+	async def _claim(self, instance: str, limit: int) -> List[tuple[str, List[OutboundReply]]]:
+		redis = await get_redis_client()
+		claimed = await redis.eval(
+			_CLAIM_SCRIPT,
+			3,
+			self._pending_key(instance),
+			self._first_seen_key(instance),
+			self._sending_key(instance),
+			int(time.time() * 1000),
+			limit,
+			self.prefix,
+			_SEND_LOCK_MS,
+		)
+		result = []
+		for chat, raw_replies in claimed:
+			replies = []
+			for raw in raw_replies:
+				try:
+					replies.append(OutboundReply.model_validate_json(raw))
+				except ValueError:
+					logger.error(f"Resposta inválida descartada da fila de {chat}")
+			result.append((chat, replies))
+		return result
+
+	async def _deliver(self, instance: str, chat: str, replies: List[OutboundReply]) -> None:
+		phone_number = chat.split("|", 1)[1]
+		REPLY_BATCH_SIZE.observe(len(replies))
+		try:
+			if replies:
+				await evolution_clients.get(instance).send_text_message(phone_number, summarize_replies(replies))
+			REPLIES.labels(outcome="sent").inc(len(replies))
+		except Exception as e:
+			if not await self._handle_failure(instance, phone_number, replies, e):
+				# Sem reagendar, as respostas ficam em andamento e voltam quando a trava expirar.
+				return
+		await self._release(instance, chat)
+
+	async def _handle_failure(
+			self,
+			instance: str,
+			phone_number: str,
+			replies: List[OutboundReply],
+			error: BaseException,
+	) -> bool:
+		"""Reagenda o que ainda pode ser tentado; False se não foi possível falar com o Redis."""
+		retry = [
+			reply.model_copy(update={"attempts": reply.attempts + 1})
+			for reply in replies
+			if reply.attempts + 1 < settings.outbox_max_attempts
+		]
+		dropped = len(replies) - len(retry)
+		if not _is_retryable(error):
+			retry, dropped = [], len(replies)
+		if dropped:
+			REPLIES.labels(outcome="dropped").inc(dropped)
+			logger.error(f"{dropped} resposta(s) para {phone_number} descartada(s) ({instance}): {error!r}")
+		if retry:
+			REPLIES.labels(outcome="retry").inc(len(retry))
+			logger.warning(f"Falha ao responder {phone_number} ({instance}), nova tentativa em breve: {error!r}")
+			try:
+				# Voltam para o início da lista, antes das respostas que chegaram durante o envio.
+				await self._push(
+					instance,
+					phone_number,
+					retry,
+					delay_ms=int(settings.outbox_retry_delay_seconds * 1000),
+					front=True,
+				)
+			except RedisError as e:
+				logger.error(f"Não foi possível reagendar respostas para {phone_number}: {e}")
+				return False
+		return True
+
+	async def _release(self, instance: str, chat: str) -> None:
+		"""
+		Encerra o envio: descarta as respostas em andamento e mantém a conversa
+		travada pelo intervalo mínimo entre mensagens para o mesmo número.
+		"""
+		try:
+			redis = await get_redis_client()
+			interval_ms = int(settings.outbox_chat_interval_seconds * 1000)
+			async with redis.pipeline(transaction=True) as pipe:
+				pipe.delete(f"{self.prefix}inflight:{chat}")
+				pipe.zrem(self._sending_key(instance), chat)
+				if interval_ms > 0:
+					pipe.set(f"{self.prefix}lock:{chat}", 1, px=interval_ms, xx=True)
+				else:
+					pipe.delete(f"{self.prefix}lock:{chat}")
+				await pipe.execute()
+		except RedisError as e:
+			logger.warning(f"Falha ao liberar a conversa {chat}: {e}")
+
+
+reply_outbox: ReplyOutbox = ReplyOutbox()
@@ -0,0 +1,165 @@
+"""
+Limites de envio por remetente e global, em janela deslizante no Redis.
+
+Cada documento aceito é registrado em três sorted sets (o do remetente, o da
+instância da Evolution que o recebeu e o global), com o horário como score; a
+contagem da janela é o número de membros com score dentro dela. Verificação e
+registro acontecem num único script Lua, então réplicas da API concorrendo pelo
+mesmo remetente não ultrapassam a cota. A cota por instância impede que um
+número muito movimentado esgote sozinho a cota global.
+
+Documentos adiados por cota da instância ou global não são contados na hora:
+a cota é cobrada quando o job sai da fila de atrasados (`Worker._admit`), e o
+job é adiado de novo se ela ainda estiver esgotada. Os atrasos são espaçados
+pela posição na fila (`deferral_delay`), no ritmo em que a janela libera cota,
+para que os adiados não voltem todos no mesmo instante.
+
+A cota do remetente depende do tier dele, lido do hash `RATE_LIMIT_TIERS_KEY`
+(`HSET nf_bot_zap:rate_limit:tiers 5511999999999 trusted`); quem não está no
+hash usa o tier `default`. Um tier com cota 0 bloqueia o remetente.
+"""
+import random
+import time
+from dataclasses import dataclass
+from typing import Literal, Optional
+
+from loguru import logger
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.redis import get_redis_client
+
+# KEYS: zset do remetente, zset global, hash de tiers, zset da instância
+# ARGV: agora (ms), janela (ms), cota global, id do envio, cota padrão, remetente,
+#       cota da instância, pares tier/cota...
+# Retorno: {1} se aceito; {0, escopo, ms até liberar, cota do escopo} se recusado.
+_SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local global_limit = tonumber(ARGV[3])
+local member = ARGV[4]
+local limit = tonumber(ARGV[5])
+local instance_limit = tonumber(ARGV[7])
+
+local tier = redis.call('HGET', KEYS[3], ARGV[6])
+if tier then
+	for i = 8, #ARGV, 2 do
+		if ARGV[i] == tier then
+			limit = tonumber(ARGV[i + 1])
+		end
+	end
+end
+
+local function retry_after(key)
+	local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+	if oldest[2] then
+		return math.max(0, tonumber(oldest[2]) + window - now)
+	end
+	return window
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+	return {0, 'sender', retry_after(KEYS[1]), limit}
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', now - window)
+if redis.call('ZCARD', KEYS[4]) >= instance_limit then
+	return {0, 'instance', retry_after(KEYS[4]), instance_limit}
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - window)
+if redis.call('ZCARD', KEYS[2]) >= global_limit then
+	return {0, 'global', retry_after(KEYS[2]), global_limit}
+end
+
+for _, key in ipairs({KEYS[1], KEYS[2], KEYS[4]}) do
+	redis.call('ZADD', key, now, member)
+	redis.call('PEXPIRE', key, window)
+end
+return {1}
+"""
+
+
+@dataclass
+class RateLimitDecision:
+	allowed: bool
+	scope: Optional[Literal["sender", "instance", "global"]] = None
+	retry_after_seconds: float = 0.0
+	limit: int = 0
+
+
+class SenderRateLimiter:
+	def __init__(
+			self,
+			prefix: str = settings.rate_limit_prefix,
+			tiers_key: str = settings.rate_limit_tiers_key,
+	) -> None:
+		self.prefix = prefix
+		self.tiers_key = tiers_key
+
+	async def hit(self, sender: str, message_id: str, instance: str) -> RateLimitDecision:
+		"""Registra um documento do remetente, se ainda houver cota para ele, para a instância e para o bot."""
+		if not settings.rate_limit_enabled:
+			return RateLimitDecision(allowed=True)
+
+		tiers = settings.rate_limit_tiers
+		tier_args = [value for name, limit in tiers.items() for value in (name, limit)]
+		try:
+			redis = await get_redis_client()
+			result = await redis.eval(
+				_SLIDING_WINDOW_SCRIPT,
+				4,
+				f"{self.prefix}sender:{sender}",
+				f"{self.prefix}global",
+				self.tiers_key,
+				f"{self.prefix}instance:{instance}",
+				int(time.time() * 1000),
+				settings.rate_limit_window_seconds * 1000,
+				settings.rate_limit_global_limit,
+				message_id,
+				tiers.get("default", 0),
+				sender,
+				settings.rate_limit_instance_limits.get(instance, settings.rate_limit_instance_limit),
+				*tier_args,
+			)
+		except RedisError as e:
+			# Sem Redis o enfileiramento também falha; não bloqueia o remetente por isso.
+			logger.warning(f"Rate limit indisponível, documento aceito sem verificação: {e}")
+			return RateLimitDecision(allowed=True)
+
+		if int(result[0]) == 1:
+			return RateLimitDecision(allowed=True)
+		return RateLimitDecision(
+			allowed=False,
+			scope=result[1],
+			retry_after_seconds=int(result[2]) / 1000,
+			limit=int(result[3]),
+		)
+
+	async def should_notify(self, sender: str, kind: str) -> bool:
+		"""No máximo um aviso de cada tipo por remetente a cada `RATE_LIMIT_NOTICE_COOLDOWN_SECONDS`."""
+		try:
+			redis = await get_redis_client()
+			return bool(await redis.set(
+				f"{self.prefix}notice:{kind}:{sender}",
+				1,
+				nx=True,
+				ex=settings.rate_limit_notice_cooldown_seconds,
+			))
+		except RedisError as e:
+			logger.warning(f"Falha ao registrar aviso de rate limit: {e}")
+			return False
+
+
+def deferral_delay(decision: RateLimitDecision, position: int) -> float:
+	"""
+	Atraso de um documento recusado por cota: até a janela liberar, mais um
+	intervalo por documento já adiado à frente dele.
+	"""
+	# A janela libera em média uma vaga a cada `janela / cota` segundos.
+	spacing = settings.rate_limit_window_seconds / max(decision.limit, 1)
+	return decision.retry_after_seconds + position * spacing + random.uniform(0, spacing)
+
+
+sender_rate_limiter: SenderRateLimiter = SenderRateLimiter()
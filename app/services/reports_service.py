@@ -0,0 +1,276 @@
+"""
+Relatórios fiscais pré-agregados.
+
+`report_issuer_monthly` e `report_item_monthly` guardam totais por emitente e mês
+(e por NCM/CFOP, com ICMS/IPI, no caso dos itens). São mantidas de forma
+incremental:
+
+- `apply_note` soma a nota recém-inserida aos seus buckets, na mesma transação
+  de `upsert_note` (`INSERT ... ON CONFLICT DO UPDATE SET x = x + excluded.x`);
+- `refresh_buckets` recalcula só os buckets (emitente, mês) afetados por edições
+  e exclusões feitas no painel.
+
+As consultas de relatório leem apenas essas tabelas, cujo tamanho cresce com o
+número de emitentes × meses × NCM/CFOP, não com o volume de notas.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Date, and_, cast, delete, func, literal, literal_column, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.notes import ItemNote, Note
+from app.models.reports import IssuerMonthlyReport, ItemMonthlyReport
+from app.schemas.notes import NoteCreate
+
+# (issuer_cnpj ou "", primeiro dia do mês)
+ReportBucket = Tuple[str, datetime.date]
+
+_ITEM_SUMS = ("items_count", "quantity", "gross_value", "discount_value", "icms_value", "ipi_value")
+
+
+def month_of(day: datetime.date) -> datetime.date:
+	return day.replace(day=1)
+
+
+def next_month(month: datetime.date) -> datetime.date:
+	return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def bucket_of(issuer_cnpj: Optional[str], date_of_issue: datetime.date) -> ReportBucket:
+	return issuer_cnpj or "", month_of(date_of_issue)
+
+
+async def apply_note(db: AsyncSession, note_in: NoteCreate) -> None:
+	"""Soma a nota (e seus itens) aos totais. Deve rodar na transação que insere a nota."""
+	issuer_cnpj, month = bucket_of(note_in.issuer_cnpj, note_in.date_of_issue)
+
+	issuer_stmt = insert(IssuerMonthlyReport).values(
+		issuer_cnpj=issuer_cnpj,
+		month=month,
+		provider=note_in.provider,
+		notes_count=1,
+		total_value=note_in.total_value,
+	)
+	await db.execute(issuer_stmt.on_conflict_do_update(
+		index_elements=[IssuerMonthlyReport.issuer_cnpj, IssuerMonthlyReport.month],
+		set_={
+			"provider": issuer_stmt.excluded.provider,
+			"notes_count": IssuerMonthlyReport.notes_count + issuer_stmt.excluded.notes_count,
+			"total_value": IssuerMonthlyReport.total_value + issuer_stmt.excluded.total_value,
+			"updated_at": func.now(),
+		},
+	))
+
+	if not note_in.items:
+		return
+
+	sums: Dict[Tuple[str, str], Dict[str, Any]] = defaultdict(lambda: dict.fromkeys(_ITEM_SUMS, Decimal(0)))
+	for item in note_in.items:
+		bucket = sums[(item.ncm or "", item.cfop or "")]
+		bucket["items_count"] += 1
+		bucket["quantity"] += Decimal(str(item.quantity or 0))
+		bucket["gross_value"] += Decimal(str(item.quantity or 0)) * Decimal(str(item.unit_value or 0))
+		bucket["discount_value"] += Decimal(str(item.discount_value or 0))
+		bucket["icms_value"] += Decimal(str(item.icms_value or 0))
+		bucket["ipi_value"] += Decimal(str(item.ipi_value or 0))
+
+	item_stmt = insert(ItemMonthlyReport).values([
+		{"issuer_cnpj": issuer_cnpj, "month": month, "ncm": ncm, "cfop": cfop, **values}
+		for (ncm, cfop), values in sums.items()
+	])
+	await db.execute(item_stmt.on_conflict_do_update(
+		index_elements=[
+			ItemMonthlyReport.issuer_cnpj,
+			ItemMonthlyReport.month,
+			ItemMonthlyReport.ncm,
+			ItemMonthlyReport.cfop,
+		],
+		set_={
+			**{name: getattr(ItemMonthlyReport, name) + getattr(item_stmt.excluded, name) for name in _ITEM_SUMS},
+			"updated_at": func.now(),
+		},
+	))
+
+
+def _notes_in_bucket(issuer_cnpj: str, month: datetime.date):
+	issuer_filter = Note.issuer_cnpj == issuer_cnpj if issuer_cnpj else Note.issuer_cnpj.is_(None)
+	return and_(issuer_filter, Note.date_of_issue >= month, Note.date_of_issue < next_month(month))
+
+
+async def refresh_buckets(db: AsyncSession, buckets: Iterable[ReportBucket]) -> None:
+	"""
+	Recalcula os buckets a partir de `notes`/`note_items` (após edição/exclusão no painel).
+	Os totais são sobrescritos via upsert, para que incrementos concorrentes de
+	notas novas continuem sendo somados por cima. O chamador faz o commit.
+	"""
+	for issuer_cnpj, month in set(buckets):
+		issuer_key = and_(IssuerMonthlyReport.issuer_cnpj == issuer_cnpj, IssuerMonthlyReport.month == month)
+		item_key = and_(ItemMonthlyReport.issuer_cnpj == issuer_cnpj, ItemMonthlyReport.month == month)
+		in_bucket = _notes_in_bucket(issuer_cnpj, month)
+
+		await db.execute(update(IssuerMonthlyReport).where(issuer_key).values(notes_count=0, total_value=0))
+		await db.execute(update(ItemMonthlyReport).where(item_key).values(dict.fromkeys(_ITEM_SUMS, 0)))
+
+		issuer_stmt = insert(IssuerMonthlyReport).from_select(
+			["issuer_cnpj", "month", "provider", "notes_count", "total_value"],
+			select(
+				literal(issuer_cnpj),
+				cast(literal(month), Date),
+				func.max(Note.provider),
+				func.count(),
+				func.sum(Note.total_value),
+			).where(in_bucket).having(func.count() > 0),
+		)
+		await db.execute(issuer_stmt.on_conflict_do_update(
+			index_elements=[IssuerMonthlyReport.issuer_cnpj, IssuerMonthlyReport.month],
+			set_={
+				"provider": issuer_stmt.excluded.provider,
+				"notes_count": issuer_stmt.excluded.notes_count,
+				"total_value": issuer_stmt.excluded.total_value,
+				"updated_at": func.now(),
+			},
+		))
+
+		ncm = func.coalesce(ItemNote.ncm, literal_column("''"))
+		cfop = func.coalesce(ItemNote.cfop, literal_column("''"))
+		item_stmt = insert(ItemMonthlyReport).from_select(
+			["issuer_cnpj", "month", "ncm", "cfop", *_ITEM_SUMS],
+			select(
+				literal(issuer_cnpj),
+				cast(literal(month), Date),
+				ncm,
+				cfop,
+				func.count(),
+				func.coalesce(func.sum(ItemNote.quantity), 0),
+				func.coalesce(func.sum(ItemNote.quantity * ItemNote.unit_value), 0),
+				func.coalesce(func.sum(ItemNote.discount_value), 0),
+				func.coalesce(func.sum(ItemNote.icms_value), 0),
+				func.coalesce(func.sum(ItemNote.ipi_value), 0),
+			)
+			.join(Note, Note.id == ItemNote.note_id)
+			.where(in_bucket)
+			.group_by(ncm, cfop),
+		)
+		await db.execute(item_stmt.on_conflict_do_update(
+			index_elements=[
+				ItemMonthlyReport.issuer_cnpj,
+				ItemMonthlyReport.month,
+				ItemMonthlyReport.ncm,
+				ItemMonthlyReport.cfop,
+			],
+			set_={
+				**{name: getattr(item_stmt.excluded, name) for name in _ITEM_SUMS},
+				"updated_at": func.now(),
+			},
+		))
+
+		await db.execute(delete(IssuerMonthlyReport).where(issuer_key, IssuerMonthlyReport.notes_count == 0))
+		await db.execute(delete(ItemMonthlyReport).where(item_key, ItemMonthlyReport.items_count == 0))
+
+
+async def buckets_of_notes(db: AsyncSession, note_ids: Iterable[int]) -> Set[ReportBucket]:
+	rows = await db.execute(select(Note.issuer_cnpj, Note.date_of_issue).where(Note.id.in_(set(note_ids))))
+	return {bucket_of(issuer_cnpj, date_of_issue) for issuer_cnpj, date_of_issue in rows}
+
+
+def _month_range(stmt, column, month_from: Optional[datetime.date], month_to: Optional[datetime.date]):
+	if month_from:
+		stmt = stmt.where(column >= month_of(month_from))
+	if month_to:
+		stmt = stmt.where(column <= month_of(month_to))
+	return stmt
+
+
+async def issuer_totals(
+		db: AsyncSession,
+		month_from: Optional[datetime.date] = None,
+		month_to: Optional[datetime.date] = None,
+		issuer_cnpj: Optional[str] = None,
+		limit: int = 100,
+) -> List[Dict[str, Any]]:
+	"""Totais por emitente no período, do maior para o menor valor."""
+	stmt = select(
+		IssuerMonthlyReport.issuer_cnpj,
+		func.max(IssuerMonthlyReport.provider).label("provider"),
+		func.sum(IssuerMonthlyReport.notes_count).label("notes_count"),
+		func.sum(IssuerMonthlyReport.total_value).label("total_value"),
+	).group_by(IssuerMonthlyReport.issuer_cnpj)
+	stmt = _month_range(stmt, IssuerMonthlyReport.month, month_from, month_to)
+	if issuer_cnpj:
+		stmt = stmt.where(IssuerMonthlyReport.issuer_cnpj == issuer_cnpj)
+	stmt = stmt.order_by(func.sum(IssuerMonthlyReport.total_value).desc()).limit(limit)
+	return [dict(row._mapping) for row in await db.execute(stmt)]
+
+
+async def monthly_totals(
+		db: AsyncSession,
+		month_from: Optional[datetime.date] = None,
+		month_to: Optional[datetime.date] = None,
+		issuer_cnpj: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+	"""Notas, valor total e impostos por mês."""
+	notes = select(
+		IssuerMonthlyReport.month,
+		func.sum(IssuerMonthlyReport.notes_count).label("notes_count"),
+		func.sum(IssuerMonthlyReport.total_value).label("total_value"),
+	).group_by(IssuerMonthlyReport.month)
+	notes = _month_range(notes, IssuerMonthlyReport.month, month_from, month_to)
+
+	taxes = select(
+		ItemMonthlyReport.month,
+		func.sum(ItemMonthlyReport.icms_value).label("icms_value"),
+		func.sum(ItemMonthlyReport.ipi_value).label("ipi_value"),
+	).group_by(ItemMonthlyReport.month)
+	taxes = _month_range(taxes, ItemMonthlyReport.month, month_from, month_to)
+
+	if issuer_cnpj:
+		notes = notes.where(IssuerMonthlyReport.issuer_cnpj == issuer_cnpj)
+		taxes = taxes.where(ItemMonthlyReport.issuer_cnpj == issuer_cnpj)
+
+	notes, taxes = notes.subquery(), taxes.subquery()
+	stmt = (
+		select(
+			notes.c.month,
+			notes.c.notes_count,
+			notes.c.total_value,
+			func.coalesce(taxes.c.icms_value, 0).label("icms_value"),
+			func.coalesce(taxes.c.ipi_value, 0).label("ipi_value"),
+		)
+		.outerjoin(taxes, taxes.c.month == notes.c.month)
+		.order_by(notes.c.month)
+	)
+	return [dict(row._mapping) for row in await db.execute(stmt)]
+
+
+async def item_totals(
+		db: AsyncSession,
+		group_by: str = "ncm",
+		month_from: Optional[datetime.date] = None,
+		month_to: Optional[datetime.date] = None,
+		issuer_cnpj: Optional[str] = None,
+		ncm: Optional[str] = None,
+		cfop: Optional[str] = None,
+		limit: int = 100,
+) -> List[Dict[str, Any]]:
+	"""Totais de itens agrupados por `ncm` ou `cfop`, do maior para o menor valor bruto."""
+	if group_by not in ("ncm", "cfop"):
+		raise ValueError("group_by deve ser 'ncm' ou 'cfop'")
+
+	key = getattr(ItemMonthlyReport, group_by)
+	stmt = select(
+		key.label(group_by),
+		*(func.sum(getattr(ItemMonthlyReport, name)).label(name) for name in _ITEM_SUMS),
+	).group_by(key)
+	stmt = _month_range(stmt, ItemMonthlyReport.month, month_from, month_to)
+	if issuer_cnpj:
+		stmt = stmt.where(ItemMonthlyReport.issuer_cnpj == issuer_cnpj)
+	if ncm:
+		stmt = stmt.where(ItemMonthlyReport.ncm == ncm)
+	if cfop:
+		stmt = stmt.where(ItemMonthlyReport.cfop == cfop)
+	stmt = stmt.order_by(func.sum(ItemMonthlyReport.gross_value).desc()).limit(limit)
+	return [dict(row._mapping) for row in await db.execute(stmt)]
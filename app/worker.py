@@ -0,0 +1,239 @@
+"""
+Worker de processamento de notas fiscais.
+
+Uso: python -m app.worker [--concurrency N] [--name NOME] [--instances loja1,loja2]
+
+Cada processo executa N consumidores concorrentes por instância da Evolution,
+no consumer group do stream daquela instância, de modo que a vazão de ingestão
+escala com o número de workers e não com o número de réplicas da API. Com
+`--instances` (ou `WORKER_INSTANCES`) o processo atende só as instâncias
+indicadas: números com muito volume podem ganhar workers dedicados sem atrasar
+os demais. Todo worker também consome o stream da ingestão em lote com
+`INGEST_CONCURRENCY` consumidores, separados dos que atendem o WhatsApp.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+from typing import Dict, List
+
+from loguru import logger
+from opentelemetry.trace import SpanKind
+from prometheus_client import start_http_server
+
+from app.core.config import settings
+from app.core.logging import setup_logging
+from app.core.metrics import JOB_DURATION, JOBS_IN_FLIGHT, RATE_LIMIT_DEFERRED, observe, register_pool_collector
+from app.core.tracing import extract_context, setup_tracing, shutdown_tracing, tracer
+from app.db.session import async_engine, job_session
+from app.schemas.jobs import DocumentJob
+from app.services.access_key import known_access_keys
+from app.services.evolution.evolution_integration import evolution_clients
+from app.services.queue.broker import JobQueue, batch_queue, queue_for
+from app.services.queue.handlers import handle_document_job, handle_document_job_failure
+from app.services.queue.outbox import reply_outbox
+from app.services.rate_limit import deferral_delay, sender_rate_limiter
+
+setup_logging()
+
+
+class Worker:
+	def __init__(
+			self,
+			queues: Dict[str, JobQueue],
+			concurrency: int,
+			name: str,
+			batch_concurrency: int = settings.ingest_concurrency,
+	) -> None:
+		self.queues = queues
+		self.concurrency = concurrency
+		self.name = name
+		self.batch_concurrency = batch_concurrency
+		self._stopping = asyncio.Event()
+
+	def stop(self) -> None:
+		logger.info("🛑 Encerrando worker após os jobs em andamento...")
+		self._stopping.set()
+
+	async def run(self) -> None:
+		for queue in self.queues.values():
+			await queue.ensure_group()
+		await batch_queue.ensure_group()
+		logger.info(
+			f"🚀 Worker {self.name} iniciado com {self.concurrency} consumidores "
+			f"por instância ({', '.join(self.queues)})"
+		)
+
+		# Consumidores separados por instância: um stream cheio não ocupa os consumidores dos outros.
+		tasks = [
+			asyncio.create_task(self._consume(queue, f"{self.name}-{instance}-{i}"))
+			for instance, queue in self.queues.items()
+			for i in range(self.concurrency)
+		]
+		tasks.extend(
+			asyncio.create_task(self._consume(batch_queue, f"{self.name}-batch-{i}"))
+			for i in range(self.batch_concurrency)
+		)
+		tasks.append(asyncio.create_task(self._promote_delayed()))
+		tasks.append(asyncio.create_task(reply_outbox.run(list(self.queues), self._stopping)))
+		await asyncio.gather(*tasks)
+
+	async def _consume(self, queue: JobQueue, consumer: str) -> None:
+		while not self._stopping.is_set():
+			try:
+				entries = await queue.claim_stale(consumer, count=1, on_dead_letter=self._notify_failure)
+				if not entries:
+					entries = await queue.read(consumer, count=1, block_ms=2000)
+			except Exception as e:
+				logger.exception(f"Erro ao ler da fila: {e}")
+				await asyncio.sleep(1)
+				continue
+
+			for entry_id, job in entries:
+				if job.quota_pending:
+					job = await self._admit(queue, entry_id, job)
+					if job is None:
+						continue
+				await self._handle(queue, consumer, entry_id, job)
+
+	@staticmethod
+	async def _admit(queue: JobQueue, entry_id: str, job: DocumentJob) -> DocumentJob | None:
+		"""Cobra a cota de um job adiado pelo rate limit; se ainda não houver, adia de novo."""
+		try:
+			decision = await sender_rate_limiter.hit(
+				job.phone_number,
+				job.message_id,
+				job.instance or evolution_clients.default_instance,
+			)
+			if decision.allowed:
+				return job.model_copy(update={"quota_pending": False})
+			delay = deferral_delay(decision, await queue.delayed_count())
+			await queue.defer(entry_id, job, delay)
+			RATE_LIMIT_DEFERRED.inc()
+			logger.info(f"⏳ Job {job.id} adiado de novo por {delay:.0f}s (cota {decision.scope})")
+		except Exception as e:
+			# O job continua pendente no stream e volta por `claim_stale`.
+			logger.exception(f"Erro ao verificar a cota do job {job.id}: {e}")
+		return None
+
+	async def _handle(self, queue: JobQueue, consumer: str, entry_id: str, job: DocumentJob) -> None:
+		heartbeat = asyncio.create_task(self._heartbeat(queue, consumer, entry_id))
+		JOBS_IN_FLIGHT.inc()
+		try:
+			span_attributes = {
+				"nfbot.job_id": job.id,
+				"nfbot.document_type": job.document_type,
+				"nfbot.attempt": job.attempts,
+				"nfbot.instance": job.instance or evolution_clients.default_instance,
+			}
+			with tracer.start_as_current_span(
+					"document_job",
+					context=extract_context(job.trace_context),
+					kind=SpanKind.CONSUMER,
+					attributes=span_attributes,
+			):
+				with observe(JOB_DURATION, document_type=job.document_type, outcome="error") as labels:
+					await handle_document_job(job)
+					labels["outcome"] = "ok"
+		except Exception as e:
+			logger.exception(f"Erro ao processar job {job.id}: {e}")
+			await self._retry_or_fail(queue, entry_id, job, repr(e))
+		else:
+			try:
+				await queue.ack(entry_id)
+			except Exception as e:
+				# Sem o ack o job volta por `claim_stale`; o reprocessamento é idempotente (hash do conteúdo).
+				logger.exception(f"Falha ao confirmar job {job.id}: {e}")
+		finally:
+			JOBS_IN_FLIGHT.dec()
+			heartbeat.cancel()
+
+	async def _retry_or_fail(self, queue: JobQueue, entry_id: str, job: DocumentJob, error: str) -> None:
+		"""Falhas do Redis aqui não derrubam o consumidor: o job fica pendente e volta por `claim_stale`."""
+		try:
+			retried = await queue.retry_later(entry_id, job, error)
+		except Exception as e:
+			logger.exception(f"Falha ao reagendar job {job.id}: {e}")
+			return
+		if not retried:
+			await self._notify_failure(job.model_copy(update={"attempts": job.attempts + 1, "last_error": error}))
+
+	@staticmethod
+	async def _notify_failure(job: DocumentJob) -> None:
+		try:
+			await handle_document_job_failure(job)
+		except Exception as e:
+			logger.exception(f"Erro ao tratar job {job.id} enviado para dead-letter: {e}")
+
+	@staticmethod
+	async def _heartbeat(queue: JobQueue, consumer: str, entry_id: str) -> None:
+		"""Renova a visibilidade do job para que outro consumidor não o assuma."""
+		interval = max(1, queue.visibility_timeout // 3)
+		while True:
+			await asyncio.sleep(interval)
+			try:
+				await queue.touch(entry_id, consumer)
+			except Exception as e:
+				logger.warning(f"Falha ao renovar visibilidade do job {entry_id}: {e}")
+
+	async def _promote_delayed(self) -> None:
+		while not self._stopping.is_set():
+			try:
+				for queue in [*self.queues.values(), batch_queue]:
+					await queue.promote_due()
+			except Exception as e:
+				logger.exception(f"Erro ao reagendar jobs atrasados: {e}")
+			try:
+				await asyncio.wait_for(self._stopping.wait(), timeout=1)
+			except asyncio.TimeoutError:
+				pass
+
+
+async def main(concurrency: int, name: str, instances: List[str]) -> None:
+	unknown = [instance for instance in instances if instance not in evolution_clients]
+	if unknown:
+		raise SystemExit(f"Instâncias não configuradas em EVOLUTION_INSTANCES: {', '.join(unknown)}")
+	worker = Worker({instance: queue_for(instance) for instance in instances}, concurrency, name)
+
+	if settings.storage_backend == "local":
+		# Webhook/API gravam no disco deles; documentos da ingestão em lote não seriam encontrados aqui.
+		logger.warning(
+			f"⚠️ STORAGE_BACKEND=local ({settings.storage_local_path}): só funciona com API e workers "
+			"no mesmo host/volume; use STORAGE_BACKEND=s3 com mais de um processo"
+		)
+
+	# Reconstrói o índice de chaves de acesso se alguma gravação falhou e o invalidou.
+	async with job_session() as db:
+		await known_access_keys.warm(db)
+
+	setup_tracing("nf_bot_zap-worker", async_engine)
+	register_pool_collector(async_engine, evolution_clients.pool_clients)
+	if settings.worker_metrics_port:
+		start_http_server(settings.worker_metrics_port)
+		logger.info(f"📈 Métricas do worker em :{settings.worker_metrics_port}/metrics")
+
+	loop = asyncio.get_running_loop()
+	for sig in (signal.SIGINT, signal.SIGTERM):
+		loop.add_signal_handler(sig, worker.stop)
+
+	try:
+		await worker.run()
+	finally:
+		await evolution_clients.close()
+		shutdown_tracing()
+		await logger.complete()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Worker de processamento de notas fiscais")
+	parser.add_argument("--concurrency", type=int, default=settings.queue_worker_concurrency)
+	parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}")
+	parser.add_argument(
+		"--instances",
+		default=",".join(settings.worker_instances or evolution_clients.instances),
+		help="Instâncias da Evolution atendidas por este worker, separadas por vírgula (padrão: todas)",
+	)
+	args = parser.parse_args()
+
+	asyncio.run(main(args.concurrency, args.name, [i.strip() for i in args.instances.split(",") if i.strip()]))
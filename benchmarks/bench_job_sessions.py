@@ -0,0 +1,121 @@
+"""
+Teste de carga do ciclo de vida das sessões de banco nos jobs.
+
+Simula N notas processadas ao mesmo tempo, como no worker: cada job abre a sua
+`job_session()`, consulta a chave de acesso, solta a conexão durante a
+"extração" (um sleep) e persiste a nota com `upsert_note`. Parte dos jobs repete
+a chave de outro, exercitando o caminho de conflito/rollback em paralelo.
+
+Ao final verifica que nenhum job falhou e que todas as conexões voltaram ao pool.
+
+Uso (com o banco e o Redis do docker-compose no ar):
+	python -m benchmarks.bench_job_sessions [--jobs 150] [--extraction-ms 200]
+
+As notas criadas são removidas ao final.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import delete, select
+
+from app.db.session import async_engine, init_db, job_session
+from app.models.notes import Note
+from app.schemas.notes import ItemNoteBase, NoteCreate
+from app.services.notes_service import upsert_note
+from app.services.reports_service import bucket_of, refresh_buckets
+
+ISSUER_CNPJ = "00000000000191"
+
+
+def make_note(key: int) -> NoteCreate:
+	return NoteCreate(
+		note_type="NFE",
+		note_number=str(key),
+		access_key=f"{key:044d}",
+		issuer_cnpj=ISSUER_CNPJ,
+		provider="Benchmark LTDA",
+		date_of_issue=date.today(),
+		total_value=Decimal("10.00"),
+		pdf_url="",
+		extractor_stage="benchmark",
+		items=[
+			ItemNoteBase(product_name="Produto", quantity=Decimal("1"), unit_of_measure="UN", unit_value=Decimal("10.00")),
+		],
+	)
+
+
+class PoolWatcher:
+	def __init__(self) -> None:
+		self.peak_checked_out = 0
+		self._stop = asyncio.Event()
+
+	async def run(self) -> None:
+		while not self._stop.is_set():
+			self.peak_checked_out = max(self.peak_checked_out, async_engine.sync_engine.pool.checkedout())
+			await asyncio.sleep(0.005)
+
+	def stop(self) -> None:
+		self._stop.set()
+
+
+async def run_job(key: int, extraction_delay: float) -> bool:
+	note_in = make_note(key)
+	async with job_session() as db:
+		existing = await db.scalar(select(Note.id).where(Note.access_key == note_in.access_key))
+		if existing is not None:
+			return False
+		await db.rollback()
+		await asyncio.sleep(extraction_delay)
+		return (await upsert_note(note_in, db)).created
+
+
+async def cleanup() -> None:
+	async with job_session() as db:
+		await db.execute(delete(Note).where(Note.extractor_stage == "benchmark"))
+		await refresh_buckets(db, {bucket_of(ISSUER_CNPJ, date.today())})
+		await db.commit()
+
+
+async def main(jobs: int, extraction_ms: int) -> int:
+	await init_db()
+	await cleanup()
+
+	# Um terço dos jobs repete a chave de outro job.
+	keys = [10 ** 12 + (i if i % 3 else i // 3) for i in range(jobs)]
+	watcher = PoolWatcher()
+	watch_task = asyncio.create_task(watcher.run())
+
+	t0 = time.perf_counter()
+	results = await asyncio.gather(*(run_job(key, extraction_ms / 1000) for key in keys), return_exceptions=True)
+	elapsed = time.perf_counter() - t0
+	watcher.stop()
+	await watch_task
+
+	errors = [r for r in results if isinstance(r, BaseException)]
+	created = sum(1 for r in results if r is True)
+	pool = async_engine.sync_engine.pool
+	leaked = pool.checkedout()
+	print(f"{jobs} jobs em {elapsed:.2f}s | {created} notas criadas, {jobs - created - len(errors)} duplicadas")
+	print(f"pool: tamanho {pool.size()}, pico em uso {watcher.peak_checked_out}, em uso ao final {leaked}")
+	for error in errors[:5]:
+		print(f"erro: {error!r}")
+
+	expected = len(set(keys))
+	await cleanup()
+	await async_engine.dispose()
+
+	ok = not errors and leaked == 0 and created == expected
+	print("OK" if ok else f"FALHOU (esperadas {expected} notas criadas, {len(errors)} erros)")
+	return 0 if ok else 1
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--jobs", type=int, default=150)
+	parser.add_argument("--extraction-ms", type=int, default=200)
+	args = parser.parse_args()
+	sys.exit(asyncio.run(main(args.jobs, args.extraction_ms)))
@@ -0,0 +1,97 @@
+"""
+Microbenchmark da persistência de notas: ORM item a item vs. inserção em lote.
+
+Uso (com o banco do docker-compose no ar):
+	python -m benchmarks.bench_persist [--repeat 5]
+
+As notas criadas são removidas ao final de cada rodada.
+"""
+import argparse
+import asyncio
+import time
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import delete
+
+from app.db.session import AsyncSessionLocal, async_engine, init_db
+from app.models.notes import Note, ItemNote
+from app.schemas.notes import ItemNoteBase, NoteCreate
+from app.services.notes_service import upsert_note
+from app.services.reports_service import bucket_of, refresh_buckets
+
+SIZES = (10, 100, 1000)
+
+
+def make_note(n_items: int) -> NoteCreate:
+	return NoteCreate(
+		note_type="NFE",
+		note_number="1",
+		provider="Benchmark LTDA",
+		date_of_issue=date.today(),
+		total_value=Decimal("100.00"),
+		pdf_url="",
+		extractor_stage="benchmark",
+		items=[
+			ItemNoteBase(
+				product_name=f"Produto {i}",
+				product_code=str(i),
+				ncm="73181500",
+				cfop="5102",
+				icms_value=Decimal("1.80"),
+				quantity=Decimal("1"),
+				unit_of_measure="UN",
+				unit_value=Decimal("10.00"),
+			)
+			for i in range(n_items)
+		],
+	)
+
+
+async def persist_orm(note_in: NoteCreate) -> int:
+	"""Caminho anterior: cópia campo a campo para o ORM e `db.add` por item."""
+	async with AsyncSessionLocal() as db:
+		note = Note(**note_in.model_dump(exclude={"items"}))
+		db.add(note)
+		await db.flush()
+		for item_in in note_in.items:
+			db.add(ItemNote(note_id=note.id, **item_in.model_dump()))
+		await db.commit()
+		return note.id
+
+
+async def persist_bulk(note_in: NoteCreate) -> int:
+	async with AsyncSessionLocal() as db:
+		return (await upsert_note(note_in, db)).note_id
+
+
+async def cleanup() -> None:
+	async with AsyncSessionLocal() as db:
+		await db.execute(delete(Note).where(Note.extractor_stage == "benchmark"))
+		# As notas entraram nos relatórios pré-agregados; o bucket é recalculado sem elas.
+		await refresh_buckets(db, {bucket_of(None, date.today())})
+		await db.commit()
+
+
+async def main(repeat: int) -> None:
+	await init_db()
+	print(f"{'itens':>6} | {'caminho':>6} | {'melhor (ms)':>11} | {'linhas/s':>10}")
+	for size in SIZES:
+		note_in = make_note(size)
+		for label, persist in (("orm", persist_orm), ("bulk", persist_bulk)):
+			timings = []
+			for _ in range(repeat):
+				t0 = time.perf_counter()
+				await persist(note_in)
+				timings.append(time.perf_counter() - t0)
+				await cleanup()
+			best = min(timings)
+			print(f"{size:>6} | {label:>6} | {best * 1000:>11.1f} | {(size + 1) / best:>10.0f}")
+	await async_engine.dispose()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--repeat", type=int, default=5)
+	args = parser.parse_args()
+	asyncio.run(main(args.repeat))
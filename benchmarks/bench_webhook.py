@@ -0,0 +1,96 @@
+"""
+Vazão do webhook da Evolution, chamando a aplicação ASGI diretamente (sem rede
+nem client HTTP, para medir só o custo do servidor), com a mistura de eventos que
+uma instância real envia: presença, status de entrega, mensagens de texto e,
+raramente, documentos.
+
+Uso (com o Redis do docker-compose no ar, usado pelos documentos enfileirados):
+	python -m benchmarks.bench_webhook [--events 20000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import time
+
+import orjson
+
+from app.main import app
+
+JID = "5511999999999@s.whatsapp.net"
+
+
+def make_events(now: int) -> dict:
+	return {
+		"presence": {"event": "presence.update", "data": {"id": JID, "presences": {JID: {"lastKnownPresence": "composing"}}}},
+		"status": {"event": "messages.update", "data": {"keyId": "ABC", "remoteJid": JID, "status": "READ"}},
+		"text": {
+			"event": "messages.upsert",
+			"data": {"key": {"id": "T1", "remoteJid": JID}, "messageTimestamp": now, "message": {"conversation": "oi " * 50}},
+		},
+		"document": {
+			"event": "messages.upsert",
+			"data": {
+				"key": {"id": "D1", "remoteJid": JID},
+				"messageTimestamp": now,
+				"message": {"documentMessage": {"mimetype": "application/pdf", "fileName": "nota.pdf", "url": "https://mmg/x"}},
+			},
+		},
+	}
+
+
+# Proporção aproximada observada: a maioria dos eventos não é documento.
+MIX = ("presence",) * 5 + ("status",) * 3 + ("text",) + ("document",)
+
+
+async def call(body: bytes) -> int:
+	scope = {
+		"type": "http",
+		"asgi": {"version": "3.0"},
+		"http_version": "1.1",
+		"method": "POST",
+		"scheme": "http",
+		"path": "/api/v1/evolution/webhook",
+		"raw_path": b"/api/v1/evolution/webhook",
+		"root_path": "/api/v1",
+		"query_string": b"",
+		"headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+		"client": ("127.0.0.1", 0),
+		"server": ("bench", 80),
+	}
+	status = 0
+
+	async def receive() -> dict:
+		return {"type": "http.request", "body": body, "more_body": False}
+
+	async def send(message: dict) -> None:
+		nonlocal status
+		if message["type"] == "http.response.start":
+			status = message["status"]
+
+	await app(scope, receive, send)
+	return status
+
+
+async def main(total: int, concurrency: int) -> None:
+	bodies = {name: orjson.dumps(event) for name, event in make_events(int(time.time())).items()}
+	queue: asyncio.Queue = asyncio.Queue()
+	for i in range(total):
+		queue.put_nowait(bodies[MIX[i % len(MIX)]])
+
+	async def sender() -> None:
+		while not queue.empty():
+			status = await call(queue.get_nowait())
+			if status != 200:
+				raise RuntimeError(f"webhook respondeu {status}")
+
+	t0 = time.perf_counter()
+	await asyncio.gather(*(sender() for _ in range(concurrency)))
+	elapsed = time.perf_counter() - t0
+	print(f"{total} eventos em {elapsed:.2f}s: {total / elapsed:,.0f} eventos/s")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--events", type=int, default=20000)
+	parser.add_argument("--concurrency", type=int, default=50)
+	args = parser.parse_args()
+	asyncio.run(main(args.events, args.concurrency))